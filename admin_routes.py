@@ -273,9 +273,13 @@ def get_lead_details(user_id):
             if key in seen:
                 continue
             seen.add(key)
+            derivatives = g.get('derivatives') or {}
             images.append({
                 'id': key,
                 'image_url': g.get('image_url', ''),
+                # Grid-sized renditions; rows from before renditions existed fall back to the original
+                'thumbnail_url': derivatives.get('thumbnail') or g.get('image_url', ''),
+                'medium_url': derivatives.get('medium') or g.get('image_url', ''),
                 'room_type': g.get('room_type', 'N/A'),
                 'style': g.get('style', 'N/A'),
                 'created_at': g.get('created_at', ''),
@@ -4,7 +4,9 @@ import sys
 import io
 import base64
 import time
+import math
 import hashlib
+import json
 import logging
 import traceback
 import tempfile
@@ -12,27 +14,37 @@ import secrets
 import smtplib
 import threading
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta, timezone
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 # Third-party imports
 from dotenv import load_dotenv
 load_dotenv()
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file, redirect
 from flask_cors import CORS
 from openai import OpenAI
 from supabase import create_client, Client
-from PIL import Image
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
-import requests
+import http_client
 from Life_Echo import scenario_bp as Life_bp
 from virtual_tour import virtual_tour_bp 
 from admin_routes import admin_bp
 from activity_routes import activity_bp
 from ai_routes import ai_bp
 from news_routes import news_bp
+from replicate_webhooks import (
+    replicate_webhook_bp,
+    webhooks_enabled,
+    register_prediction,
+    wait_for_prediction,
+    discard_prediction,
+    REPLICATE_WEBHOOK_URL,
+    REPLICATE_WEBHOOK_DEADLINE,
+    TERMINAL_STATUSES
+)
 
 
 # ============================================================
@@ -51,6 +63,9 @@ logger = logging.getLogger(__name__)
 # IMPORT PROJECT MODULES - AFTER LOGGER
 # ============================================================
 from config import (
+    CLIENT_ROOM_IMAGES,
+    REPLICATE_MODEL,
+    MODEL_VERSION_PINS,
     INTERIOR_STYLES,
     FIXED_ROOM_LAYOUTS,
     ROOM_DESCRIPTIONS, 
@@ -58,17 +73,46 @@ from config import (
     THEME_ELEMENTS
 )
 from prompts import (
-    construct_prompt,
     construct_fixed_layout_prompt,
     construct_custom_theme_prompt,
     validate_inputs, 
     deconstruct_theme_to_realistic_elements,
-    get_short_prompt_for_cache
+    get_short_prompt_for_cache,
+    compile_prompt,
+    truncate_at_boundary,
+    cache_key_tokens,
+    normalize_cache_prompt,
+    PROMPT_CHAR_BUDGET
 )
 
 # ✅ ADD THESE 2 LINES SEPARATELY (AFTER the prompts import)
 from whatsapp_service import send_notification_to_user
 from scheduler import init_scheduler, start_scheduler, schedule_user_notification
+from design_cache import TieredDesignCache, create_cache_backend
+from single_flight import SingleFlight
+from generation_jobs import (
+    submit_job, get_job, get_job_stats, wait_for_job_update,
+    report_progress, progress_reporter, QueueFullError
+)
+from variant_pool import VariantPool, VARIANT_POOL_ENABLED, pool_keys
+from generation_history import GenerationHistory, GENERATION_HISTORY_ENABLED
+from background_tasks import submit_task, get_task_stats, install_signal_handlers
+from outbox import enqueue, register_handler, start_drainer, get_outbox_stats, requeue_dead
+from counters import CounterAggregator
+from model_versions import ModelVersionCache
+from prediction_poller import PredictionPoller, POLLER_TIMEOUT, POLLER_MAX_INTERVAL
+from circuit_breaker import CircuitBreaker
+from generation_scheduler import GenerationScheduler, AdmissionRejected
+from image_store import store_image, get_image, image_id_for, get_image_store_stats, set_image_location, get_image_location
+from prompt_index import PromptSimilarityIndex
+from derivatives import derivative_urls, get_derivative, schedule_derivatives, derivative_key, DERIVATIVE_SIZES
+from reference_images import (
+    build_reference_store,
+    sync_reference_uploads,
+    get_reference_base64,
+    get_reference_image_url,
+    get_reference_stats
+)
 
 # ============================================================
 # API CONFIGURATION - AFTER LOGGER
@@ -87,6 +131,22 @@ from scheduler import init_scheduler, start_scheduler, schedule_user_notificatio
 # Set your API key as environment variable: export REPLICATE_API_TOKEN="your_token"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 REPLICATE_API_TOKEN = os.getenv("REPLICATE_API_TOKEN")
+# Override to point at a local stub server when testing
+REPLICATE_API_BASE = os.getenv("REPLICATE_API_BASE", "https://api.replicate.com/v1").rstrip('/')
+# Upper bound for num_variants (outputs requested from a single prediction)
+MAX_VARIANTS = int(os.getenv("MAX_VARIANTS", "4"))
+# Upload chunk size for Cloudinary (their minimum for chunked uploads is 5MB)
+CLOUDINARY_CHUNK_SIZE = int(os.getenv("CLOUDINARY_CHUNK_SIZE", str(6 * 1024 * 1024)))
+# Prefix for /api/images/<id> URLs in responses (empty = relative to this API)
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip('/')
+# Old clients read image_base64 - set true to keep inlining it unless a request opts out
+INLINE_BASE64_DEFAULT = os.getenv("INLINE_BASE64_DEFAULT", "false").lower() == "true"
+# Past generations are fetched on the request path - give up quickly and generate instead
+HISTORY_FETCH_TIMEOUT = float(os.getenv("HISTORY_FETCH_TIMEOUT", "5"))
+# Seconds a polled prediction may sit in 'starting' before a second one is raced against it (0 = off)
+REPLICATE_HEDGE_AFTER = float(os.getenv("REPLICATE_HEDGE_AFTER", "0"))
+# While Replicate's circuit is open, custom themes may be answered by a looser cached match
+PROMPT_FALLBACK_THRESHOLD = float(os.getenv("PROMPT_FALLBACK_THRESHOLD", "0.4"))
 
 
 
@@ -119,8 +179,31 @@ EMAIL_FROM = os.getenv("EMAIL_FROM", EMAIL_USER)
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5177/")
 
 # Cache Settings
-CACHE_DURATION = 1800  # 30 minutes
-image_cache = {}
+CACHE_DURATION = int(os.getenv('DESIGN_CACHE_TTL', '1800'))  # 30 minutes
+image_cache = TieredDesignCache(backend=create_cache_backend(), ttl=CACHE_DURATION)
+image_cache.start_janitor()
+# Coalesces concurrent identical generations (same client + cache_prompt)
+generation_flights = SingleFlight('single_flight')
+# Near-duplicate custom themes ('Batman theme' / 'batman-themed' / 'batman at night') share cached designs
+prompt_index = PromptSimilarityIndex()
+
+
+def flush_generation_counters(deltas):
+    """One atomic RPC per flush instead of a select + update per generation"""
+    supabase.rpc('apply_counter_deltas', {
+        'p_client_deltas': deltas.get('client_generations', {}),
+        'p_user_deltas': deltas.get('user_generations', {})
+    }).execute()
+
+
+generation_counters = CounterAggregator(flush_generation_counters)
+if supabase:
+    generation_counters.start()
+
+# Past style-based generations on Cloudinary, reused after restarts instead of regenerating
+generation_history = GenerationHistory()
+if GENERATION_HISTORY_ENABLED and supabase:
+    generation_history.start(supabase)
 
 # Cloudinary Setup
 # Cloudinary Setup
@@ -130,12 +213,32 @@ cloudinary.config(
     api_secret = os.getenv("CLOUDINARY_API_SECRET")
 )
 
+# Reference images - transcode once at startup, never on the request path
+build_reference_store()
+# Host each reference once so predictions send a URL, not a data URI (non-blocking)
+submit_task('maintenance', sync_reference_uploads)
+# Finish queued uploads/emails on deploy instead of killing them mid-flight
+install_signal_handlers()
+
 # ============================================================
-# GLOBAL CACHE FOR MODEL VERSION - MUST BE HERE!
+# MODEL VERSION - refreshed in the background, never on a request
 # ============================================================
-_cached_model_version = None
-_version_cache_time = None
-VERSION_CACHE_DURATION = 3600  # 1 hour
+model_versions = ModelVersionCache(REPLICATE_API_BASE, REPLICATE_API_TOKEN, REPLICATE_MODEL, MODEL_VERSION_PINS)
+if REPLICATE_API_TOKEN:
+    model_versions.start()
+
+# Trips on Replicate error rate / latency so requests fail fast to fallbacks during an incident
+replicate_breaker = CircuitBreaker('replicate')
+
+# One poller thread for every in-flight prediction (replaces per-request 0.3s polling loops)
+prediction_poller = PredictionPoller(REPLICATE_API_BASE, REPLICATE_API_TOKEN, breaker=replicate_breaker)
+
+# Replicate slots by priority class (registered > anonymous > pre-warm), fair across clients
+generation_scheduler = GenerationScheduler()
+
+# Predictions raced against a slow-to-start one, and how often the race was won
+hedge_stats = {'hedged': 0, 'hedge_won': 0}
+hedge_stats_lock = threading.Lock()
 
 # ============================================================
 # FLASK APP INITIALIZATION
@@ -197,6 +300,7 @@ logger.info("[BLUEPRINT] Registering activity blueprint...")
 app.register_blueprint(activity_bp)
 logger.info("[BLUEPRINT] ✅ Activity Tracker Registered!")
 app.register_blueprint(ai_bp)
+app.register_blueprint(replicate_webhook_bp)
 # List all routes to verify
 with app.app_context():
     logger.info("[ROUTES] All registered routes:")
@@ -230,34 +334,40 @@ def timeout_decorator(seconds=120):
 
 
 def get_cached_image(prompt, client_name='default'):
-    """Check if we have a cached image for this prompt + client combo"""
+    """Check if we have a cached image for this prompt + client combo. Returns (metadata, image_bytes) or None."""
     cache_key = hashlib.md5(f"{client_name}:{prompt}".encode()).hexdigest()
-    if cache_key in image_cache:
-        cached_data, timestamp = image_cache[cache_key]
-        if time.time() - timestamp < CACHE_DURATION:
-            logger.info(f"[SUCCESS] Cache HIT for client={client_name}, prompt: {prompt[:50]}...")
-            return cached_data
-        else:
-            del image_cache[cache_key]
-            logger.info(f"[INFO] Cache EXPIRED for client={client_name}, prompt: {prompt[:50]}...")
+    cached = image_cache.get(cache_key)
+    if cached:
+        logger.info(f"[SUCCESS] Cache HIT for client={client_name}, prompt: {prompt[:50]}...")
+        return cached
     logger.info(f"[INFO] Cache MISS for client={client_name}, prompt: {prompt[:50]}...")
     return None
 
 
-def save_to_cache(prompt, image_data, client_name='default'):
-    """Save generated image to cache with client context"""
+def save_to_cache(prompt, metadata, image_bytes, client_name='default'):
+    """Save generated image to cache with client context (stored as raw bytes, not base64)"""
     cache_key = hashlib.md5(f"{client_name}:{prompt}".encode()).hexdigest()
-    image_cache[cache_key] = (image_data, time.time())
-    logger.info(f"[CACHE] Cached image for client={client_name}: {prompt[:50]}...")
-def save_generation_to_db(client_name, room_type, style, custom_prompt, generated_image_url, user_id=None, session_id=None):
+    if image_cache.set(cache_key, client_name, metadata, image_bytes):
+        logger.info(f"[CACHE] Cached image for client={client_name}: {prompt[:50]}...")
+def save_generation_to_db(client_name, room_type, style, custom_prompt, generated_image_url, user_id=None, session_id=None, generation_id=None, derivatives=None):
     """Save generation to Supabase only (MongoDB removed for performance)"""
     try:
         if not supabase or not generated_image_url:
             logger.warning("[DB] Supabase or image URL missing")
             return None
         
-        # Generate unique ID
-        generation_id = f"gen_{int(time.time())}_{secrets.token_hex(4)}"
+        if generation_id:
+            # Replayed outbox job - the row may already exist
+            existing = supabase.table('user_generations')\
+                .select('generation_id')\
+                .eq('generation_id', generation_id)\
+                .execute()
+            if existing.data:
+                logger.info(f"[DB] Generation {generation_id} already saved")
+                return generation_id
+        else:
+            # Generate unique ID
+            generation_id = f"gen_{int(time.time())}_{secrets.token_hex(4)}"
         
         # ✅ STEP 1: Save generation to user_generations
         user_gen_data = {
@@ -272,8 +382,20 @@ def save_generation_to_db(client_name, room_type, style, custom_prompt, generate
             'downloaded': False,
             'download_count': 0
         }
+        # Only sent when there is something to store, so inserts keep working on a
+        # database that has not run migrations/001_user_generations_derivatives.sql yet
+        if derivatives:
+            user_gen_data['derivatives'] = derivatives
         
-        result = supabase.table('user_generations').insert(user_gen_data).execute()
+        try:
+            result = supabase.table('user_generations').insert(user_gen_data).execute()
+        except Exception as e:
+            if 'derivatives' not in user_gen_data or 'derivatives' not in str(e):
+                raise
+            # Column missing (migration not applied) - keep the lead record, lose only the rendition URLs
+            logger.warning(f"[DB] derivatives column unavailable, saving without it: {e}")
+            del user_gen_data['derivatives']
+            result = supabase.table('user_generations').insert(user_gen_data).execute()
         
         if not result.data:
             logger.error(f"[DB] ❌ Failed to save generation")
@@ -281,36 +403,8 @@ def save_generation_to_db(client_name, room_type, style, custom_prompt, generate
         
         logger.info(f"[DB] ✅ Saved generation: {generation_id}")
         
-        # ✅ STEP 2: Update client statistics
-        try:
-            # Check if client exists
-            client_result = supabase.table('client_stats')\
-                .select('total_generations')\
-                .eq('client_name', client_name)\
-                .execute()
-            
-            if client_result.data:
-                # Client exists - increment
-                current_count = client_result.data[0]['total_generations']
-                supabase.table('client_stats')\
-                    .update({
-                        'total_generations': current_count + 1,
-                        'updated_at': datetime.now().isoformat()
-                    })\
-                    .eq('client_name', client_name)\
-                    .execute()
-                logger.info(f"[DB] ✅ Incremented {client_name}: {current_count} → {current_count + 1}")
-            else:
-                # Client doesn't exist - create new
-                supabase.table('client_stats').insert({
-                    'client_name': client_name,
-                    'total_generations': 1,
-                    'total_downloads': 0
-                }).execute()
-                logger.info(f"[DB] ✅ Created stats for client: {client_name}")
-                
-        except Exception as stats_error:
-            logger.warning(f"[DB] Could not update client stats: {stats_error}")
+        # ✅ STEP 2: Update client statistics (batched, flushed by generation_counters)
+        generation_counters.add('client_generations', client_name)
         
         return generation_id
         
@@ -320,13 +414,20 @@ def save_generation_to_db(client_name, room_type, style, custom_prompt, generate
         traceback.print_exc()
         return None
     
-def upload_to_cloudinary(image_base64, client_name, room_type):
-    """Upload generated image to Cloudinary"""
+def upload_to_cloudinary(image, client_name, room_type, public_id=None):
+    """
+    Upload generated image to Cloudinary (a fixed public_id makes retries idempotent).
+    image is raw bytes (streamed in chunks, never re-encoded) or a public URL that
+    Cloudinary fetches itself, so the bytes don't pass through us at all.
+    """
     try:
-        upload_result = cloudinary.uploader.upload(
-            f"data:image/png;base64,{image_base64}",
+        upload_result = cloudinary.uploader.upload_large(
+            image if isinstance(image, str) else io.BytesIO(image),
+            filename=room_type,
+            chunk_size=CLOUDINARY_CHUNK_SIZE,
             folder=f"generated/{client_name}",
-            public_id=f"{room_type}_{int(time.time())}",
+            public_id=public_id or f"{room_type}_{int(time.time())}",
+            overwrite=not public_id,
             resource_type="image"
         )
         
@@ -339,107 +440,18 @@ def upload_to_cloudinary(image_base64, client_name, room_type):
         return None
     
 def clean_expired_cache():
-    """Remove expired entries from cache"""
-    current_time = time.time()
-    expired_keys = [
-        key for key, (_, timestamp) in image_cache.items()
-        if current_time - timestamp >= CACHE_DURATION
-    ]
-    for key in expired_keys:
-        del image_cache[key]
-    if expired_keys:
-        logger.info(f"[CLEANUP] Cleaned {len(expired_keys)} expired cache entries")
-
-
-def optimize_prompt_for_gpt_image1(prompt, room_type):
-    """Pre-process prompt for GPT Image 1"""
-    replacements = {
-        "⚠️": "", "✅": "", "❌": "", "🔒": "", "🏗️": "", 
-        "🪑": "", "🎨": "", "📸": "", "🚫": "", "━": ""
-    }
-    for old, new in replacements.items():
-        prompt = prompt.replace(old, new)
-    
-    prompt = " ".join(prompt.split())
-    logger.info(f"[SUCCESS] Prompt optimized for GPT Image 1 (Length: {len(prompt)} chars)")
-    return prompt
+    """Remove expired entries from cache (the janitor thread also does this periodically)"""
+    removed = image_cache.purge_expired()
+    if removed:
+        logger.info(f"[CLEANUP] Cleaned {removed} expired cache entries")
 
 
 def load_reference_image(room_type, client_name='skyline'):
-    """Load and convert reference image to PNG format for OpenAI - WITH CLIENT SUPPORT"""
+    """Return the precompiled base64 PNG reference image for OpenAI/Replicate - WITH CLIENT SUPPORT"""
     try:
-        # Build client-specific path
-        if client_name and client_name != 'default':
-            # Client-specific images
-            base_dir = os.path.dirname(os.path.abspath(__file__))
-            
-            # Map room_type to actual filename based on client
-            if client_name == 'skyline':
-                filename_map = {
-                    'master_bedroom': 'skyline_bedroom.webp',
-                    'living_room': 'skyline_living_room.webp',
-                    'kitchen': 'skyline_kitchen.webp'
-                }
-            elif client_name == 'ellington':
-                filename_map = {
-                    'master_bedroom': 'ellington_bedroom.webp',
-                    'living_room': 'ellington_living_room.webp',
-                    'kitchen': 'ellington_kitchen.webp'
-                }
-            elif client_name == 'sothebys':
-                filename_map = {
-                'master_bedroom': 'sothebys_bedroom.webp',
-                'living_room': 'sothebys_living_room.webp',
-                'kitchen': 'sothebys_kitchen.webp'
-            }    
-            else:
-                logger.error(f"Unknown client: {client_name}")
-                return None
-            
-            filename = filename_map.get(room_type)
-            if not filename:
-                logger.error(f"No filename mapping for {room_type} in {client_name}")
-                return None
-            
-            image_path = os.path.join(base_dir, 'images', client_name, filename)
-            
-            if not os.path.exists(image_path):
-                logger.warning(f"Client image not found: {image_path}, falling back to default")
-                # Fallback to default
-                image_path = ROOM_IMAGES.get(room_type)
-        else:
-            # Default images (your current setup)
-            if room_type not in ROOM_IMAGES:
-                logger.error(f"No reference image found for {room_type}")
-                return None
-            image_path = ROOM_IMAGES[room_type]
-        
-        if not os.path.exists(image_path):
-            logger.error(f"Reference image not found at path: {image_path}")
-            return None
-        
-        logger.info(f"[INFO] Loading image from: {image_path} (Client: {client_name})")
-        
-        img = Image.open(image_path)
-        
-        # Convert RGBA to RGB if needed
-        if img.mode == 'RGBA':
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            background.paste(img, mask=img.split()[3])
-            img = background
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Save as PNG to bytes
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
-        image_data = img_byte_arr.read()
-        
-        # Convert to base64
-        image_base64 = base64.b64encode(image_data).decode('utf-8')
-        
-        logger.info(f"[SUCCESS] Loaded reference image for {room_type} - {client_name} ({len(image_data)} bytes)")
+        image_base64 = get_reference_base64(room_type, client_name)
+        if image_base64:
+            logger.info(f"[SUCCESS] Loaded reference image for {room_type} - {client_name} (precompiled)")
         return image_base64
         
     except Exception as e:
@@ -546,52 +558,127 @@ def send_welcome_email(full_name, email):
 # ============================================================
 
 
-def get_cached_model_version():
-    """Get model version with 1-hour caching - SAVES 1-2 SECONDS"""
-    global _cached_model_version, _version_cache_time
-    
-    current_time = time.time()
-    
-    # Return cached version if valid
-    if _cached_model_version and _version_cache_time:
-        if current_time - _version_cache_time < VERSION_CACHE_DURATION:
-            logger.info("[CACHE] Using cached model version ⚡")
-            return _cached_model_version
-    
-    # Fetch new version
-    logger.info("[API] Fetching model version...")
+def get_cached_model_version(flow='style'):
+    """Model version for a flow (pinned, or latest from the background refresher)"""
+    return model_versions.get(flow)
+
+
+CIRCUIT_OPEN = 'circuit_open'
+
+
+def replicate_headers():
+    return {
+        "Authorization": f"Token {REPLICATE_API_TOKEN}",
+        "Content-Type": "application/json"
+    }
+
+
+def create_prediction(prediction_payload):
+    """
+    POST a prediction through the circuit breaker.
+    Returns (prediction, None) or (None, error); error is CIRCUIT_OPEN when the breaker refused the call.
+    """
+    if not replicate_breaker.allow():
+        return None, CIRCUIT_OPEN
+
+    started = time.time()
     try:
-        model_response = requests.get(
-            "https://api.replicate.com/v1/models/adirik/interior-design",
-            headers={"Authorization": f"Token {REPLICATE_API_TOKEN}"},
-            timeout=15
+        response = http_client.post(
+            f"{REPLICATE_API_BASE}/predictions",
+            headers=replicate_headers(),
+            json=prediction_payload,
+            timeout=30
         )
-        
-        if model_response.status_code != 200:
-            # If cache exists, use stale cache
-            if _cached_model_version:
-                logger.warning("[CACHE] Using stale cache (fetch failed)")
-                return _cached_model_version
-            raise Exception(f"Model fetch failed: {model_response.status_code}")
-        
-        latest_version = model_response.json().get("latest_version", {}).get("id")
-        if not latest_version:
-            if _cached_model_version:
-                return _cached_model_version
-            raise Exception("No model version found")
-        
-        # Cache it
-        _cached_model_version = latest_version
-        _version_cache_time = current_time
-        
-        logger.info(f"[CACHE] Cached version: {latest_version[:16]}... ✅")
-        return latest_version
-        
     except Exception as e:
-        if _cached_model_version:
-            logger.warning(f"[CACHE] Using stale cache: {e}")
-            return _cached_model_version
-        raise
+        replicate_breaker.record(False, time.time() - started)
+        return None, str(e)
+
+    # 429/5xx mean Replicate is struggling; other 4xx are about our request
+    replicate_breaker.record(response.status_code < 500 and response.status_code != 429, time.time() - started)
+    if response.status_code != 201:
+        return None, response.text
+    return response.json(), None
+
+
+def cancel_prediction(prediction_id):
+    """Best effort - a prediction nobody is waiting for any more"""
+    try:
+        http_client.post(f"{REPLICATE_API_BASE}/predictions/{prediction_id}/cancel",
+                         headers=replicate_headers(), timeout=10)
+    except Exception as e:
+        logger.warning(f"[HEDGE] Could not cancel {prediction_id[:12]}: {e}")
+
+
+def fetch_prediction_status(prediction_id):
+    """Current status of a prediction from one GET, or None if Replicate did not answer"""
+    started = time.time()
+    try:
+        response = http_client.get(f"{REPLICATE_API_BASE}/predictions/{prediction_id}",
+                                   headers=replicate_headers(), timeout=10)
+    except Exception as e:
+        replicate_breaker.record(False, time.time() - started)
+        logger.warning(f"[HEDGE] Status check failed for {prediction_id[:12]}: {e}")
+        return None
+    replicate_breaker.record(response.status_code < 500 and response.status_code != 429, time.time() - started)
+    return response.json().get("status") if response.status_code == 200 else None
+
+
+def poll_prediction(prediction_id, flow_name, hedge_payload=None):
+    """
+    Wait for a prediction on the shared adaptive poller. Returns its payload, or None on timeout.
+
+    hedge_payload: when the prediction is still 'starting' after REPLICATE_HEDGE_AFTER
+    seconds (queued behind a cold start), create a second one from this payload; the
+    first to succeed is used and the other is cancelled.
+    """
+    report = progress_reporter()
+    started = threading.Event()  # left 'starting' (or finished)
+
+    def on_status(status):
+        if status != 'starting':
+            started.set()
+        report(prediction_status=status)
+
+    # The adaptive schedule is untouched, so a fast prediction returns as soon as it is done
+    primary = prediction_poller.watch(prediction_id, kind=flow_name, on_status=on_status)
+    primary.add_done_callback(lambda _: started.set())
+    futures = {primary: prediction_id}
+
+    # At the hedge age, one direct status check decides - the poller may not have looked yet
+    if hedge_payload and REPLICATE_HEDGE_AFTER > 0 and not started.wait(REPLICATE_HEDGE_AFTER) \
+            and fetch_prediction_status(prediction_id) == 'starting':
+        hedge, error = create_prediction(hedge_payload)
+        if hedge:
+            logger.info(f"[HEDGE] {prediction_id[:12]} not started after {REPLICATE_HEDGE_AFTER:.0f}s - racing {hedge['id'][:12]}")
+            futures[prediction_poller.watch(hedge['id'], kind=flow_name)] = hedge['id']
+            with hedge_stats_lock:
+                hedge_stats['hedged'] += 1
+        else:
+            logger.warning(f"[HEDGE] Could not create hedge prediction: {error[:200]}")
+
+    # The poller resolves every watch by POLLER_TIMEOUT; the margin only guards against a lost Future
+    winner, status_data = prediction_id, None
+    try:
+        for future in as_completed(futures, timeout=POLLER_TIMEOUT + 2 * POLLER_MAX_INTERVAL):
+            winner, status_data = futures[future], future.result()
+            if status_data and status_data.get("status") == "succeeded":
+                break
+    except FutureTimeoutError:
+        logger.error(f"[POLLER] ❌ No result for {prediction_id[:12]} after {POLLER_TIMEOUT:.0f}s - giving up")
+        winner, status_data = None, None
+
+    for future, other_id in futures.items():
+        if other_id != winner and not future.done():
+            cancel_prediction(other_id)
+    for other_id in futures.values():
+        discard_prediction(other_id)
+
+    if winner and winner != prediction_id:
+        logger.info(f"[HEDGE] ⚡ Hedge {winner[:12]} finished first")
+        report(prediction_id=winner)
+        with hedge_stats_lock:
+            hedge_stats['hedge_won'] += 1
+    return status_data
 
 
 # ============================================================
@@ -603,10 +690,18 @@ def generate_interior_design_unified(
     room_type="living_room",
     is_custom_theme=False,
     width=1024,
-    height=1024
+    height=1024,
+    reference_image_url=None,
+    num_outputs=1
 ):
     """
     UNIFIED: Single function for both flows
+
+    reference_image_url: hosted copy of the reference; sent instead of the
+    base64 data URI when available (much smaller prediction request)
+
+    num_outputs: variants to request from one prediction; all outputs are
+    downloaded concurrently and returned as raw bytes in images
     
     FLOW 1: Style-based (is_custom_theme=False)
     - Parameters: guidance_scale=10, prompt_strength=0.82, steps=28
@@ -624,9 +719,8 @@ def generate_interior_design_unified(
         logger.info(f"[{flow_name}] Starting generation for {room_type}...")
         start_time = time.time()
         
-        # Optimize prompt length
-        if len(prompt) > 800:
-            prompt = prompt[:800]
+        # Optimize prompt length (compiled prompts already fit - this only guards other callers)
+        prompt = truncate_at_boundary(prompt, PROMPT_CHAR_BUDGET)
         
         # Enhanced prompt based on flow
         if is_custom_theme:
@@ -645,7 +739,7 @@ def generate_interior_design_unified(
             )
         
         # Get cached model version (SAVES 1-2 SECONDS)
-        latest_version = get_cached_model_version()
+        latest_version = get_cached_model_version('custom' if is_custom_theme else 'style')
         
         logger.info(f"[{flow_name}] Creating prediction...")
         
@@ -662,96 +756,96 @@ def generate_interior_design_unified(
             num_inference_steps = 28  # Faster
         
         # Create prediction
-        prediction_response = requests.post(
-            "https://api.replicate.com/v1/predictions",
-            headers={
-                "Authorization": f"Token {REPLICATE_API_TOKEN}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "version": latest_version,
-                "input": {
-                    "image": f"data:image/png;base64,{reference_image_base64}",
-                    "prompt": enhanced_prompt,
-                    "negative_prompt": (
-                        "lowres, bad quality, watermark, text, logo, worst quality, "
-                        "low quality, blurry, pixelated, deformed, ugly" +
-                        (", boring, plain" if is_custom_theme else "")
-                    ),
-                    "guidance_scale": guidance_scale,
-                    "prompt_strength": prompt_strength,
-                    "num_inference_steps": num_inference_steps
-                }
-            },
-            timeout=30
-        )
-        
-        if prediction_response.status_code != 201:
-            return {"success": False, "error": prediction_response.text}
-        
-        prediction_id = prediction_response.json().get("id")
-        logger.info(f"[{flow_name}] Polling (ID: {prediction_id[:12]}...)...")
-        
-        # Fast polling - 0.5 second intervals
-        max_attempts = 200
-        attempt = 0
-        
-        while attempt < max_attempts:
-            time.sleep(0.3)
+        prediction_payload = {
+            "version": latest_version,
+            "input": {
+                "image": reference_image_url or f"data:image/png;base64,{reference_image_base64}",
+                "prompt": enhanced_prompt,
+                "negative_prompt": (
+                    "lowres, bad quality, watermark, text, logo, worst quality, "
+                    "low quality, blurry, pixelated, deformed, ugly" +
+                    (", boring, plain" if is_custom_theme else "")
+                ),
+                "guidance_scale": guidance_scale,
+                "prompt_strength": prompt_strength,
+                "num_inference_steps": num_inference_steps
+            }
+        }
+        if num_outputs > 1:
+            prediction_payload["input"]["num_outputs"] = num_outputs
+        use_webhook = webhooks_enabled()
+        if use_webhook:
+            prediction_payload["webhook"] = REPLICATE_WEBHOOK_URL
+            prediction_payload["webhook_events_filter"] = ["completed"]
+
+        prediction, error = create_prediction(prediction_payload)
+        if error == CIRCUIT_OPEN:
+            logger.warning(f"[{flow_name}] Replicate circuit open - not creating a prediction")
+            return {"success": False, "error": "Replicate is currently unavailable", "circuit_open": True}
+        if error:
+            return {"success": False, "error": error}
+        
+        prediction_id = prediction.get("id")
+        report_progress(prediction_id=prediction_id,
+                        prediction_status=prediction.get("status", "starting"))
+
+        # Webhook mode: sleep until Replicate calls us back, poll only as a fallback
+        status_data = None
+        if use_webhook:
+            logger.info(f"[{flow_name}] Waiting for webhook (ID: {prediction_id[:12]}...)...")
+            register_prediction(prediction_id)
+            status_data = wait_for_prediction(prediction_id, REPLICATE_WEBHOOK_DEADLINE)
+            if not status_data:
+                logger.warning(f"[{flow_name}] No webhook after {REPLICATE_WEBHOOK_DEADLINE:.0f}s - falling back to polling")
+
+        if not status_data:
+            logger.info(f"[{flow_name}] Polling (ID: {prediction_id[:12]}...)...")
+            # Only hedge while the prediction is young - not after a webhook deadline
+            status_data = poll_prediction(prediction_id, flow_name,
+                                          hedge_payload=None if use_webhook else prediction_payload)
+
+        if not status_data:
+            return {"success": False, "error": "Timeout after 75 seconds"}
+
+        status = status_data.get("status")
+
+        if status == "succeeded":
+            output = status_data.get("output")
+            if not output:
+                return {"success": False, "error": "No output"}
             
-            status_response = requests.get(
-                f"https://api.replicate.com/v1/predictions/{prediction_id}",
-                headers={"Authorization": f"Token {REPLICATE_API_TOKEN}"},
-                timeout=15
-            )
+            image_urls = (output if isinstance(output, list) else [output])[:num_outputs]
+            report_progress(prediction_status=status, output_urls=image_urls)
+            images = list(download_executor.map(download_image, image_urls))
+            if len(images) < num_outputs:
+                logger.warning(f"[{flow_name}] Model returned {len(images)} of {num_outputs} requested outputs")
             
-            status_data = status_response.json()
-            status = status_data.get("status")
+            generation_time = time.time() - start_time
             
-            # Reduced logging - only every 10 attempts (~5 seconds)
-            if attempt % 20 == 0 and attempt > 0:
-                elapsed = attempt * 0.3
-                logger.info(f"[{flow_name}] {status} (~{elapsed:.1f}s)")
+            logger.info(f"{'='*60}")
+            logger.info(f"[SUCCESS] ⚡ {flow_name}: {generation_time:.2f}s")
+            logger.info(f"{'='*60}")
             
-            if status == "succeeded":
-                output = status_data.get("output")
-                if not output:
-                    return {"success": False, "error": "No output"}
-                
-                image_url = output[0] if isinstance(output, list) else output
-                img_response = requests.get(image_url, timeout=30)
-                image_base64 = base64.b64encode(img_response.content).decode('utf-8')
-                
-                generation_time = time.time() - start_time
-                
-                logger.info(f"{'='*60}")
-                logger.info(f"[SUCCESS] ⚡ {flow_name}: {generation_time:.2f}s")
-                logger.info(f"{'='*60}")
-                
-                return {
-                    "success": True,
-                    "image_base64": image_base64,
-                    "model": "adirik/interior-design",
-                    "size": "1024x1024",
-                    "room_type": room_type,
-                    "method": f"unified_{'custom' if is_custom_theme else 'style'}",
-                    "generation_time": f"{generation_time:.2f}s",
-                    "flow": "FLOW 2" if is_custom_theme else "FLOW 1",
-                    "parameters": {
-                        "guidance_scale": guidance_scale,
-                        "prompt_strength": prompt_strength,
-                        "steps": num_inference_steps
-                    }
+            return {
+                "success": True,
+                "images": images,
+                "output_urls": image_urls,
+                "model": "adirik/interior-design",
+                "size": "1024x1024",
+                "room_type": room_type,
+                "method": f"unified_{'custom' if is_custom_theme else 'style'}",
+                "generation_time": f"{generation_time:.2f}s",
+                "flow": "FLOW 2" if is_custom_theme else "FLOW 1",
+                "parameters": {
+                    "guidance_scale": guidance_scale,
+                    "prompt_strength": prompt_strength,
+                    "steps": num_inference_steps
                 }
-            
-            elif status == "failed":
-                error = status_data.get("error", "Unknown error")
-                logger.error(f"[ERROR] {flow_name} failed: {error}")
-                return {"success": False, "error": error}
-            
-            attempt += 1
-        
-        return {"success": False, "error": "Timeout after 75 seconds"}
+            }
+
+        error = status_data.get("error") or f"Prediction {status}"
+        logger.error(f"[ERROR] {flow_name} failed: {error}")
+        return {"success": False, "error": error}
         
     except Exception as e:
         logger.error(f"[ERROR] {flow_name}: {str(e)}")
@@ -759,6 +853,17 @@ def generate_interior_design_unified(
         return {"success": False, "error": str(e)}
 
 
+# Output downloads for multi-variant predictions run side by side
+download_executor = ThreadPoolExecutor(max_workers=MAX_VARIANTS * 2, thread_name_prefix='download')
+
+
+def download_image(image_url):
+    """Fetch one prediction output as raw bytes"""
+    img_response = http_client.get(image_url, timeout=30)
+    img_response.raise_for_status()
+    return img_response.content
+
+
 # ============================================================
 # WRAPPER FUNCTIONS (KEEP YOUR EXISTING API INTACT)
 # ============================================================
@@ -776,7 +881,7 @@ def generate_with_gemini_flash_image(prompt, room_type, reference_image_base64):
     )
 
 
-def generate_with_openai_style_based(prompt, room_type, reference_image_base64, width=1024, height=1024):
+def generate_with_openai_style_based(prompt, room_type, reference_image_base64, width=1024, height=1024, reference_image_url=None, num_outputs=1):
     """
     FLOW 1 WRAPPER: Style-based generation
     Calls unified function with is_custom_theme=False
@@ -787,11 +892,13 @@ def generate_with_openai_style_based(prompt, room_type, reference_image_base64,
         room_type=room_type,
         is_custom_theme=False,
         width=width,
-        height=height
+        height=height,
+        reference_image_url=reference_image_url,
+        num_outputs=num_outputs
     )
 
 
-def generate_with_openai_custom_theme(prompt, reference_image_base64, width=1024, height=1024):
+def generate_with_openai_custom_theme(prompt, reference_image_base64, width=1024, height=1024, reference_image_url=None, num_outputs=1):
     """
     FLOW 2 WRAPPER: Custom theme generation
     Calls unified function with is_custom_theme=True
@@ -802,7 +909,9 @@ def generate_with_openai_custom_theme(prompt, reference_image_base64, width=1024
         room_type="custom",
         is_custom_theme=True,
         width=width,
-        height=height
+        height=height,
+        reference_image_url=reference_image_url,
+        num_outputs=num_outputs
     )
 
 
@@ -827,9 +936,26 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'replicate_configured': bool(REPLICATE_API_TOKEN),
+        'replicate_webhooks': webhooks_enabled(),
+        'model_version': model_versions.stats(),
+        'prediction_poller': prediction_poller.stats(),
+        'replicate_circuit': replicate_breaker.stats(),
+        'replicate_hedging': {**hedge_stats, 'hedge_after': REPLICATE_HEDGE_AFTER},
+        'generation_scheduler': generation_scheduler.stats(),
         'email_configured': bool(EMAIL_USER and EMAIL_PASSWORD),
         'supabase_configured': bool(supabase),
         'cache_entries': len(image_cache),
+        'cache': image_cache.stats(),
+        'image_store': get_image_store_stats(),
+        'prompt_index': prompt_index.stats(),
+        'single_flight': generation_flights.stats(),
+        'variant_pool': variant_pool.stats(),
+        'generation_history': generation_history.stats(),
+        'background_tasks': get_task_stats(),
+        'outbox': get_outbox_stats(),
+        'counters': generation_counters.stats(),
+        'generation_jobs': get_job_stats(),
+        'reference_images': get_reference_stats(),
         'available_models': ['adirik/interior-design'] if REPLICATE_API_TOKEN else []
     }), 200
 
@@ -943,10 +1069,9 @@ def simple_register():
             except Exception as e:
                 logger.warning(f"[SIMPLE_REGISTER] Failed to send welcome email: {e}")
         
-        # Start email thread in background
-        email_thread = threading.Thread(target=send_email_async, daemon=True)
-        email_thread.start()
-        logger.info(f"[SIMPLE_REGISTER] Email queued for background sending")
+        # Queue email on the background pool
+        if submit_task('email', send_email_async):
+            logger.info(f"[SIMPLE_REGISTER] Email queued for background sending")
         
         logger.info(f"[SIMPLE_REGISTER] Registration complete for {email}")
         
@@ -1009,99 +1134,293 @@ def check_user_status():
 # IMAGE GENERATION ROUTE - UPDATED WITH IMAGEN 3 SUPPORT
 # ============================================================
 
-@app.route('/api/generate-design', methods=['POST', 'OPTIONS'])
-@timeout_decorator(180)
-def generate_design():
-    """OPTIMIZED: Generate interior design in under 10 seconds"""
-    if request.method == 'OPTIONS':
-        return '', 204
+def validate_design_request(data):
+    """Return (error_body, status_code) for an invalid generation request, or None"""
+    if not data:
+        return {'error': 'No data provided'}, 400
+
+    client_name = data.get('client_name', 'skyline')
+    VALID_CLIENTS = ['skyline', 'ellington','sothebys']
+    if client_name not in VALID_CLIENTS:
+        return {'error': f'Invalid client. Must be one of: {VALID_CLIENTS}'}, 400
+
+    is_valid, message = validate_inputs(data.get('room_type'), data.get('style'), data.get('custom_prompt', '').strip())
+    if not is_valid:
+        return {'error': message}, 400
+
+    num_variants = data.get('num_variants', 1)
+    if not isinstance(num_variants, int) or isinstance(num_variants, bool) or not 1 <= num_variants <= MAX_VARIANTS:
+        return {'error': f'num_variants must be an integer between 1 and {MAX_VARIANTS}'}, 400
+
+    return None
+
+
+DEFAULT_WIDTH, DEFAULT_HEIGHT = 1024, 1024
+
+
+def design_params(data):
+    """Extract generation parameters (and the cache key) from a validated request"""
+    custom_prompt = data.get('custom_prompt', '').strip()
+    is_custom_theme = bool(custom_prompt)
+    room_type = data.get('room_type')
+    if is_custom_theme:
+        # Normalized (case, punctuation, stopwords, plurals) and per room - the reference image differs by room
+        cache_prompt = f"{room_type}_custom_{normalize_cache_prompt(custom_prompt)}"
+    else:
+        cache_prompt = f"{room_type}_{data.get('style')}"
+    return {
+        'room_type': data.get('room_type'),
+        'client_name': data.get('client_name', 'skyline'),
+        'style': data.get('style'),
+        'custom_prompt': custom_prompt,
+        'width': data.get('width', DEFAULT_WIDTH),
+        'height': data.get('height', DEFAULT_HEIGHT),
+        'is_custom_theme': is_custom_theme,
+        'num_variants': data.get('num_variants', 1),
+        'cache_prompt': cache_prompt,
+        'prompt_tokens': cache_key_tokens(custom_prompt) if is_custom_theme else (),
+        'priority': 'anonymous'  # upgraded by build_design_response once registration is verified
+    }
+
+
+# user_id -> (is_registered, checked_at); verdicts are cached so only generations pay for a lookup
+REGISTERED_USER_TTL = int(os.getenv('REGISTERED_USER_TTL', '3600'))
+UNREGISTERED_USER_TTL = int(os.getenv('UNREGISTERED_USER_TTL', '300'))
+registered_users = {}
+registered_users_lock = threading.Lock()
+
+
+def is_registered_user(user_id):
+    """Does user_id belong to a row in users? Unknown ids, malformed ids and lookup failures count as no."""
+    now = time.time()
+    with registered_users_lock:
+        cached = registered_users.get(user_id)
+    if cached and now - cached[1] < (REGISTERED_USER_TTL if cached[0] else UNREGISTERED_USER_TTL):
+        return cached[0]
+    if not supabase:
+        return False
 
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({'error': 'No data provided'}), 400
+        registered = bool(supabase.table('users').select('id').eq('id', user_id).limit(1).execute().data)
+    except Exception as e:
+        # Malformed UUIDs land here too - never grant priority on an unverified id
+        logger.warning(f"[SCHEDULER] Could not verify user {str(user_id)[:40]}: {e}")
+        registered = False
 
-        # Extract parameters
-        room_type = data.get('room_type')
-        client_name = data.get('client_name', 'skyline')
-        style = data.get('style')
-        custom_prompt = data.get('custom_prompt', '').strip()
-        width = data.get('width', 1024)
-        height = data.get('height', 1024)
+    with registered_users_lock:
+        if len(registered_users) > 10000:
+            registered_users.clear()
+        registered_users[user_id] = (registered, now)
+    return registered
+
+
+def generation_priority(data):
+    """Scheduler class: verified registered leads before anonymous sessions (pool refills use 'prewarm')"""
+    user_id = data.get('user_id')
+    return 'registered' if user_id and is_registered_user(str(user_id)) else 'anonymous'
+
+
+def run_design_generation(data):
+    """
+    Full generation pipeline shared by the sync route and async jobs.
+    Returns (body, status_code) - no Flask request context required.
+    Images are returned as URLs; base64 only when the request sets include_base64.
+    """
+    body, status_code = build_design_response(data)
+    if status_code == 200 and data and data.get('include_base64', INLINE_BASE64_DEFAULT):
+        body = inline_base64(body)
+    return body, status_code
+
+
+def build_design_response(data):
+    """Pool -> cache -> history -> (coalesced) fresh generation"""
+    try:
+        invalid = validate_design_request(data)
+        if invalid:
+            return invalid
+
+        params = design_params(data)
+        client_name = params['client_name']
+        cache_prompt = params['cache_prompt']
         logger.info(f"="*70)
-        logger.info(f"[REQUEST] Room: {room_type} | Style: {style} | Client: {client_name}")
+        logger.info(f"[REQUEST] Room: {params['room_type']} | Style: {params['style']} | Client: {client_name}")
         logger.info(f"="*70)
 
-        # Validate client
-        VALID_CLIENTS = ['skyline', 'ellington','sothebys']
-        if client_name not in VALID_CLIENTS:
-            return jsonify({'error': f'Invalid client. Must be one of: {VALID_CLIENTS}'}), 400
+        # Multi-variant requests always get a fresh batch from one prediction
+        if params['num_variants'] == 1:
+            # Style-based requests: hand out a pre-generated variant when one is ready
+            pooled = serve_pooled_design(data, params)
+            if pooled:
+                logger.info(f"[VARIANT POOL] ⚡ Served pre-generated variant")
+                return pooled
+
+            # ✅ FIX #1: CHECK CACHE FIRST (BEFORE GENERATION)
+            cached = serve_cached_design(params)
+            if cached:
+                return cached
+
+            # Reuse a previous generation of this room/style from Cloudinary
+            historical = serve_historical_design(data, params)
+            if historical:
+                logger.info(f"[HISTORY] ⚡ Answered from a previous generation")
+                return historical
+
+        # Identical requests already generating share that prediction's result. Priority is part
+        # of the key so a registered follower never waits (or gets rejected) at anonymous priority.
+        params['priority'] = generation_priority(data)
+        (body, status_code), shared = generation_flights.do(
+            (client_name, cache_prompt, params['num_variants'], params['priority']),
+            lambda: generate_uncached_design(data, params)
+        )
+        if shared:
+            body = {**body, 'coalesced': True}
 
-        # Validate inputs
-        is_valid, message = validate_inputs(room_type, style, custom_prompt)
-        if not is_valid:
-            return jsonify({'error': message}), 400
+        # Replicate's circuit is open: answer with something we already have rather than an error
+        if body.get('circuit_open'):
+            degraded = serve_degraded_design(data, params)
+            if degraded:
+                return degraded
+        return body, status_code
 
-        # ✅ FIX #1: CHECK CACHE FIRST (BEFORE GENERATION)
-        is_custom_theme = bool(custom_prompt)
-        cache_prompt = custom_prompt if is_custom_theme else f"{room_type}_{style}"
-        
-        cached_result = get_cached_image(cache_prompt, client_name)
-        if cached_result:
-            logger.info(f"[CACHE HIT] ⚡ Returning cached result instantly!")
-            return jsonify({
-                'success': True,
-                'cached': True,
-                'images': [cached_result],
-                'generation_time': '0.1s'
-            }), 200
+    except Exception as e:
+        logger.error(f"="*70)
+        logger.error(f"[FATAL ERROR] {str(e)}")
+        logger.error(f"="*70)
+        traceback.print_exc()
+        return {
+            'error': 'Internal server error',
+            'details': str(e)
+        }, 500
+
+
+def serve_cached_design(params, fuzzy_threshold=None):
+    """Cached image for the exact cache key (or, for custom themes, a near-duplicate prompt), or None"""
+    client_name = params['client_name']
+    cached_result = get_cached_image(params['cache_prompt'], client_name)
+    cache_match = (params['cache_prompt'], 'exact', 1.0)
+    if not cached_result and params['is_custom_theme']:
+        similar = find_similar_cached_design(params, fuzzy_threshold)
+        if similar:
+            cached_result, cache_match = similar
+    if not cached_result:
+        return None
 
-        # Load reference image
-        logger.info(f"[STEP 1/3] Loading reference image...")
-        reference_image = load_reference_image(room_type, client_name)
-        
-        if not reference_image:
-            return jsonify({
-                'error': f'Reference image not found for {room_type}',
-                'details': 'Reference image required'
-            }), 500
+    logger.info(f"[CACHE HIT] ⚡ Returning cached result instantly! ({cache_match[1]} match: {cache_match[0][:60]})")
+    return {
+        'success': True,
+        'cached': True,
+        'cache_key': cache_match[0],
+        'cache_match': cache_match[1],
+        'similarity': round(cache_match[2], 2),
+        'images': [present_image(*cached_result, client_name)],
+        'generation_time': '0.1s'
+    }, 200
 
-        # Build prompt
-        logger.info(f"[STEP 2/3] Building prompt...")
-        prompt_data = construct_prompt(room_type, style, custom_prompt)
-        if not prompt_data.get('success', True):
-            return jsonify({'error': prompt_data.get('error', 'Prompt failed')}), 400
-        
-        prompt = prompt_data['prompt']
-        prompt = optimize_prompt_for_gpt_image1(prompt, room_type)
 
-        # ✅ FIX #2: GENERATE IMAGE (FAST - 7-8 SECONDS)
-        logger.info(f"[STEP 3/3] Generating with Replicate...")
-        start_time = time.time()
-        
-        if is_custom_theme:
-            result = generate_with_openai_custom_theme(prompt, reference_image,width,height)
-        else:
-            result = generate_with_openai_style_based(prompt, room_type, reference_image,width,height)
+def serve_degraded_design(data, params):
+    """
+    Fallback while Replicate's circuit is open: a pooled, cached (custom themes: loosely
+    matched) or previously generated design, even for multi-variant requests. None if we have nothing.
+    """
+    fallback = (
+        serve_pooled_design(data, params)
+        or serve_cached_design(params, fuzzy_threshold=PROMPT_FALLBACK_THRESHOLD)
+        or serve_historical_design(data, params)
+    )
+    if not fallback:
+        return None
+    body, status_code = fallback
+    logger.warning(f"[BREAKER] ⚡ Replicate circuit open - served a fallback design")
+    return {**body, 'degraded': True, 'variants_requested': params['num_variants']}, status_code
 
-        if not result or not result.get('success'):
-            error_msg = result.get('error', 'Unknown error') if result else 'No result returned'
-            logger.error(f"[GENERATION FAILED] {error_msg}")
-            return jsonify({
-                'error': 'Generation failed',
-                'details': error_msg
-            }), 500
-        
-        generation_time = time.time() - start_time
-        logger.info(f"[SUCCESS] ✨ Generated in {generation_time:.2f}s")
 
-        # ✅ FIX #3: PREPARE RESPONSE IMMEDIATELY (NO BLOCKING)
-        image_base64 = result['image_base64']
-        
-        # Generate response
-        response_data = {
-            'id': int(time.time()),
-            'image_base64': image_base64,  # Keep for backward compatibility
+def find_similar_cached_design(params, threshold=None):
+    """Custom themes: ((metadata, image_bytes), (cache_key, 'fuzzy', similarity)) for a cached near-duplicate, or None"""
+    client_name, room_type = params['client_name'], params['room_type']
+    match = prompt_index.match(client_name, room_type, params['prompt_tokens'], threshold)
+    if not match:
+        return None
+    cache_key, similarity = match
+    cached = get_cached_image(cache_key, client_name)
+    if not cached:
+        prompt_index.discard(client_name, room_type, cache_key)  # expired from the cache
+        return None
+    # The exact key was already checked - even a same-token-set hit is a different prompt
+    return cached, (cache_key, 'fuzzy', similarity)
+
+
+def generate_design_images(params):
+    """
+    Reference image -> prompt -> Replicate (num_variants outputs from one prediction),
+    with no caching or side effects.
+    Returns ([(metadata, image_bytes), ...], prompt, None) or (None, None, (error_body, status_code)).
+    """
+    room_type = params['room_type']
+    client_name = params['client_name']
+    style = params['style']
+    custom_prompt = params['custom_prompt']
+    width = params['width']
+    height = params['height']
+    is_custom_theme = params['is_custom_theme']
+
+    # Load reference image
+    logger.info(f"[STEP 1/3] Loading reference image...")
+    reference_url = get_reference_image_url(room_type, client_name)
+    # The base64 data URI is only the fallback for references not hosted yet
+    reference_image = None if reference_url else load_reference_image(room_type, client_name)
+    
+    if not reference_image and not reference_url:
+        return None, None, ({
+            'error': f'Reference image not found for {room_type}',
+            'details': 'Reference image required'
+        }, 500)
+
+    # Precompiled for styles, memoized for custom themes - already normalized and within budget
+    logger.info(f"[STEP 2/3] Building prompt...")
+    prompt = compile_prompt(room_type, style, custom_prompt)
+
+    # ✅ FIX #2: GENERATE IMAGE (FAST - 7-8 SECONDS)
+    logger.info(f"[STEP 3/3] Generating with Replicate...")
+    start_time = time.time()
+    
+    num_variants = params['num_variants']
+    try:
+        with generation_scheduler.slot(client_name, params['priority']):
+            if is_custom_theme:
+                result = generate_with_openai_custom_theme(prompt, reference_image, width, height, reference_image_url=reference_url, num_outputs=num_variants)
+            else:
+                result = generate_with_openai_style_based(prompt, room_type, reference_image, width, height, reference_image_url=reference_url, num_outputs=num_variants)
+    except AdmissionRejected as e:
+        logger.warning(f"[SCHEDULER] ❌ Rejected {params['priority']} generation for {client_name}: {e}")
+        return None, None, ({
+            'error': 'Too many generations in progress',
+            'details': str(e),
+            'retry_after': e.retry_after
+        }, 429)
+
+    if result and result.get('circuit_open'):
+        return None, None, ({
+            'error': 'Generation temporarily unavailable',
+            'details': result['error'],
+            'circuit_open': True,
+            'retry_after': max(1, math.ceil(replicate_breaker.retry_after()))
+        }, 503)
+
+    if not result or not result.get('success'):
+        error_msg = result.get('error', 'Unknown error') if result else 'No result returned'
+        logger.error(f"[GENERATION FAILED] {error_msg}")
+        return None, None, ({
+            'error': 'Generation failed',
+            'details': error_msg
+        }, 500)
+    
+    generation_time = time.time() - start_time
+    logger.info(f"[SUCCESS] ✨ Generated in {generation_time:.2f}s")
+
+    base_id = int(time.time())
+    variants = [
+        ({
+            'id': base_id + index,
             'client_name': client_name,
             'room_type': room_type,
             'style': style if not is_custom_theme else 'custom',
@@ -1109,90 +1428,453 @@ def generate_design():
             'model_used': 'adirik/interior-design',
             'generation_method': result.get('method'),
             'resolution': f"{width}x{height}",
-            'generation_time': f"{generation_time:.2f}s"
-        }
+            'generation_time': f"{generation_time:.2f}s",
+            'source_url': source_url
+        }, image_bytes)
+        for index, (image_bytes, source_url) in enumerate(zip(result['images'], result['output_urls']))
+    ]
+    return variants, prompt, None
+
+
+def present_image(metadata, image_bytes, client_name):
+    """Response entry for an image: its metadata plus the URLs of it and its renditions (no base64)"""
+    image_id, created = store_image(image_bytes, client_name)
+    if created:
+        schedule_derivatives(image_id, image_bytes, client_name)
+    return {
+        **metadata,
+        'image_id': image_id,
+        'image_url': f"{PUBLIC_BASE_URL}/api/images/{image_id}",
+        'derivatives': derivative_urls(image_id, PUBLIC_BASE_URL)
+    }
 
-        # ✅ FIX #4: CACHE THE RESULT
-        save_to_cache(cache_prompt, response_data, client_name)
 
-        # ✅ FIX #5: DO CLOUDINARY + DATABASE IN BACKGROUND (NON-BLOCKING)
-        def background_upload():
-            """Upload to Cloudinary and save to DB in background"""
-            try:
-                # Upload to Cloudinary
-                cloudinary_url = upload_to_cloudinary(image_base64, client_name, room_type)
-                
-                if cloudinary_url:
-                    logger.info(f"[BACKGROUND] ✅ Uploaded to Cloudinary: {cloudinary_url}")
-                    
-                    # ✅ GET user_id and session_id from request data
-                    request_user_id = data.get('user_id')
-                    request_session_id = data.get('session_id')
-                    
-                    # Save to database
-                    save_generation_to_db(
-                        client_name=client_name,
-                        room_type=room_type,
-                        style=style if not is_custom_theme else 'custom',
-                        custom_prompt=custom_prompt if is_custom_theme else None,
-                        generated_image_url=cloudinary_url,
-                        user_id=request_user_id,
-                        session_id=request_session_id
-                    )
-                    logger.info(f"[BACKGROUND] ✅ Saved to database")
-
-                    # ✅ Update total_generations in users table
-                    if request_user_id:
-                        try:
-                            user_result = supabase.table('users')\
-                                .select('total_generations')\
-                                .eq('id', request_user_id)\
-                                .execute()
-                            if user_result.data:
-                                current = user_result.data[0]['total_generations'] or 0
-                                supabase.table('users')\
-                                    .update({'total_generations': current + 1})\
-                                    .eq('id', request_user_id)\
-                                    .execute()
-                                logger.info(f"[DB] ✅ Updated total_generations for {request_user_id}: {current} → {current + 1}")
-                        except Exception as e:
-                            logger.warning(f"[DB] Could not update total_generations: {e}")
-                else:
-                    logger.error(f"[BACKGROUND] ❌ Cloudinary upload failed")
-                        
-            except Exception as e:
-                logger.error(f"[BACKGROUND] ❌ Error: {e}")
+def inline_base64(body):
+    """Compatibility: add image_base64 to every image of a response body"""
+    images = []
+    for image in body.get('images', []):
+        stored = get_image(image['image_id'])
+        if stored:
+            image = {**image, 'image_base64': base64.b64encode(stored[0]).decode('ascii')}
+        images.append(image)
+    return {**body, 'images': images}
 
-        # Start background thread
-        upload_thread = threading.Thread(target=background_upload, daemon=True)
-        upload_thread.start()
-        logger.info(f"[BACKGROUND] 🚀 Upload thread started (non-blocking)")
 
-        # ✅ RETURN IMMEDIATELY - DON'T WAIT FOR UPLOADS
-        logger.info(f"="*70)
-        logger.info(f"[RESPONSE] ⚡ Returning to client after {generation_time:.2f}s")
-        logger.info(f"="*70)
+def schedule_generation_side_effects(data, params, image_bytes, source_url=None, cloudinary_url=None):
+    """
+    Durably queue Cloudinary upload + DB record + user counter for an image shown to a user.
+    source_url (the Replicate output) lets Cloudinary fetch the image itself; the bytes are the fallback.
+    cloudinary_url: the image is already on Cloudinary (reused past generation) - record it, no upload.
+    """
+    generation_id = f"gen_{int(time.time())}_{secrets.token_hex(4)}"
+    payload = {
+        'client_name': params['client_name'],
+        'room_type': params['room_type'],
+        'style': params['style'] if not params['is_custom_theme'] else 'custom',
+        'custom_prompt': params['custom_prompt'] if params['is_custom_theme'] else None,
+        'user_id': data.get('user_id'),
+        'session_id': data.get('session_id'),
+        'source_url': source_url,
+        'cloudinary_url': cloudinary_url
+    }
+    # Committed to the outbox before the response goes out, replayed if we crash
+    if enqueue('generation_side_effects', generation_id, payload, image_bytes):
+        logger.info(f"[BACKGROUND] 🚀 Upload queued (non-blocking): {generation_id}")
 
-        return jsonify({
-            'success': True,
-            'cached': False,
-            'images': [response_data],
-            'prompt_used': prompt[:300] + '...',
-            'generation_details': {
-                'model': 'adirik/interior-design',
-                'generation_time': f"{generation_time:.2f}s"
-            }
-        }), 200
 
+def upload_derivatives(job, client_name, room_type):
+    """Upload a WebP rendition per size as <job key>_<size>; returns {size: url} for what succeeded"""
+    image_id = image_id_for(job.blob)
+    uploaded = {}
+    for size in DERIVATIVE_SIZES:
+        try:
+            rendition = get_derivative(image_id, size, 'webp', job.blob, client_name)
+        except Exception as e:
+            logger.warning(f"[BACKGROUND] Could not render {size} rendition: {e}")
+            continue
+        if not rendition:
+            continue
+        url = upload_to_cloudinary(rendition, client_name, room_type, public_id=f"{job.key}_{size}")
+        if url:
+            uploaded[size] = url
+            set_image_location(derivative_key(image_id, size, 'webp'), url, client_name)
+    return uploaded
+
+
+def process_generation_side_effects(job):
+    """Outbox handler - each step is checkpointed so a retry resumes where it stopped"""
+    payload = job.payload
+    client_name = payload['client_name']
+    room_type = payload['room_type']
+    style = payload['style']
+    request_user_id = payload['user_id']
+
+    # Upload to Cloudinary (public_id = job key, so a replay never duplicates the asset)
+    cloudinary_url = job.progress.get('cloudinary_url') or payload.get('cloudinary_url')
+    if not cloudinary_url:
+        # Let Cloudinary pull the Replicate output; those URLs expire, so fall back to our copy
+        source_url = payload.get('source_url')
+        if source_url:
+            cloudinary_url = upload_to_cloudinary(source_url, client_name, room_type, public_id=job.key)
+        if not cloudinary_url:
+            cloudinary_url = upload_to_cloudinary(job.blob, client_name, room_type, public_id=job.key)
+        if not cloudinary_url:
+            raise RuntimeError('Cloudinary upload failed')
+        job.checkpoint('cloudinary_url', cloudinary_url)
+        logger.info(f"[BACKGROUND] ✅ Uploaded to Cloudinary: {cloudinary_url}")
+    if job.blob:
+        # /api/images/<id> redirects here once the image store has dropped the bytes
+        set_image_location(image_id_for(job.blob), cloudinary_url, client_name)
+
+    # Thumbnail/medium WebP next to the original (best effort - the admin grid falls back to the original)
+    derivatives = job.progress.get('derivatives')
+    if derivatives is None:
+        # Reused Cloudinary images carry no bytes - their row just points at the original
+        derivatives = upload_derivatives(job, client_name, room_type) if job.blob else {}
+        job.checkpoint('derivatives', derivatives)
+
+    if not supabase:
+        logger.warning("[BACKGROUND] Supabase not configured - skipping DB record")
+        return
+
+    # Save to database (generation_id = job key, checked before insert)
+    if not job.progress.get('db_saved'):
+        if not save_generation_to_db(
+            client_name=client_name,
+            room_type=room_type,
+            style=style,
+            custom_prompt=payload['custom_prompt'],
+            generated_image_url=cloudinary_url,
+            user_id=request_user_id,
+            session_id=payload['session_id'],
+            generation_id=job.key,
+            derivatives=derivatives
+        ):
+            raise RuntimeError('Saving user_generations row failed')
+        job.checkpoint('db_saved')
+        logger.info(f"[BACKGROUND] ✅ Saved to database")
+        if style != 'custom':
+            generation_history.add(client_name, room_type, style, cloudinary_url)
+
+    # ✅ Update total_generations in users table (batched, flushed by generation_counters)
+    if request_user_id and not job.progress.get('user_counted'):
+        generation_counters.add('user_generations', request_user_id)
+        job.checkpoint('user_counted')
+
+
+register_handler('generation_side_effects', process_generation_side_effects)
+# Replay side effects left unfinished by a previous process, then keep retrying failures
+start_drainer()
+
+
+def generate_uncached_design(data, params):
+    """Cache-miss path: generate -> cache -> background upload"""
+    variants, prompt, error = generate_design_images(params)
+    if error:
+        return error
+
+    client_name = params['client_name']
+    # ✅ FIX #4: CACHE THE RESULT (the first variant answers later single-variant requests)
+    save_to_cache(params['cache_prompt'], *variants[0], client_name)
+    if params['is_custom_theme']:
+        prompt_index.add(client_name, params['room_type'], params['cache_prompt'], params['prompt_tokens'])
+
+    # ✅ FIX #5: DO CLOUDINARY + DATABASE IN BACKGROUND (NON-BLOCKING) - every variant the user sees
+    for metadata, image_bytes in variants:
+        schedule_generation_side_effects(data, params, image_bytes, metadata['source_url'])
+
+    # ✅ RETURN IMMEDIATELY - DON'T WAIT FOR UPLOADS
+    generation_time = variants[0][0]['generation_time']
+    logger.info(f"="*70)
+    logger.info(f"[RESPONSE] ⚡ Returning to client after {generation_time}")
+    logger.info(f"="*70)
+
+    return {
+        'success': True,
+        'cached': False,
+        'images': [present_image(metadata, image_bytes, client_name) for metadata, image_bytes in variants],
+        'variants_requested': params['num_variants'],
+        'prompt_used': prompt[:300] + '...',
+        'generation_details': {
+            'model': 'adirik/interior-design',
+            'generation_time': generation_time
+        }
+    }, 200
+
+
+def serve_historical_design(data, params):
+    """Answer a style-based request with a past generation's Cloudinary image, or None"""
+    if params['is_custom_theme']:
+        return None
+    if (params['width'], params['height']) != (DEFAULT_WIDTH, DEFAULT_HEIGHT):
+        return None
+
+    client_name = params['client_name']
+    image_url = generation_history.lookup(client_name, params['room_type'], params['style'])
+    if not image_url:
+        return None
+
+    try:
+        image_response = http_client.get(image_url, timeout=HISTORY_FETCH_TIMEOUT)
+        image_response.raise_for_status()
     except Exception as e:
-        logger.error(f"="*70)
-        logger.error(f"[FATAL ERROR] {str(e)}")
-        logger.error(f"="*70)
-        traceback.print_exc()
-        return jsonify({
-            'error': 'Internal server error',
-            'details': str(e)
-        }), 500
+        logger.warning(f"[HISTORY] Could not fetch {image_url}: {e}")
+        return None
+
+    metadata = {
+        'id': int(time.time()),
+        'source_url': image_url,
+        'client_name': client_name,
+        'room_type': params['room_type'],
+        'style': params['style'],
+        'custom_theme': None,
+        'model_used': 'adirik/interior-design',
+        'generation_method': 'history',
+        'resolution': f"{DEFAULT_WIDTH}x{DEFAULT_HEIGHT}",
+        'generation_time': '0.1s'
+    }
+    save_to_cache(params['cache_prompt'], metadata, image_response.content, client_name)
+
+    # The lead saw this design, so it gets its user_generations row - pointing at the existing asset
+    schedule_generation_side_effects(data, params, None, cloudinary_url=image_url)
+
+    image = present_image(metadata, image_response.content, client_name)
+    set_image_location(image['image_id'], image_url, client_name)
+    return {
+        'success': True,
+        'cached': True,
+        'images': [image],
+        'generation_time': '0.1s'
+    }, 200
+
+
+def generate_pool_variants(key, count):
+    """VariantPool refill: count fresh style-based variants from one prediction, as [(metadata, image_bytes)]"""
+    client_name, room_type, style = key
+    params = design_params({'client_name': client_name, 'room_type': room_type, 'style': style, 'num_variants': count})
+    params['priority'] = 'prewarm'
+    variants, _, error = generate_design_images(params)
+    return [] if error else variants
+
+
+def serve_pooled_design(data, params):
+    """Serve a pre-generated variant for a style-based request, or None if the pool is empty"""
+    if params['is_custom_theme']:
+        return None
+    if (params['width'], params['height']) != (DEFAULT_WIDTH, DEFAULT_HEIGHT):
+        return None
+
+    variant = variant_pool.take((params['client_name'], params['room_type'], params['style']))
+    if not variant:
+        return None
+
+    metadata, image_bytes = variant
+    metadata = {**metadata, 'id': int(time.time())}
+
+    # Each variant goes to exactly one user, so record it like a fresh generation
+    schedule_generation_side_effects(data, params, image_bytes, metadata.get('source_url'))
+
+    return {
+        'success': True,
+        'cached': False,
+        'pooled': True,
+        'images': [present_image(metadata, image_bytes, params['client_name'])],
+        'generation_time': '0.1s'
+    }, 200
+
+
+# Pre-generated variants for style-based requests (off by default - refills spend Replicate credits)
+variant_pool = VariantPool(generate_pool_variants, pool_keys(CLIENT_ROOM_IMAGES, INTERIOR_STYLES))
+if VARIANT_POOL_ENABLED:
+    variant_pool.start()
+
+
+@app.route('/api/generate-design', methods=['POST', 'OPTIONS'])
+@timeout_decorator(180)
+def generate_design():
+    """OPTIMIZED: Generate interior design in under 10 seconds (synchronous wrapper)"""
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    body, status_code = run_design_generation(request.get_json(silent=True))
+    return json_response(body, status_code)
+
+
+def json_response(body, status_code):
+    """jsonify, plus a Retry-After header when an error body says when to come back"""
+    response = jsonify(body)
+    if status_code in (429, 503) and body.get('retry_after'):
+        response.headers['Retry-After'] = str(body['retry_after'])
+    return response, status_code
+
+
+@app.route('/api/generate-design/async', methods=['POST', 'OPTIONS'])
+def submit_generate_design():
+    """Queue a generation and return its job id immediately"""
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    data = request.get_json(silent=True)
+    invalid = validate_design_request(data)
+    if invalid:
+        body, status_code = invalid
+        return jsonify(body), status_code
+
+    # Turn the job away now if its priority class is already queued to the limit
+    try:
+        generation_scheduler.check(generation_priority(data))
+    except AdmissionRejected as e:
+        logger.warning(f"[SCHEDULER] ❌ Rejected async generation: {e}")
+        return json_response({'error': 'Too many generations in progress', 'details': str(e),
+                              'retry_after': e.retry_after}, 429)
+
+    try:
+        job_id = submit_job(run_design_generation, data)
+    except QueueFullError as e:
+        logger.warning(f"[JOBS] ❌ Rejected generation: {e}")
+        return jsonify({'error': str(e)}), 503
+
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f"/api/generate-design/{job_id}",
+        'events_url': f"/api/generate-design/{job_id}/events"
+    }), 202
+
+
+@app.route('/api/generate-design/<job_id>', methods=['GET'])
+def get_generate_design_job(job_id):
+    """Poll an async generation job for its state and result"""
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+
+    response = {
+        'success': job['status'] != 'failed',
+        'job_id': job_id,
+        'status': job['status'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at']
+    }
+    if job['status'] == 'succeeded':
+        response['result'] = job['result']
+    elif job['status'] == 'failed':
+        response['error'] = job['result'].get('error')
+        response['details'] = job['result'].get('details')
+
+    return jsonify(response), 200
+
+
+@app.route('/api/images/<image_id>', methods=['GET'])
+def get_generated_image(image_id):
+    """Serve a generated image; content-addressed, so clients may cache it forever"""
+    stored = get_image(image_id)
+    if not stored:
+        return redirect_to_image_location(image_id)
+
+    image_bytes, content_type = stored
+    return send_image(image_bytes, content_type, image_id)
+
+
+@app.route('/api/images/<image_id>/<rendition>', methods=['GET'])
+def get_generated_image_rendition(image_id, rendition):
+    """Serve a rendition such as thumbnail.webp, rendering it now if the imaging pool hasn't yet"""
+    size, _, fmt = rendition.partition('.')
+    image_bytes = get_derivative(image_id, size, fmt)
+    if not image_bytes:
+        # Only WebP renditions are uploaded - any other falls back to the original
+        if size in DERIVATIVE_SIZES and fmt == 'webp':
+            location = get_image_location(derivative_key(image_id, size, fmt))
+            if location:
+                return redirect(location)
+        return redirect_to_image_location(image_id)
+    return send_image(image_bytes, f"image/{fmt}", derivative_key(image_id, size, fmt))
+
+
+def redirect_to_image_location(image_id):
+    """The bytes have expired from the image store - send the client to the durable Cloudinary copy"""
+    location = get_image_location(image_id)
+    if not location:
+        return jsonify({'error': 'Image not found'}), 404
+    return redirect(location)
+
+
+def send_image(image_bytes, content_type, etag):
+    """Immutable, content-addressed image response: If-None-Match -> 304, Range -> 206"""
+    response = send_file(io.BytesIO(image_bytes), mimetype=content_type, etag=etag,
+                         conditional=True, max_age=31536000)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '5'))
+SSE_MAX_SECONDS = float(os.getenv('SSE_MAX_SECONDS', '300'))
+
+
+def job_state(job):
+    """Phase shown to SSE clients"""
+    if job['status'] != 'running':
+        return job['status']
+    # Replicate's own lifecycle (starting -> processing) once the prediction exists;
+    # the job itself only succeeds after the outputs are downloaded
+    state = job['progress'].get('prediction_status') or 'running'
+    return 'finishing' if state in TERMINAL_STATUSES else state
+
+
+def job_event(job_id, job):
+    """One SSE message for the job's current state"""
+    progress = job['progress']
+    state = job_state(job)
+    data = {
+        'job_id': job_id,
+        'status': state,
+        'elapsed': round(time.time() - job['created_at'], 1),
+        'queue_position': job['queue_position'],
+        'prediction_id': progress.get('prediction_id')
+    }
+    if job['status'] == 'succeeded':
+        data['result_url'] = f"/api/generate-design/{job_id}"
+        # Our durable /api/images URLs - set for cached, pooled and coalesced results too
+        data['image_urls'] = [image['image_url'] for image in (job['result'] or {}).get('images', [])]
+    elif job['status'] == 'failed':
+        data['error'] = job['result'].get('error')
+        data['details'] = job['result'].get('details')
+
+    return f"id: {job['version']}\nevent: {state}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route('/api/generate-design/<job_id>/events', methods=['GET'])
+def stream_generate_design_job(job_id):
+    """Server-Sent Events: one event per phase change, re-sent every SSE_HEARTBEAT_SECONDS with elapsed time"""
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def events():
+        current = job
+        deadline = time.time() + SSE_MAX_SECONDS
+        sent, sent_at = None, 0.0
+        yield "retry: 3000\n\n"
+        while True:
+            # Other job updates (e.g. progress details) don't change what the client sees
+            phase = (job_state(current), current['queue_position'])
+            if phase != sent or time.time() - sent_at >= SSE_HEARTBEAT_SECONDS:
+                yield job_event(job_id, current)
+                sent, sent_at = phase, time.time()
+            if current['status'] in ('succeeded', 'failed') or time.time() >= deadline:
+                return
+            wait = max(0.0, sent_at + SSE_HEARTBEAT_SECONDS - time.time())
+            current = wait_for_job_update(job_id, current['version'], wait)
+            if not current:
+                return
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # don't let a proxy buffer the stream
+    })
 
 
 # ============================================================
@@ -1317,6 +1999,10 @@ def increment_generation():
                 'last_activity': datetime.now().isoformat()
             }).eq('session_id', session_id).execute()
             
+            # Request context is gone by the time the task runs - capture it now
+            ip_address = request.remote_addr
+            user_agent = request.headers.get('User-Agent', '')
+
             # ✅ MOVE THIS TO BACKGROUND THREAD
             def log_generation_async():
                 try:
@@ -1329,16 +2015,16 @@ def increment_generation():
                         'custom_prompt': data.get('custom_prompt'),
                         'generation_number': new_count,
                         'was_registered': session_result.data[0].get('is_registered', False),
-                        'ip_address': request.remote_addr,
-                        'user_agent': request.headers.get('User-Agent', '')
+                        'ip_address': ip_address,
+                        'user_agent': user_agent
                     }
                     supabase.table('generation_logs').insert(log_data).execute()
                     logger.info(f"[BACKGROUND] ✅ Logged generation #{new_count}")
                 except Exception as e:
                     logger.error(f"[BACKGROUND] ❌ Log error: {e}")
             
-            # Start background thread
-            threading.Thread(target=log_generation_async, daemon=True).start()
+            # Queue on the background logging pool
+            submit_task('logging', log_generation_async)
             
             # ✅ RETURN IMMEDIATELY
             return jsonify({
@@ -1363,14 +2049,24 @@ def increment_generation():
 @app.route('/api/cache/clear', methods=['POST'])
 def clear_cache():
     """Clear all cached images"""
-    cache_count = len(image_cache)
-    image_cache.clear()
+    cache_count = image_cache.clear()
     logger.info(f"[CLEANUP] Manually cleared {cache_count} cache entries")
     return jsonify({
         'success': True,
         'message': f'Cleared {cache_count} cached images'
     }), 200
 
+
+@app.route('/api/outbox/requeue', methods=['POST'])
+def requeue_outbox():
+    """Retry dead side-effect jobs (body: optional {"keys": [...]}) once Supabase/Cloudinary are healthy again"""
+    data = request.get_json(silent=True) or {}
+    requeued = requeue_dead(data.get('keys'))
+    return jsonify({
+        'success': True,
+        'message': f'Requeued {requeued} dead job(s)'
+    }), 200
+
 # ============================================================
 # DEBUG ENDPOINTS - Add after /api/cache/clear
 # ============================================================
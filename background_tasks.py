@@ -0,0 +1,189 @@
+"""
+background_tasks.py — Shared bounded executor for fire-and-forget work
+Replaces one-daemon-thread-per-request spawns (uploads, emails, logging)
+with a fixed worker pool per task class. Each class has a bounded backlog:
+submit_task() waits briefly for room and otherwise rejects, so thread count
+stays flat under load. Queued and running tasks are drained on SIGTERM/exit
+instead of being killed mid-upload.
+"""
+
+import os
+import time
+import atexit
+import signal
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# task class -> worker count
+TASK_CLASS_WORKERS = {
+    'upload': int(os.getenv('BACKGROUND_UPLOAD_WORKERS', '4')),
+    'email': int(os.getenv('BACKGROUND_EMAIL_WORKERS', '2')),
+    'logging': int(os.getenv('BACKGROUND_LOGGING_WORKERS', '2')),
+    'maintenance': int(os.getenv('BACKGROUND_MAINTENANCE_WORKERS', '1')),
+    'imaging': int(os.getenv('BACKGROUND_IMAGING_WORKERS', '2')),
+}
+BACKGROUND_QUEUE_LIMIT = int(os.getenv('BACKGROUND_QUEUE_LIMIT', '200'))  # waiting tasks per class
+BACKGROUND_SUBMIT_TIMEOUT = float(os.getenv('BACKGROUND_SUBMIT_TIMEOUT', '2'))
+BACKGROUND_DRAIN_TIMEOUT = float(os.getenv('BACKGROUND_DRAIN_TIMEOUT', '25'))  # keep under gunicorn graceful_timeout
+LATENCY_SAMPLES = 500
+
+
+class _TaskClass:
+    """One worker pool + backlog bound + metrics"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=f"bg-{name}")
+        self.workers = max(1, workers)
+        self.slots = threading.BoundedSemaphore(self.workers + BACKGROUND_QUEUE_LIMIT)
+        self.futures = set()
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.counts = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+        self.wait_times = deque(maxlen=LATENCY_SAMPLES)
+        self.run_times = deque(maxlen=LATENCY_SAMPLES)
+
+    def _run(self, label, fn, args, kwargs, submitted_at):
+        started_at = time.time()
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_times.append(started_at - submitted_at)
+
+        try:
+            fn(*args, **kwargs)
+            outcome = 'completed'
+        except Exception as e:
+            outcome = 'failed'
+            logger.error(f"[TASKS] ❌ {self.name}/{label} failed: {e}")
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.counts[outcome] += 1
+                self.run_times.append(time.time() - started_at)
+            self.slots.release()
+
+    def submit(self, label, fn, args, kwargs, timeout):
+        if not self.slots.acquire(timeout=timeout):
+            with self.lock:
+                self.counts['rejected'] += 1
+            logger.error(f"[TASKS] ❌ {self.name} backlog full - dropped {label}")
+            return False
+
+        with self.lock:
+            self.queued += 1
+            self.counts['submitted'] += 1
+        try:
+            future = self.executor.submit(self._run, label, fn, args, kwargs, time.time())
+        except RuntimeError:
+            # Executor already shut down (process is exiting)
+            with self.lock:
+                self.queued -= 1
+                self.counts['rejected'] += 1
+            self.slots.release()
+            logger.error(f"[TASKS] ❌ {self.name} is shut down - dropped {label}")
+            return False
+
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(self._forget)
+        return True
+
+    def _forget(self, future):
+        with self.lock:
+            self.futures.discard(future)
+
+    def stats(self):
+        with self.lock:
+            return {
+                **self.counts,
+                'workers': self.workers,
+                'queued': self.queued,
+                'running': self.running,
+                'wait_ms': _latency_summary(self.wait_times),
+                'run_ms': _latency_summary(self.run_times)
+            }
+
+
+def _latency_summary(samples):
+    """avg / p95 / max in milliseconds over the recent samples"""
+    if not samples:
+        return {'avg': 0, 'p95': 0, 'max': 0}
+    ordered = sorted(samples)
+    return {
+        'avg': round(sum(ordered) / len(ordered) * 1000, 1),
+        'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+        'max': round(ordered[-1] * 1000, 1)
+    }
+
+
+_classes = {name: _TaskClass(name, workers) for name, workers in TASK_CLASS_WORKERS.items()}
+_draining = threading.Event()
+
+
+def submit_task(task_class, fn, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) on the task class's pool.
+    Waits up to BACKGROUND_SUBMIT_TIMEOUT for backlog room; returns False if the task was dropped.
+    """
+    if _draining.is_set():
+        logger.error(f"[TASKS] ❌ Shutting down - dropped {task_class}/{fn.__name__}")
+        return False
+    return _classes[task_class].submit(fn.__name__, fn, args, kwargs, BACKGROUND_SUBMIT_TIMEOUT)
+
+
+def get_task_stats():
+    """Per-class counters, backlog and latency for the health endpoint"""
+    return {name: task_class.stats() for name, task_class in _classes.items()}
+
+
+def drain(timeout=BACKGROUND_DRAIN_TIMEOUT):
+    """Stop accepting work and wait up to timeout for queued/running tasks. Returns tasks left unfinished."""
+    if _draining.is_set():
+        return 0
+    _draining.set()
+
+    pending = set()
+    for task_class in _classes.values():
+        with task_class.lock:
+            pending |= task_class.futures
+    if pending:
+        logger.info(f"[TASKS] Draining {len(pending)} background task(s)...")
+    _, not_done = wait(pending, timeout=timeout)
+
+    for task_class in _classes.values():
+        task_class.executor.shutdown(wait=False, cancel_futures=True)
+
+    if not_done:
+        logger.error(f"[TASKS] ❌ {len(not_done)} background task(s) unfinished after {timeout}s")
+    elif pending:
+        logger.info(f"[TASKS] ✅ Background tasks drained")
+    return len(not_done)
+
+
+def install_signal_handlers():
+    """
+    Make SIGTERM exit cleanly so the atexit drain runs. The drain never runs inside the
+    handler: gunicorn's handler (if any) goes first and finishes in-flight requests, and
+    blocking here would eat its graceful-shutdown timeout.
+    """
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def handle_sigterm(signum, frame):
+            if callable(previous):
+                previous(signum, frame)  # gunicorn: stop accepting, finish requests, then exit -> atexit drain
+            elif previous != signal.SIG_IGN:
+                raise SystemExit(0)  # plain process: unwind, atexit drains
+
+        signal.signal(signal.SIGTERM, handle_sigterm)
+    except ValueError:
+        # Not on the main thread (e.g. imported by a test runner thread) - atexit still drains
+        logger.warning("[TASKS] Could not install SIGTERM handler outside the main thread")
+
+    atexit.register(drain)
@@ -0,0 +1,156 @@
+"""
+circuit_breaker.py — Fail fast while an upstream API is degraded
+Calls report their outcome and duration. Over a sliding window, when enough
+calls fail (BREAKER_ERROR_RATE) or run slow (BREAKER_SLOW_RATE) the breaker
+opens: allow() returns False for BREAKER_OPEN_SECONDS, so requests are
+answered from fallbacks instead of each waiting out the upstream timeouts.
+After that it goes half-open and lets a few probe calls through; their
+outcome closes it again or re-opens it.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+BREAKER_WINDOW_SECONDS = float(os.getenv('BREAKER_WINDOW_SECONDS', '60'))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '10'))
+BREAKER_ERROR_RATE = float(os.getenv('BREAKER_ERROR_RATE', '0.5'))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '10'))
+BREAKER_SLOW_RATE = float(os.getenv('BREAKER_SLOW_RATE', '0.8'))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '30'))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv('BREAKER_HALF_OPEN_PROBES', '2'))
+TRANSITION_HISTORY = 20
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class CircuitBreaker:
+    """Sliding-window error/latency breaker with half-open probing"""
+
+    def __init__(self, name, window=BREAKER_WINDOW_SECONDS, min_calls=BREAKER_MIN_CALLS,
+                 error_rate=BREAKER_ERROR_RATE, slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+                 slow_rate=BREAKER_SLOW_RATE, open_seconds=BREAKER_OPEN_SECONDS,
+                 half_open_probes=BREAKER_HALF_OPEN_PROBES):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._calls = deque()  # (timestamp, ok, slow)
+        self._transitions = deque(maxlen=TRANSITION_HISTORY)
+        self._lock = threading.Lock()
+        self._stats = {'rejected': 0, 'opened': 0}
+
+    # ── internal (caller holds the lock) ────────────────────
+
+    def _transition(self, state, reason):
+        logger.warning(f"[BREAKER] {self.name}: {self._state} -> {state} ({reason})")
+        self._transitions.append({'at': time.time(), 'from': self._state, 'to': state, 'reason': reason})
+        self._state = state
+        if state == OPEN:
+            self._opened_at = time.time()
+            self._stats['opened'] += 1
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        if state == CLOSED:
+            self._calls.clear()
+
+    def _trim(self, now):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def _refresh(self, now):
+        """Open -> half-open once the cool-down has passed"""
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN, f"cool-down of {self.open_seconds:.0f}s elapsed")
+
+    def _rates(self):
+        total = len(self._calls)
+        if not total:
+            return 0.0, 0.0
+        failures = sum(1 for _, ok, _ in self._calls if not ok)
+        slow = sum(1 for _, _, is_slow in self._calls if is_slow)
+        return failures / total, slow / total
+
+    # ── public ──────────────────────────────────────────────
+
+    def allow(self):
+        """May a call go upstream now? In half-open only BREAKER_HALF_OPEN_PROBES at a time."""
+        with self._lock:
+            self._refresh(time.time())
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes_in_flight < self.half_open_probes:
+                self._probes_in_flight += 1
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def record(self, ok, duration=0.0):
+        """Report a call's outcome; may trip or reset the breaker"""
+        now = time.time()
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            self._refresh(now)
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if not ok or slow:
+                    self._transition(OPEN, 'probe failed' if not ok else f"probe took {duration:.1f}s")
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_probes:
+                        self._transition(CLOSED, f"{self._probe_successes} probe(s) succeeded")
+                return
+            if self._state == OPEN:
+                return  # a call that started before the breaker opened
+
+            self._calls.append((now, ok, slow))
+            self._trim(now)
+            if len(self._calls) < self.min_calls:
+                return
+            error_rate, slow_rate = self._rates()
+            if error_rate >= self.error_rate:
+                self._transition(OPEN, f"error rate {error_rate:.0%} over {len(self._calls)} calls")
+            elif slow_rate >= self.slow_rate:
+                self._transition(OPEN, f"{slow_rate:.0%} of {len(self._calls)} calls slower than {self.slow_call_seconds:.0f}s")
+
+    def retry_after(self):
+        """Seconds until the breaker will let probes through again (0 when not open)"""
+        with self._lock:
+            if self._state != OPEN:
+                return 0
+            return max(0.0, self.open_seconds - (time.time() - self._opened_at))
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh(time.time())
+            return self._state
+
+    def stats(self):
+        with self._lock:
+            now = time.time()
+            self._refresh(now)
+            self._trim(now)
+            error_rate, slow_rate = self._rates()
+            return {
+                **self._stats,
+                'state': self._state,
+                'window_calls': len(self._calls),
+                'error_rate': round(error_rate, 2),
+                'slow_rate': round(slow_rate, 2),
+                'retry_after': round(max(0.0, self.open_seconds - (now - self._opened_at)), 1)
+                if self._state == OPEN else 0,
+                'transitions': list(self._transitions)
+            }
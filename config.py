@@ -5,6 +5,14 @@ load_dotenv()
 
 # FAL API Configuration
 
+# Replicate model used by both generation flows. A pinned version (per flow)
+# is used as-is; unset flows follow the model's latest version.
+REPLICATE_MODEL = os.getenv('REPLICATE_MODEL', 'adirik/interior-design')
+MODEL_VERSION_PINS = {
+    'style': os.getenv('REPLICATE_VERSION_STYLE') or None,
+    'custom': os.getenv('REPLICATE_VERSION_CUSTOM') or None,
+}
+
 # Paths to reference room images - CORRECTED PATHS
 ROOM_IMAGES = {
     'master_bedroom': 'images/MADHUBANbedroom.webp',
@@ -19,6 +27,25 @@ ROOM_IMAGES = {
     'living_room': os.path.join(BASE_DIR, 'images', 'madhubanlivingroom3.webp'),
     'kitchen': os.path.join(BASE_DIR, 'images', 'madhubankitchen.webp'),
 }
+
+# Client-specific reference images (images/<client>/<filename>)
+CLIENT_ROOM_IMAGES = {
+    'skyline': {
+        'master_bedroom': 'skyline_bedroom.webp',
+        'living_room': 'skyline_living_room.webp',
+        'kitchen': 'skyline_kitchen.webp'
+    },
+    'ellington': {
+        'master_bedroom': 'ellington_bedroom.webp',
+        'living_room': 'ellington_living_room.webp',
+        'kitchen': 'ellington_kitchen.webp'
+    },
+    'sothebys': {
+        'master_bedroom': 'sothebys_bedroom.webp',
+        'living_room': 'sothebys_living_room.webp',
+        'kitchen': 'sothebys_kitchen.webp'
+    }
+}
 """
 🎯 FIXED LAYOUT SYSTEM FOR CONSISTENT GENERATION
 Only theme, colors, textures, and decorative elements change.
@@ -0,0 +1,124 @@
+"""
+counters.py — Write-behind aggregation for DB counters
+Counters like client_stats.total_generations and users.total_generations were
+updated with a select + update per image, which costs two round trips and
+loses increments when two generations race. Here increments only touch an
+in-memory dict; a flusher thread sends the accumulated deltas every
+COUNTER_FLUSH_INTERVAL seconds as one atomic-increment RPC (see
+apply_counter_deltas in data.sql / migrations/). Failed flushes keep their
+deltas for the next attempt, and pending deltas are flushed at exit. After
+COUNTER_ALERT_FAILURES failures in a row every failure is logged as an alert;
+after COUNTER_MAX_FAILED_FLUSHES the pending deltas are logged and dropped
+instead of being retried forever.
+"""
+
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FLUSH_INTERVAL = float(os.getenv('COUNTER_FLUSH_INTERVAL', '5'))
+COUNTER_ALERT_FAILURES = int(os.getenv('COUNTER_ALERT_FAILURES', '5'))
+COUNTER_MAX_FAILED_FLUSHES = int(os.getenv('COUNTER_MAX_FAILED_FLUSHES', '120'))  # ~10 min at 5s
+LATENCY_SAMPLES = 100
+
+
+class CounterAggregator:
+    """
+    Accumulates {counter: {key: delta}} and hands batches to flush_fn.
+    flush_fn(deltas) must apply them atomically or raise.
+    """
+
+    def __init__(self, flush_fn, interval=COUNTER_FLUSH_INTERVAL):
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self._pending = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._started = False
+        self._flush_times = deque(maxlen=LATENCY_SAMPLES)
+        self._consecutive_failures = 0
+        self._stats = {'increments': 0, 'flushes': 0, 'flush_failures': 0, 'applied': 0, 'dropped': 0}
+
+    def add(self, counter, key, delta=1):
+        """Record an increment - never touches the network"""
+        if key is None:
+            return
+        with self._lock:
+            self._pending[counter][str(key)] += delta
+            self._stats['increments'] += 1
+
+    def flush(self):
+        """Send everything pending in one call; on failure the deltas are merged back"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch = {counter: dict(deltas) for counter, deltas in self._pending.items()}
+                self._pending.clear()
+
+            start = time.time()
+            try:
+                self.flush_fn(batch)
+            except Exception as e:
+                with self._lock:
+                    self._stats['flush_failures'] += 1
+                    self._consecutive_failures += 1
+                    failures = self._consecutive_failures
+                    give_up = failures >= COUNTER_MAX_FAILED_FLUSHES
+                    if give_up:
+                        self._consecutive_failures = 0
+                        self._stats['dropped'] += sum(len(deltas) for deltas in batch.values())
+                    else:
+                        for counter, deltas in batch.items():
+                            for key, delta in deltas.items():
+                                self._pending[counter][key] += delta
+                if give_up:
+                    # Logged in full so the counts can be reconciled by hand
+                    logger.error(f"[COUNTERS] 🚨 {failures} flushes failed in a row - dropping deltas: {json.dumps(batch)}")
+                elif failures >= COUNTER_ALERT_FAILURES:
+                    logger.error(f"[COUNTERS] 🚨 {failures} flushes failed in a row - counters are not being saved "
+                                 f"(is apply_counter_deltas installed? see migrations/): {e}")
+                else:
+                    logger.error(f"[COUNTERS] ❌ Flush failed, will retry: {e}")
+                return 0
+
+            applied = sum(len(deltas) for deltas in batch.values())
+            with self._lock:
+                self._consecutive_failures = 0
+                self._flush_times.append(time.time() - start)
+                self._stats['flushes'] += 1
+                self._stats['applied'] += applied
+            logger.info(f"[COUNTERS] ✅ Flushed {applied} counter(s) in {(time.time() - start) * 1000:.0f}ms")
+            return applied
+
+    def start(self):
+        """Flush every interval in the background, and once more at exit"""
+        if self._started:
+            return
+        self._started = True
+
+        def run():
+            while True:
+                time.sleep(self.interval)
+                self.flush()
+
+        threading.Thread(target=run, daemon=True, name='counter-flusher').start()
+        atexit.register(self.flush)
+
+    def stats(self):
+        with self._lock:
+            flush_times = sorted(self._flush_times)
+            return {
+                **self._stats,
+                'consecutive_failures': self._consecutive_failures,
+                'pending_keys': sum(len(deltas) for deltas in self._pending.values()),
+                'pending_deltas': sum(sum(deltas.values()) for deltas in self._pending.values()),
+                'last_flush_ms': round(self._flush_times[-1] * 1000, 1) if self._flush_times else 0,
+                'max_flush_ms': round(flush_times[-1] * 1000, 1) if flush_times else 0
+            }
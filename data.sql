@@ -3,12 +3,15 @@
 -- ✅ All tables for WhatsApp + Client Stats
 -- ✅ No unique constraints on users
 -- ✅ MongoDB replacement ready
+-- ⚠️ Drops and recreates everything - upgrade existing
+--    databases with the scripts in migrations/ instead
 -- ============================================
 
 -- STEP 1: DROP EXISTING FUNCTIONS
 DROP FUNCTION IF EXISTS get_user_generation_history(UUID) CASCADE;
 DROP FUNCTION IF EXISTS get_pending_notifications() CASCADE;
 DROP FUNCTION IF EXISTS link_session_to_user(TEXT, UUID) CASCADE;
+DROP FUNCTION IF EXISTS apply_counter_deltas(JSONB, JSONB) CASCADE;
 
 -- STEP 2: DROP OLD VERIFICATION TABLES
 DROP TABLE IF EXISTS phone_otp_logs CASCADE;
@@ -110,6 +113,7 @@ CREATE TABLE user_generations (
     style TEXT,
     custom_prompt TEXT,
     image_url TEXT,
+    derivatives JSONB DEFAULT '{}'::jsonb,  -- {"thumbnail": url, "medium": url}
     
     -- Download tracking
     downloaded BOOLEAN DEFAULT FALSE,
@@ -293,6 +297,29 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Function 5: Apply batched counter deltas atomically (write-behind flush from counters.py)
+-- p_client_deltas: {"skyline": 3, ...}   p_user_deltas: {"<user uuid>": 1, ...}
+CREATE OR REPLACE FUNCTION apply_counter_deltas(
+    p_client_deltas JSONB,
+    p_user_deltas JSONB
+)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO client_stats (client_name, total_generations, total_downloads)
+    SELECT d.key, d.value::INTEGER, 0
+    FROM jsonb_each_text(COALESCE(p_client_deltas, '{}'::JSONB)) d
+    ON CONFLICT (client_name) DO UPDATE
+    SET 
+        total_generations = COALESCE(client_stats.total_generations, 0) + EXCLUDED.total_generations,
+        updated_at = NOW();
+    
+    UPDATE users u
+    SET total_generations = COALESCE(u.total_generations, 0) + d.value::INTEGER
+    FROM jsonb_each_text(COALESCE(p_user_deltas, '{}'::JSONB)) d
+    WHERE u.id = d.key::UUID;
+END;
+$$ LANGUAGE plpgsql;
+
 -- ============================================
 -- VIEWS FOR ANALYTICS
 -- ============================================
@@ -360,6 +387,7 @@ GROUP BY cs.client_name, cs.total_generations, cs.total_downloads, cs.created_at
 COMMENT ON TABLE users IS 'Stores all user registrations - NO UNIQUE CONSTRAINTS - Duplicates allowed for testing';
 COMMENT ON TABLE scheduled_notifications IS 'Stores scheduled WhatsApp/SMS notifications sent 30 minutes after registration';
 COMMENT ON TABLE user_generations IS 'Links all generated images to users with download tracking';
+COMMENT ON COLUMN user_generations.derivatives IS 'Cloudinary URLs of the WebP thumbnail/medium renditions, keyed by size';
 COMMENT ON TABLE client_stats IS 'Tracks statistics per client (replaces MongoDB clients collection)';
 COMMENT ON TABLE generation_logs IS 'Detailed logs of all generation requests';
 COMMENT ON TABLE sessions IS 'Tracks anonymous and registered user sessions';
@@ -369,6 +397,7 @@ COMMENT ON FUNCTION get_user_generation_history IS 'Get complete generation hist
 COMMENT ON FUNCTION get_pending_notifications IS 'Get all notifications that are due to be sent now';
 COMMENT ON FUNCTION link_session_to_user IS 'Link pre-registration generations to user account';
 COMMENT ON FUNCTION track_image_download IS 'Track when a user downloads a generated image';
+COMMENT ON FUNCTION apply_counter_deltas IS 'Atomically add batched generation counts to client_stats and users';
 
 -- ============================================
 -- VERIFICATION & TESTING
@@ -453,7 +482,8 @@ WHERE n.nspname = 'public'
       'get_user_generation_history',
       'get_pending_notifications',
       'link_session_to_user',
-      'track_image_download'
+      'track_image_download',
+      'apply_counter_deltas'
   );
 
 -- Check 8: Verify views
@@ -0,0 +1,101 @@
+"""
+derivatives.py — Thumbnail / medium renditions of generated designs
+Galleries and the admin lead grid show designs small, but only the 1024px
+original existed. Right after generation the 'imaging' worker pool renders
+each size in each format (WebP, plus AVIF when Pillow supports it) into the
+image store, so /api/images/<image_id>/<size>.<format> is usually ready
+before the browser asks. A request that arrives first renders on demand
+(concurrent requests for the same rendition share one render).
+"""
+
+import io
+import os
+import logging
+
+from PIL import Image, features
+
+from background_tasks import submit_task
+from image_store import get_image, put_image
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# size name -> max width/height in pixels
+DERIVATIVE_SIZES = {
+    'thumbnail': int(os.getenv('DERIVATIVE_THUMBNAIL_PX', '320')),
+    'medium': int(os.getenv('DERIVATIVE_MEDIUM_PX', '768')),
+}
+DERIVATIVE_QUALITY = {'webp': 80, 'avif': 60}
+DERIVATIVE_FORMATS = [
+    fmt for fmt in os.getenv('DERIVATIVE_FORMATS', 'webp,avif').split(',')
+    if fmt in DERIVATIVE_QUALITY and features.check(fmt)
+]
+
+_renders = SingleFlight('derivatives')
+
+
+def derivative_key(image_id, size, fmt):
+    """Image store key; the pixel size is part of it so changing a size never serves stale renditions"""
+    return f"{image_id}_{DERIVATIVE_SIZES[size]}.{fmt}"
+
+
+def derivative_urls(image_id, base_url=''):
+    """{size: {format: url}} for every rendition of an image"""
+    return {
+        size: {fmt: f"{base_url}/api/images/{image_id}/{size}.{fmt}" for fmt in DERIVATIVE_FORMATS}
+        for size in DERIVATIVE_SIZES
+    }
+
+
+def render_derivative(image_bytes, size, fmt):
+    """Downscale to fit DERIVATIVE_SIZES[size] and encode as fmt"""
+    max_px = DERIVATIVE_SIZES[size]
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = image.convert('RGB')
+        image.thumbnail((max_px, max_px), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format=fmt.upper(), quality=DERIVATIVE_QUALITY[fmt])
+    return output.getvalue()
+
+
+def get_derivative(image_id, size, fmt, image_bytes=None, client_name='default'):
+    """
+    Rendition bytes, rendering (and storing) them if needed.
+    image_bytes is the original when the caller has it; otherwise it is read from the store.
+    Returns None for unknown sizes/formats or when the original is gone.
+    """
+    if size not in DERIVATIVE_SIZES or fmt not in DERIVATIVE_FORMATS:
+        return None
+
+    key = derivative_key(image_id, size, fmt)
+    stored = get_image(key)
+    if stored:
+        return stored[0]
+
+    if image_bytes is None:
+        original = get_image(image_id)
+        if not original:
+            return None
+        image_bytes = original[0]
+
+    def render():
+        rendered = render_derivative(image_bytes, size, fmt)
+        put_image(key, rendered, client_name)
+        return rendered
+
+    rendered, _ = _renders.do(key, render)
+    return rendered
+
+
+def render_all(image_id, image_bytes, client_name):
+    for size in DERIVATIVE_SIZES:
+        for fmt in DERIVATIVE_FORMATS:
+            try:
+                get_derivative(image_id, size, fmt, image_bytes, client_name)
+            except Exception as e:
+                logger.warning(f"[DERIVATIVES] {size}.{fmt} failed for {image_id}: {e}")
+
+
+def schedule_derivatives(image_id, image_bytes, client_name='default'):
+    """Pre-render every rendition on the imaging pool (a dropped task just means on-demand rendering)"""
+    return submit_task('imaging', render_all, image_id, image_bytes, client_name)
@@ -0,0 +1,385 @@
+"""
+design_cache.py — Bounded, byte-aware LRU + TTL cache for generated designs
+Images are stored as raw bytes (not base64, which is 33% larger) next to a
+small metadata dict. The cache enforces a byte budget with LRU eviction,
+evicting first from whichever client is furthest over its fair share, and
+a background janitor drops expired entries.
+
+TieredDesignCache puts that in-memory cache (L1) in front of a pluggable
+CacheBackend (L2). SQLiteCacheBackend is a content-addressed store on local
+disk that every worker on the host shares and that survives restarts.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from config import BASE_DIR
+
+logger = logging.getLogger(__name__)
+
+DESIGN_CACHE_MAX_BYTES = int(float(os.getenv('DESIGN_CACHE_MAX_MB', '256')) * 1024 * 1024)
+DESIGN_CACHE_TTL = int(os.getenv('DESIGN_CACHE_TTL', '1800'))  # 30 minutes
+DESIGN_CACHE_JANITOR_INTERVAL = int(os.getenv('DESIGN_CACHE_JANITOR_INTERVAL', '60'))
+
+# Shared L2 tier: 'sqlite' (all workers on the host, survives restarts) or 'memory'
+DESIGN_CACHE_BACKEND = os.getenv('DESIGN_CACHE_BACKEND', 'sqlite').lower()
+DESIGN_CACHE_SQLITE_PATH = os.getenv(
+    'DESIGN_CACHE_SQLITE_PATH',
+    os.path.join(BASE_DIR, '.cache', 'design_cache.sqlite3')
+)
+DESIGN_CACHE_DISK_MAX_BYTES = int(float(os.getenv('DESIGN_CACHE_DISK_MAX_MB', '2048')) * 1024 * 1024)
+
+METADATA_OVERHEAD_BYTES = 1024  # rough per-entry cost of the key and metadata dict
+
+
+class DesignCache:
+    """Thread-safe LRU keyed by cache key, with per-client byte accounting"""
+
+    def __init__(self, max_bytes=DESIGN_CACHE_MAX_BYTES, ttl=DESIGN_CACHE_TTL,
+                 janitor_interval=DESIGN_CACHE_JANITOR_INTERVAL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.janitor_interval = janitor_interval
+        self._entries = OrderedDict()  # key -> entry dict, oldest first
+        self._client_bytes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._janitor = None
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'rejected': 0}
+
+    # ── internal (caller holds the lock) ────────────────────
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry['size']
+        client = entry['client_name']
+        self._client_bytes[client] -= entry['size']
+        if self._client_bytes[client] <= 0:
+            del self._client_bytes[client]
+        return entry
+
+    def _pick_victim(self):
+        """Oldest entry of the client most over its fair share, else the global LRU entry"""
+        fair_share = self.max_bytes / max(len(self._client_bytes), 1)
+        heaviest = max(self._client_bytes, key=self._client_bytes.get)
+        if self._client_bytes[heaviest] > fair_share:
+            for key, entry in self._entries.items():
+                if entry['client_name'] == heaviest:
+                    return key
+        return next(iter(self._entries))
+
+    def _purge_expired(self, now):
+        expired = [k for k, e in self._entries.items() if now >= e['expires_at']]
+        for key in expired:
+            self._remove(key)
+        self._stats['expirations'] += len(expired)
+        return len(expired)
+
+    # ── public API ──────────────────────────────────────────
+
+    def get(self, key):
+        """Return (metadata, image_bytes) or None; refreshes LRU position"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            if time.time() >= entry['expires_at']:
+                self._remove(key)
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry['metadata'], entry['image_bytes']
+
+    def set(self, key, client_name, metadata, image_bytes, ttl=None):
+        """
+        Insert or replace an entry, evicting until the byte budget holds. Returns False if rejected.
+        ttl overrides the cache's TTL for this entry (e.g. the time left on an L2 entry).
+        """
+        size = len(image_bytes) + METADATA_OVERHEAD_BYTES
+        with self._lock:
+            if size > self.max_bytes:
+                self._stats['rejected'] += 1
+                logger.warning(f"[CACHE] Entry of {size} bytes exceeds the whole cache budget - not cached")
+                return False
+
+            if key in self._entries:
+                self._remove(key)
+
+            while self._entries and self._bytes + size > self.max_bytes:
+                victim = self._pick_victim()
+                self._remove(victim)
+                self._stats['evictions'] += 1
+
+            self._entries[key] = {
+                'client_name': client_name,
+                'metadata': metadata,
+                'image_bytes': image_bytes,
+                'size': size,
+                'expires_at': time.time() + (self.ttl if ttl is None else ttl)
+            }
+            self._bytes += size
+            self._client_bytes[client_name] = self._client_bytes.get(client_name, 0) + size
+            return True
+
+    def purge_expired(self):
+        with self._lock:
+            return self._purge_expired(time.time())
+
+    def clear(self):
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._client_bytes.clear()
+            self._bytes = 0
+            return count
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'client_bytes': dict(self._client_bytes)
+            }
+
+    def start_janitor(self):
+        """Background thread that drops expired entries every janitor_interval seconds"""
+        if self._janitor and self._janitor.is_alive():
+            return
+
+        def run():
+            while True:
+                time.sleep(self.janitor_interval)
+                try:
+                    removed = self.purge_expired()
+                    if removed:
+                        logger.info(f"[CLEANUP] Janitor expired {removed} cache entries")
+                except Exception as e:
+                    logger.error(f"[CLEANUP] Janitor error: {e}")
+
+        self._janitor = threading.Thread(target=run, daemon=True, name='design-cache-janitor')
+        self._janitor.start()
+
+
+# ============================================================
+# SHARED (L2) BACKENDS
+# ============================================================
+
+class CacheBackend(ABC):
+    """
+    Interface for a cache tier shared by every worker on the host.
+    get() returns (metadata, image_bytes, expires_at) or None.
+    """
+
+    name = 'none'
+
+    @abstractmethod
+    def get(self, key):
+        ...
+
+    @abstractmethod
+    def set(self, key, client_name, metadata, image_bytes, ttl):
+        ...
+
+    def purge_expired(self):
+        return 0
+
+    def clear(self):
+        return 0
+
+    def stats(self):
+        return {'backend': self.name}
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    Content-addressed SQLite store: image bytes live once in `blobs` keyed by
+    SHA-256, `entries` maps cache keys to blobs with an expiry. WAL mode lets
+    all gunicorn workers on the host read and write concurrently.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                client_name TEXT NOT NULL,
+                blob_hash TEXT NOT NULL REFERENCES blobs(hash),
+                metadata TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_expires ON entries(expires_at);
+            CREATE INDEX IF NOT EXISTS idx_entries_created ON entries(created_at);
+        """)
+
+    def _conn(self):
+        """One connection per thread (sqlite3 connections are not thread-safe)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT e.metadata, b.data, e.expires_at FROM entries e JOIN blobs b ON b.hash = e.blob_hash "
+            "WHERE e.key = ? AND e.expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+        if not row:
+            return None
+        return json.loads(row[0]), bytes(row[1]), row[2]
+
+    def set(self, key, client_name, metadata, image_bytes, ttl):
+        blob_hash = hashlib.sha256(image_bytes).hexdigest()
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                "INSERT OR IGNORE INTO blobs (hash, data, size) VALUES (?, ?, ?)",
+                (blob_hash, sqlite3.Binary(image_bytes), len(image_bytes))
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, client_name, blob_hash, metadata, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, client_name, blob_hash, json.dumps(metadata), now, now + ttl)
+            )
+
+    def _delete_orphan_blobs(self, conn):
+        conn.execute("DELETE FROM blobs WHERE hash NOT IN (SELECT blob_hash FROM entries)")
+
+    def purge_expired(self):
+        """Drop expired entries, then trim oldest entries until the disk budget holds"""
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            removed = conn.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),)).rowcount
+            self._delete_orphan_blobs(conn)
+
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            while total > self.max_bytes:
+                oldest = conn.execute("SELECT key FROM entries ORDER BY created_at LIMIT 1").fetchone()
+                if not oldest:
+                    break
+                conn.execute("DELETE FROM entries WHERE key = ?", oldest)
+                self._delete_orphan_blobs(conn)
+                removed += 1
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        return removed
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            count = conn.execute("DELETE FROM entries").rowcount
+            conn.execute("DELETE FROM blobs")
+        return count
+
+    def stats(self):
+        conn = self._conn()
+        entries = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        blobs, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {'backend': self.name, 'entries': entries, 'blobs': blobs, 'bytes': size, 'max_bytes': self.max_bytes}
+
+
+class TieredDesignCache(DesignCache):
+    """In-memory DesignCache as L1 in front of an optional shared CacheBackend (L2)"""
+
+    def __init__(self, backend=None, **kwargs):
+        super().__init__(**kwargs)
+        self.backend = backend
+        self._stats['l2_hits'] = 0
+        self._stats['l2_errors'] = 0
+
+    def get(self, key):
+        cached = super().get(key)
+        if cached or not self.backend:
+            return cached
+        try:
+            cached = self.backend.get(key)
+        except Exception as e:
+            self._stats['l2_errors'] += 1
+            logger.warning(f"[CACHE] L2 read failed: {e}")
+            return None
+        if not cached:
+            return None
+        metadata, image_bytes, expires_at = cached
+        self._stats['l2_hits'] += 1
+        # Promote with the time the L2 entry has left, so it never outlives it
+        super().set(key, metadata.get('client_name', 'default'), metadata, image_bytes,
+                    ttl=expires_at - time.time())
+        return metadata, image_bytes
+
+    def set(self, key, client_name, metadata, image_bytes, ttl=None):
+        stored = super().set(key, client_name, metadata, image_bytes, ttl)
+        if self.backend:
+            try:
+                self.backend.set(key, client_name, metadata, image_bytes, self.ttl if ttl is None else ttl)
+            except Exception as e:
+                self._stats['l2_errors'] += 1
+                logger.warning(f"[CACHE] L2 write failed: {e}")
+        return stored
+
+    def purge_expired(self):
+        removed = super().purge_expired()
+        if self.backend:
+            removed += self.backend.purge_expired()
+        return removed
+
+    def clear(self):
+        count = super().clear()
+        if self.backend:
+            count = max(count, self.backend.clear())
+        return count
+
+    def stats(self):
+        stats = super().stats()
+        if self.backend:
+            try:
+                stats['l2'] = self.backend.stats()
+            except Exception as e:
+                stats['l2'] = {'backend': self.backend.name, 'error': str(e)}
+        return stats
+
+
+def create_cache_backend(path=DESIGN_CACHE_SQLITE_PATH, max_bytes=DESIGN_CACHE_DISK_MAX_BYTES):
+    """Build the L2 backend selected by DESIGN_CACHE_BACKEND ('sqlite' or 'memory')"""
+    if DESIGN_CACHE_BACKEND != 'sqlite':
+        logger.info("[CACHE] Using in-memory cache only")
+        return None
+    try:
+        backend = SQLiteCacheBackend(path, max_bytes)
+        logger.info(f"[CACHE] ✅ Shared SQLite cache at {path}")
+        return backend
+    except Exception as e:
+        logger.warning(f"[CACHE] SQLite cache unavailable ({e}) - using in-memory cache only")
+        return None
@@ -0,0 +1,128 @@
+"""
+generation_history.py — Reusable past generations from Supabase user_generations
+Every style-based generation already lives on Cloudinary with a row in
+user_generations. Paging through recent rows at startup (and periodically
+after) builds an index keyed like the design cache (client + cache_prompt),
+so a freshly restarted worker can answer from an existing Cloudinary image
+instead of paying for a new Replicate prediction.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+GENERATION_HISTORY_ENABLED = os.getenv('GENERATION_HISTORY_ENABLED', 'true').lower() == 'true'
+GENERATION_HISTORY_DAYS = int(os.getenv('GENERATION_HISTORY_DAYS', '30'))
+GENERATION_HISTORY_MAX_ROWS = int(os.getenv('GENERATION_HISTORY_MAX_ROWS', '5000'))
+GENERATION_HISTORY_PAGE_SIZE = int(os.getenv('GENERATION_HISTORY_PAGE_SIZE', '500'))
+GENERATION_HISTORY_PER_KEY = int(os.getenv('GENERATION_HISTORY_PER_KEY', '5'))
+GENERATION_HISTORY_REFRESH = int(os.getenv('GENERATION_HISTORY_REFRESH', '3600'))  # 0 = startup only
+
+
+def history_key(client_name, room_type, style):
+    """Same shape as the design cache key for style-based requests"""
+    return (client_name, f"{room_type}_{style}")
+
+
+class GenerationHistory:
+    """(client_name, cache_prompt) -> most recent Cloudinary URLs for that combination"""
+
+    def __init__(self, per_key=GENERATION_HISTORY_PER_KEY):
+        self.per_key = per_key
+        self._index = {}
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._stats = {'rows': 0, 'hits': 0, 'misses': 0, 'load_errors': 0}
+
+    def add(self, client_name, room_type, style, image_url):
+        """Record a generation (newest first) - used by the loader and after live uploads"""
+        if not image_url or not style or style == 'custom':
+            return
+        key = history_key(client_name, room_type, style)
+        with self._lock:
+            urls = self._index.setdefault(key, [])
+            if image_url in urls:
+                return
+            urls.insert(0, image_url)
+            del urls[self.per_key:]
+
+    def lookup(self, client_name, room_type, style):
+        """A stored URL for this combination (random among the recent ones), or None"""
+        with self._lock:
+            urls = self._index.get(history_key(client_name, room_type, style))
+            if not urls:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            return random.choice(urls)
+
+    def load(self, supabase):
+        """Page through recent style-based rows, newest first, and rebuild the index"""
+        if not supabase:
+            return 0
+
+        since = (datetime.now(timezone.utc) - timedelta(days=GENERATION_HISTORY_DAYS)).isoformat()
+        index = {}
+        rows_seen = 0
+        start = time.time()
+
+        try:
+            while rows_seen < GENERATION_HISTORY_MAX_ROWS:
+                end = rows_seen + min(GENERATION_HISTORY_PAGE_SIZE, GENERATION_HISTORY_MAX_ROWS - rows_seen) - 1
+                page = supabase.table('user_generations')\
+                    .select('client_name, room_type, style, image_url')\
+                    .gte('created_at', since)\
+                    .is_('custom_prompt', 'null')\
+                    .not_.is_('image_url', 'null')\
+                    .order('created_at', desc=True)\
+                    .range(rows_seen, end)\
+                    .execute()
+                rows = page.data or []
+
+                for row in rows:
+                    style = row.get('style')
+                    if not style or style == 'custom':
+                        continue
+                    urls = index.setdefault(history_key(row['client_name'], row['room_type'], style), [])
+                    if len(urls) < self.per_key and row['image_url'] not in urls:
+                        urls.append(row['image_url'])
+
+                rows_seen += len(rows)
+                if len(rows) < GENERATION_HISTORY_PAGE_SIZE:
+                    break
+        except Exception as e:
+            with self._lock:
+                self._stats['load_errors'] += 1
+            logger.error(f"[HISTORY] ❌ Failed to load user_generations: {e}")
+            return 0
+
+        with self._lock:
+            self._index = index
+            self._loaded_at = time.time()
+            self._stats['rows'] = rows_seen
+        logger.info(f"[HISTORY] ✅ Indexed {len(index)} combination(s) from {rows_seen} row(s) in {time.time() - start:.2f}s")
+        return len(index)
+
+    def start(self, supabase):
+        """Load now in the background, then refresh every GENERATION_HISTORY_REFRESH seconds"""
+        def run():
+            while True:
+                self.load(supabase)
+                if GENERATION_HISTORY_REFRESH <= 0:
+                    return
+                time.sleep(GENERATION_HISTORY_REFRESH)
+
+        threading.Thread(target=run, daemon=True, name='generation-history').start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                'combinations': len(self._index),
+                'loaded_at': self._loaded_at
+            }
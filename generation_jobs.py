@@ -0,0 +1,185 @@
+"""
+generation_jobs.py — In-process job registry for asynchronous design generation
+Flow: POST /api/generate-design/async -> submit_job() returns a job id at once
+      -> bounded executor runs the generation in the background
+      -> GET /api/generate-design/<job_id> reports state and result
+      -> GET /api/generate-design/<job_id>/events streams state changes (SSE)
+
+Code running inside a job can call report_progress() to publish prediction
+lifecycle details (Replicate status, output URLs) to anyone watching the job.
+"""
+
+import os
+import time
+import secrets
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', '4'))
+GENERATION_QUEUE_LIMIT = int(os.getenv('GENERATION_QUEUE_LIMIT', '32'))
+JOB_RETENTION_SECONDS = int(os.getenv('JOB_RETENTION_SECONDS', '1800'))  # 30 minutes
+
+_executor = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix='generation')
+_jobs = {}
+_jobs_lock = threading.Lock()
+_jobs_changed = threading.Condition(_jobs_lock)
+_current = threading.local()  # job id of the job running on this thread
+
+
+class QueueFullError(Exception):
+    """Raised when the generation queue cannot take another job"""
+
+
+def _prune_finished_jobs():
+    """Drop finished jobs older than JOB_RETENTION_SECONDS (caller holds the lock)"""
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job['finished_at'] and job['finished_at'] < cutoff
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+    if expired:
+        logger.info(f"[JOBS] Pruned {len(expired)} finished job(s)")
+
+
+def _active_count():
+    """Queued + running jobs (caller holds the lock)"""
+    return sum(1 for job in _jobs.values() if job['status'] in ('queued', 'running'))
+
+
+def _touch(job):
+    """Record a change and wake watchers (caller holds the lock)"""
+    job['version'] += 1
+    _jobs_changed.notify_all()
+
+
+def _run_job(job_id, func, args, kwargs):
+    """Executor entry point - runs func and records (body, status_code)"""
+    with _jobs_lock:
+        job = _jobs[job_id]
+        job['status'] = 'running'
+        job['started_at'] = time.time()
+        # Everyone still queued moved up one place
+        for other in _jobs.values():
+            if other['status'] == 'queued':
+                other['version'] += 1
+        _touch(job)
+
+    _current.job_id = job_id
+    try:
+        body, status_code = func(*args, **kwargs)
+    except Exception as e:
+        logger.error(f"[JOBS] ❌ Job {job_id} crashed: {e}")
+        body, status_code = {'error': 'Internal server error', 'details': str(e)}, 500
+    finally:
+        _current.job_id = None
+
+    with _jobs_lock:
+        job['status'] = 'succeeded' if status_code < 400 else 'failed'
+        job['http_status'] = status_code
+        job['result'] = body
+        job['finished_at'] = time.time()
+        _touch(job)
+
+    elapsed = job['finished_at'] - job['started_at']
+    logger.info(f"[JOBS] Job {job_id} {job['status']} in {elapsed:.2f}s")
+
+
+def submit_job(func, *args, **kwargs):
+    """
+    Queue func(*args, **kwargs) on the generation executor.
+    func must return a (body, status_code) tuple.
+
+    Returns:
+        job_id string
+
+    Raises:
+        QueueFullError: when GENERATION_WORKERS + GENERATION_QUEUE_LIMIT jobs are already active
+    """
+    with _jobs_lock:
+        _prune_finished_jobs()
+        if _active_count() >= GENERATION_WORKERS + GENERATION_QUEUE_LIMIT:
+            raise QueueFullError('Generation queue is full')
+
+        job_id = f"job_{int(time.time())}_{secrets.token_hex(6)}"
+        _jobs[job_id] = {
+            'job_id': job_id,
+            'status': 'queued',
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'http_status': None,
+            'result': None,
+            'progress': {},
+            'version': 0
+        }
+
+    _executor.submit(_run_job, job_id, func, args, kwargs)
+    logger.info(f"[JOBS] 🚀 Queued {job_id}")
+    return job_id
+
+
+def report_progress(**fields):
+    """Merge fields into the current job's progress; a no-op outside a job (e.g. sync requests)"""
+    _report(getattr(_current, 'job_id', None), fields)
+
+
+def progress_reporter():
+    """report_progress bound to the current job, for callbacks that run on other threads"""
+    job_id = getattr(_current, 'job_id', None)
+    return lambda **fields: _report(job_id, fields)
+
+
+def _report(job_id, fields):
+    if not job_id:
+        return
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job and any(job['progress'].get(key) != value for key, value in fields.items()):
+            job['progress'].update(fields)
+            _touch(job)
+
+
+def _snapshot(job):
+    """Copy of the job plus its place in the queue (caller holds the lock)"""
+    snapshot = dict(job, progress=dict(job['progress']), queue_position=None)
+    if job['status'] == 'queued':
+        snapshot['queue_position'] = sum(
+            1 for other in _jobs.values()
+            if other['status'] == 'queued' and other['created_at'] <= job['created_at']
+        )
+    return snapshot
+
+
+def get_job(job_id):
+    """Return a snapshot of the job, or None if unknown/expired"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return _snapshot(job) if job else None
+
+
+def wait_for_job_update(job_id, seen_version, timeout):
+    """
+    Block until the job changes past seen_version (or timeout).
+    Returns the current snapshot either way, or None if the job is gone.
+    """
+    with _jobs_changed:
+        _jobs_changed.wait_for(
+            lambda: job_id not in _jobs or _jobs[job_id]['version'] > seen_version,
+            timeout
+        )
+        job = _jobs.get(job_id)
+        return _snapshot(job) if job else None
+
+
+def get_job_stats():
+    """Counts by status, for the health endpoint"""
+    with _jobs_lock:
+        stats = {'workers': GENERATION_WORKERS, 'queue_limit': GENERATION_QUEUE_LIMIT}
+        for status in ('queued', 'running', 'succeeded', 'failed'):
+            stats[status] = sum(1 for job in _jobs.values() if job['status'] == status)
+        return stats
@@ -0,0 +1,242 @@
+"""
+generation_scheduler.py — Admission control for Replicate generations
+Every generation that needs a prediction takes a slot here first, so the
+Replicate concurrency we can afford goes to the most valuable traffic:
+
+- priority classes are served strictly in order: registered users, then
+  anonymous sessions, then pre-warm refills (which also have their own cap),
+- within a class, clients (builders) share slots by weighted fair queuing
+  (start-time fair queuing, weights from GENERATION_CLIENT_WEIGHTS),
+- no client holds more than GENERATION_CLIENT_MAX_CONCURRENT slots.
+
+A full class queue rejects at once, and a waiter gives up after
+GENERATION_MAX_WAIT. Either way the caller gets AdmissionRejected with a
+Retry-After estimate based on queue depth and recent generation times.
+"""
+
+import os
+import math
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_CLASSES = ('registered', 'anonymous', 'prewarm')  # highest first
+
+GENERATION_MAX_CONCURRENT = int(os.getenv('GENERATION_MAX_CONCURRENT', '4'))  # predictions in flight
+GENERATION_CLIENT_MAX_CONCURRENT = int(os.getenv('GENERATION_CLIENT_MAX_CONCURRENT', '3'))
+GENERATION_PREWARM_MAX_CONCURRENT = int(os.getenv('GENERATION_PREWARM_MAX_CONCURRENT', '1'))
+GENERATION_MAX_WAIT = float(os.getenv('GENERATION_MAX_WAIT', '30'))
+GENERATION_CLASS_QUEUE_LIMITS = {
+    'registered': int(os.getenv('GENERATION_REGISTERED_QUEUE_LIMIT', '32')),
+    'anonymous': int(os.getenv('GENERATION_ANONYMOUS_QUEUE_LIMIT', '16')),
+    'prewarm': int(os.getenv('GENERATION_PREWARM_QUEUE_LIMIT', '2')),
+}
+GENERATION_EXPECTED_SECONDS = float(os.getenv('GENERATION_EXPECTED_SECONDS', '10'))  # until measured
+DURATION_SMOOTHING = 0.2  # weight of the newest slot hold time in the moving average
+
+
+def parse_client_weights(value):
+    """'skyline=2,acme=1' -> {'skyline': 2.0, 'acme': 1.0} (malformed entries are skipped)"""
+    weights = {}
+    for entry in (value or '').split(','):
+        name, _, weight = entry.partition('=')
+        try:
+            if name.strip() and float(weight) > 0:
+                weights[name.strip()] = float(weight)
+        except ValueError:
+            logger.warning(f"[SCHEDULER] Ignoring client weight {entry!r}")
+    return weights
+
+
+GENERATION_CLIENT_WEIGHTS = parse_client_weights(os.getenv('GENERATION_CLIENT_WEIGHTS', ''))
+
+
+class AdmissionRejected(Exception):
+    """The generation queue for this priority class is full (or the wait ran out)"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    """One waiting generation"""
+
+    def __init__(self, client_name, priority, start_tag):
+        self.client_name = client_name
+        self.priority = priority
+        self.start_tag = start_tag
+        self.enqueued_at = time.time()
+        self.granted = False
+
+
+class GenerationScheduler:
+    """Strict priority across classes, weighted fair queuing across clients within a class"""
+
+    def __init__(self, max_concurrent=GENERATION_MAX_CONCURRENT,
+                 client_max_concurrent=GENERATION_CLIENT_MAX_CONCURRENT,
+                 class_max_concurrent=None, queue_limits=None, weights=None,
+                 max_wait=GENERATION_MAX_WAIT):
+        self.max_concurrent = max(1, max_concurrent)
+        self.client_max_concurrent = max(1, client_max_concurrent)
+        self.class_max_concurrent = class_max_concurrent or {'prewarm': GENERATION_PREWARM_MAX_CONCURRENT}
+        self.queue_limits = queue_limits or GENERATION_CLASS_QUEUE_LIMITS
+        self.weights = GENERATION_CLIENT_WEIGHTS if weights is None else weights
+        self.max_wait = max_wait
+        self._queues = {priority: {} for priority in PRIORITY_CLASSES}  # priority -> client -> deque of tickets
+        self._virtual_time = {priority: 0.0 for priority in PRIORITY_CLASSES}
+        self._last_tag = {priority: {} for priority in PRIORITY_CLASSES}  # priority -> client -> last start tag
+        self._running = 0
+        self._running_by_class = {priority: 0 for priority in PRIORITY_CLASSES}
+        self._running_by_client = {}
+        self._expected = GENERATION_EXPECTED_SECONDS
+        self._cond = threading.Condition()
+        self._stats = {priority: {'admitted': 0, 'rejected': 0, 'timed_out': 0, 'wait_seconds': 0.0}
+                       for priority in PRIORITY_CLASSES}
+
+    # ── internal (caller holds the lock) ────────────────────
+
+    def _queued(self, priority):
+        return sum(len(tickets) for tickets in self._queues[priority].values())
+
+    def _retry_after(self, priority):
+        """Seconds until a slot is likely free for a new request of this class"""
+        ahead = sum(self._queued(p) for p in PRIORITY_CLASSES[:PRIORITY_CLASSES.index(priority) + 1])
+        rounds = (self._running + ahead) / self.max_concurrent
+        return max(1, math.ceil(rounds * self._expected))
+
+    def _reject_if_full(self, priority):
+        if self._queued(priority) >= self.queue_limits.get(priority, 0):
+            self._stats[priority]['rejected'] += 1
+            raise AdmissionRejected(f"{priority} generation queue is full", self._retry_after(priority))
+
+    def _can_run(self, priority, client_name):
+        return (self._running_by_class[priority] < self.class_max_concurrent.get(priority, self.max_concurrent)
+                and self._running_by_client.get(client_name, 0) < self.client_max_concurrent)
+
+    def _next_ticket(self):
+        """Eligible head ticket with the smallest start tag in the highest non-blocked class"""
+        for priority in PRIORITY_CLASSES:
+            heads = [
+                tickets[0] for client_name, tickets in self._queues[priority].items()
+                if tickets and self._can_run(priority, client_name)
+            ]
+            if heads:
+                return min(heads, key=lambda ticket: ticket.start_tag)
+        return None
+
+    def _dispatch(self):
+        """Grant free slots to waiting tickets"""
+        granted = False
+        while self._running < self.max_concurrent:
+            ticket = self._next_ticket()
+            if not ticket:
+                break
+            tickets = self._queues[ticket.priority][ticket.client_name]
+            tickets.popleft()
+            if not tickets:
+                del self._queues[ticket.priority][ticket.client_name]
+            self._virtual_time[ticket.priority] = ticket.start_tag
+            self._take(ticket.priority, ticket.client_name)
+            ticket.granted = True
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _take(self, priority, client_name):
+        self._running += 1
+        self._running_by_class[priority] += 1
+        self._running_by_client[client_name] = self._running_by_client.get(client_name, 0) + 1
+
+    def _remove(self, ticket):
+        tickets = self._queues[ticket.priority].get(ticket.client_name)
+        if tickets and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del self._queues[ticket.priority][ticket.client_name]
+
+    # ── public ──────────────────────────────────────────────
+
+    def check(self, priority):
+        """Raise AdmissionRejected now if a request of this class would be turned away"""
+        with self._cond:
+            self._reject_if_full(priority)
+
+    def acquire(self, client_name, priority):
+        """Block until a slot is granted. Raises AdmissionRejected when the queue is full or the wait runs out."""
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class: {priority}")
+
+        with self._cond:
+            self._reject_if_full(priority)
+
+            # Start-time fair queuing: a client's next request starts after its previous one
+            # (scaled by its weight), but never before the class's virtual time
+            weight = self.weights.get(client_name, 1.0)
+            start_tag = max(self._virtual_time[priority], self._last_tag[priority].get(client_name, 0.0))
+            self._last_tag[priority][client_name] = start_tag + 1.0 / weight
+            ticket = _Ticket(client_name, priority, start_tag)
+            self._queues[priority].setdefault(client_name, deque()).append(ticket)
+            self._dispatch()
+
+            if not self._cond.wait_for(lambda: ticket.granted, self.max_wait):
+                self._remove(ticket)
+                self._stats[priority]['timed_out'] += 1
+                logger.warning(f"[SCHEDULER] ❌ {priority} generation for {client_name} waited {self.max_wait:.0f}s without a slot")
+                raise AdmissionRejected('Timed out waiting for a generation slot', self._retry_after(priority))
+
+            waited = time.time() - ticket.enqueued_at
+            self._stats[priority]['admitted'] += 1
+            self._stats[priority]['wait_seconds'] += waited
+        if waited > 1:
+            logger.info(f"[SCHEDULER] {priority} generation for {client_name} started after {waited:.1f}s in queue")
+
+    def release(self, client_name, priority, duration=None):
+        with self._cond:
+            self._running -= 1
+            self._running_by_class[priority] -= 1
+            self._running_by_client[client_name] -= 1
+            if not self._running_by_client[client_name]:
+                del self._running_by_client[client_name]
+            if duration is not None:
+                self._expected += DURATION_SMOOTHING * (duration - self._expected)
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, client_name, priority):
+        """with scheduler.slot(client, priority): <create and wait for the prediction>"""
+        self.acquire(client_name, priority)
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.release(client_name, priority, time.time() - started)
+
+    def stats(self):
+        with self._cond:
+            classes = {}
+            for priority in PRIORITY_CLASSES:
+                counts = self._stats[priority]
+                classes[priority] = {
+                    'admitted': counts['admitted'],
+                    'rejected': counts['rejected'],
+                    'timed_out': counts['timed_out'],
+                    'avg_wait': round(counts['wait_seconds'] / counts['admitted'], 2) if counts['admitted'] else 0,
+                    'queued': self._queued(priority),
+                    'running': self._running_by_class[priority],
+                    'queue_limit': self.queue_limits.get(priority, 0),
+                    'retry_after': self._retry_after(priority)
+                }
+            return {
+                'max_concurrent': self.max_concurrent,
+                'client_max_concurrent': self.client_max_concurrent,
+                'running': self._running,
+                'running_by_client': dict(self._running_by_client),
+                'expected_seconds': round(self._expected, 1),
+                'weights': self.weights,
+                'classes': classes
+            }
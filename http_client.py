@@ -0,0 +1,105 @@
+"""
+http_client.py — Shared keep-alive HTTP sessions for all outbound API calls
+One requests.Session per host, so Replicate polls, image downloads, NewsAPI,
+Google Geocoding and Meta Graph calls reuse pooled TCP+TLS connections
+instead of paying a fresh handshake on every request.
+
+Usage mirrors requests:  http_client.get(url, params=...), http_client.post(url, json=...)
+"""
+
+import os
+import random
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = float(os.getenv('HTTP_DEFAULT_TIMEOUT', '15'))
+DEFAULT_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))
+MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '3'))
+RETRY_BACKOFF = 0.3   # seconds, doubled per attempt
+RETRY_JITTER = 0.3    # up to this many extra random seconds per attempt
+
+# Hosts that see many concurrent calls get bigger pools
+HOST_POOL_SIZES = {
+    'api.replicate.com': int(os.getenv('HTTP_POOL_SIZE_REPLICATE', '32')),
+    'replicate.delivery': int(os.getenv('HTTP_POOL_SIZE_REPLICATE', '32')),
+}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class JitteredRetry(Retry):
+    """Exponential backoff plus random jitter so retries from parallel workers don't align"""
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return backoff
+        return backoff + random.uniform(0, RETRY_JITTER)
+
+
+def _build_session(host):
+    pool_size = HOST_POOL_SIZES.get(host, DEFAULT_POOL_SIZE)
+
+    # Only idempotent methods are retried on read errors / 5xx; POSTs are
+    # retried only when the connection itself failed (nothing was sent).
+    retry = JitteredRetry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=MAX_RETRIES,
+        status=MAX_RETRIES,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    logger.info(f"[HTTP] Created pooled session for {host} (pool={pool_size})")
+    return session
+
+
+def get_session(url):
+    """Return the shared session for the URL's host, creating it on first use"""
+    host = urlsplit(url).netloc or 'default'
+    session = _sessions.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = _build_session(host)
+                _sessions[host] = session
+    return session
+
+
+def request(method, url, **kwargs):
+    """requests.request() on the pooled session, with a default timeout"""
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    return get_session(url).request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def close_all():
+    """Close every pooled session (called on shutdown)"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,113 @@
+"""
+image_store.py — Content-addressed store for generated images served by URL
+Generated images used to travel as base64 inside JSON (33% larger, encoded
+on every response, never HTTP-cached). Now the generate path stores the raw
+bytes here and returns /api/images/<image_id>. The id is the SHA-256 of the
+bytes, so it doubles as a strong ETag and an image can be cached forever.
+
+Storage reuses the tiered design cache: bounded memory L1 in front of the
+shared SQLite L2 (per DESIGN_CACHE_BACKEND), with its own TTL and budgets.
+
+The bytes are only kept for IMAGE_STORE_TTL (or less under the byte budget),
+but image URLs live on in the frontend. Once an image is on Cloudinary its
+durable URL is recorded here for IMAGE_LOCATION_TTL, and /api/images/<id>
+redirects there after the bytes are gone.
+"""
+
+import os
+import hashlib
+import logging
+
+from config import BASE_DIR
+from design_cache import TieredDesignCache, create_cache_backend
+
+logger = logging.getLogger(__name__)
+
+IMAGE_STORE_TTL = int(os.getenv('IMAGE_STORE_TTL', '86400'))  # 1 day
+IMAGE_STORE_MAX_BYTES = int(float(os.getenv('IMAGE_STORE_MAX_MB', '64')) * 1024 * 1024)
+IMAGE_STORE_DISK_MAX_BYTES = int(float(os.getenv('IMAGE_STORE_DISK_MAX_MB', '1024')) * 1024 * 1024)
+IMAGE_STORE_SQLITE_PATH = os.getenv('IMAGE_STORE_SQLITE_PATH', os.path.join(BASE_DIR, '.cache', 'images.sqlite3'))
+IMAGE_LOCATION_TTL = int(os.getenv('IMAGE_LOCATION_TTL', str(90 * 86400)))  # 90 days
+IMAGE_LOCATION_SQLITE_PATH = os.getenv(
+    'IMAGE_LOCATION_SQLITE_PATH',
+    os.path.join(BASE_DIR, '.cache', 'image_locations.sqlite3')
+)
+
+# Leading bytes -> MIME type for the formats Replicate and Pillow produce
+_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF8', 'image/gif'),
+)
+
+_store = TieredDesignCache(
+    backend=create_cache_backend(IMAGE_STORE_SQLITE_PATH, IMAGE_STORE_DISK_MAX_BYTES),
+    max_bytes=IMAGE_STORE_MAX_BYTES,
+    ttl=IMAGE_STORE_TTL
+)
+_store.start_janitor()
+
+# image key -> durable (Cloudinary) URL; entries carry no bytes, only {'url': ...}
+_locations = TieredDesignCache(
+    backend=create_cache_backend(IMAGE_LOCATION_SQLITE_PATH, 64 * 1024 * 1024),
+    max_bytes=8 * 1024 * 1024,
+    ttl=IMAGE_LOCATION_TTL
+)
+_locations.start_janitor()
+
+
+def image_id_for(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()[:32]
+
+
+def sniff_content_type(image_bytes):
+    for signature, content_type in _SIGNATURES:
+        if image_bytes.startswith(signature):
+            return content_type
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return 'image/webp'
+    if image_bytes[4:12] in (b'ftypavif', b'ftypavis'):
+        return 'image/avif'
+    return 'application/octet-stream'
+
+
+def put_image(key, image_bytes, client_name='default'):
+    """Store bytes under an explicit key (derived images: '<image_id>_<width>.<format>')"""
+    _store.set(key, client_name, {'content_type': sniff_content_type(image_bytes)}, image_bytes)
+
+
+def store_image(image_bytes, client_name='default'):
+    """
+    Keep the bytes servable (storing the same image twice is free).
+    Returns (image_id, created) - created is False when it was already stored.
+    """
+    image_id = image_id_for(image_bytes)
+    if _store.get(image_id):
+        return image_id, False
+    put_image(image_id, image_bytes, client_name)
+    return image_id, True
+
+
+def get_image(key):
+    """(image_bytes, content_type) or None if unknown/expired"""
+    stored = _store.get(key)
+    if not stored:
+        return None
+    metadata, image_bytes = stored
+    return image_bytes, metadata['content_type']
+
+
+def set_image_location(key, url, client_name='default'):
+    """Remember where an image (or rendition) lives durably, for after its bytes expire here"""
+    if url:
+        _locations.set(key, client_name, {'url': url}, b'')
+
+
+def get_image_location(key):
+    """Durable URL recorded for an image key, or None"""
+    stored = _locations.get(key)
+    return stored[0]['url'] if stored else None
+
+
+def get_image_store_stats():
+    return {**_store.stats(), 'locations': _locations.stats()}
@@ -0,0 +1,11 @@
+-- ============================================
+-- MIGRATION: user_generations.derivatives
+-- Run once on databases created before the column existed
+-- (data.sql drops and recreates every table - do not use it to upgrade).
+-- Safe to re-run.
+-- ============================================
+
+ALTER TABLE user_generations
+    ADD COLUMN IF NOT EXISTS derivatives JSONB DEFAULT '{}'::jsonb;
+
+COMMENT ON COLUMN user_generations.derivatives IS 'Cloudinary URLs of the WebP thumbnail/medium renditions, keyed by size';
@@ -0,0 +1,29 @@
+-- ============================================
+-- MIGRATION: apply_counter_deltas RPC
+-- Run once on databases created before the write-behind counters
+-- (counters.py flushes client_stats / users.total_generations through it;
+-- without it every flush fails). data.sql drops and recreates every
+-- table - do not use it to upgrade. Safe to re-run.
+-- ============================================
+
+-- p_client_deltas: {"skyline": 3, ...}   p_user_deltas: {"<user uuid>": 1, ...}
+CREATE OR REPLACE FUNCTION apply_counter_deltas(
+    p_client_deltas JSONB,
+    p_user_deltas JSONB
+)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO client_stats (client_name, total_generations, total_downloads)
+    SELECT d.key, d.value::INTEGER, 0
+    FROM jsonb_each_text(COALESCE(p_client_deltas, '{}'::JSONB)) d
+    ON CONFLICT (client_name) DO UPDATE
+    SET 
+        total_generations = COALESCE(client_stats.total_generations, 0) + EXCLUDED.total_generations,
+        updated_at = NOW();
+    
+    UPDATE users u
+    SET total_generations = COALESCE(u.total_generations, 0) + d.value::INTEGER
+    FROM jsonb_each_text(COALESCE(p_user_deltas, '{}'::JSONB)) d
+    WHERE u.id = d.key::UUID;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,128 @@
+"""
+model_versions.py — Replicate model version, refreshed off the request path
+The latest version is fetched at startup and renewed in the background
+before it expires (refresh-ahead). Callers always get the current value
+immediately; an expired value is still served while one background refresh
+runs (stale-while-revalidate). Flows can be pinned to a fixed version via
+MODEL_VERSION_PINS in config.
+"""
+
+import os
+import time
+import logging
+import threading
+
+import http_client
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_DURATION = int(os.getenv('MODEL_VERSION_TTL', '3600'))  # 1 hour
+VERSION_REFRESH_AHEAD = float(os.getenv('MODEL_VERSION_REFRESH_AHEAD', '0.8'))  # refresh at 80% of TTL
+VERSION_RETRY_DELAY = int(os.getenv('MODEL_VERSION_RETRY_DELAY', '30'))
+VERSION_COLD_WAIT = float(os.getenv('MODEL_VERSION_COLD_WAIT', '30'))  # max wait behind a running fetch
+
+
+class ModelVersionCache:
+    """Latest version of one Replicate model plus optional per-flow pins"""
+
+    def __init__(self, api_base, api_token, model, pins=None, ttl=VERSION_CACHE_DURATION):
+        self.url = f"{api_base}/models/{model}"
+        self.api_token = api_token
+        self.model = model
+        self.pins = {flow: v for flow, v in (pins or {}).items() if v}
+        self.ttl = ttl
+        self._version = None
+        self._fetched_at = None
+        self._last_attempt = 0
+        self._refreshing = threading.Lock()
+        self._started = False
+        self._stats = {'refreshes': 0, 'failures': 0, 'stale_served': 0, 'last_error': None}
+
+    def _fetch(self):
+        response = http_client.get(
+            self.url,
+            headers={"Authorization": f"Token {self.api_token}"},
+            timeout=15
+        )
+        if response.status_code != 200:
+            raise Exception(f"Model fetch failed: {response.status_code}")
+        version = response.json().get("latest_version", {}).get("id")
+        if not version:
+            raise Exception("No model version found")
+        return version
+
+    def refresh(self, wait=False):
+        """
+        Fetch the latest version now; keeps the previous value on failure. Returns True on success.
+        wait=True queues behind a refresh that is already running and reuses its result.
+        """
+        requested_at = time.time()
+        if wait:
+            if not self._refreshing.acquire(timeout=VERSION_COLD_WAIT):
+                return False
+            if self._fetched_at and self._fetched_at >= requested_at:
+                self._refreshing.release()
+                return True  # the refresh we waited for got it
+        elif not self._refreshing.acquire(blocking=False):
+            return False  # another refresh is already running
+        self._last_attempt = time.time()
+        try:
+            version = self._fetch()
+            if version != self._version:
+                logger.info(f"[MODEL] ✅ {self.model} version {version[:16]}...")
+            self._version = version
+            self._fetched_at = time.time()
+            self._stats['refreshes'] += 1
+            self._stats['last_error'] = None
+            return True
+        except Exception as e:
+            self._stats['failures'] += 1
+            self._stats['last_error'] = str(e)
+            logger.warning(f"[MODEL] Version refresh failed: {e}")
+            return False
+        finally:
+            self._refreshing.release()
+
+    def get(self, flow='style'):
+        """Version for a flow - never blocks on the network once a version is known"""
+        pinned = self.pins.get(flow)
+        if pinned:
+            return pinned
+
+        if self._version is None:
+            # Cold start before the first background fetch finished - wait for it (or fetch ourselves)
+            self.refresh(wait=True)
+            if self._version is None:
+                raise Exception(self._stats['last_error'] or "No model version available")
+            return self._version
+
+        now = time.time()
+        if now - self._fetched_at >= self.ttl:
+            self._stats['stale_served'] += 1
+            if now - self._last_attempt >= VERSION_RETRY_DELAY:
+                threading.Thread(target=self.refresh, daemon=True).start()
+        return self._version
+
+    def start(self):
+        """Fetch now, then keep renewing before expiry"""
+        if self._started:
+            return
+        self._started = True
+
+        def run():
+            while True:
+                refreshed = self.refresh()
+                time.sleep(self.ttl * VERSION_REFRESH_AHEAD if refreshed else VERSION_RETRY_DELAY)
+
+        threading.Thread(target=run, daemon=True, name='model-version-refresher').start()
+
+    def stats(self):
+        age = round(time.time() - self._fetched_at, 1) if self._fetched_at else None
+        return {
+            'model': self.model,
+            'latest_version': self._version,
+            'age_seconds': age,
+            'ttl': self.ttl,
+            'pinned': self.pins,
+            **self._stats
+        }
@@ -10,7 +10,7 @@ import os
 import json
 import re
 import logging
-import requests
+import http_client
 from datetime import datetime, timedelta, timezone
 from groq import Groq
 
@@ -45,7 +45,7 @@ def zip_to_location(zip_code):
     """
     url = "https://maps.googleapis.com/maps/api/geocode/json"
     params = {'address': zip_code, 'key': GOOGLE_MAPS_KEY}
-    resp = requests.get(url, params=params, timeout=10)
+    resp = http_client.get(url, params=params, timeout=10)
     data = resp.json()
 
     if data.get('status') != 'OK' or not data.get('results'):
@@ -136,7 +136,7 @@ def fetch_news(area_name, city):
         'apiKey': NEWS_API_KEY
     }
     logger.info(f"[NEWS FETCH] Query: {query}")
-    resp = requests.get(url, params=params, timeout=10)
+    resp = http_client.get(url, params=params, timeout=10)
     data = resp.json()
     logger.info(
         f"[NEWS FETCH] status={data.get('status')}, "
@@ -156,7 +156,7 @@ def fetch_news(area_name, city):
         logger.info("[NEWS FETCH] Sparse results, retrying with broader location-only query")
         fallback_params = dict(params)
         fallback_params['q'] = f'"{area_name}"' if area_name else f'"{city}"'
-        resp = requests.get(url, params=fallback_params, timeout=10)
+        resp = http_client.get(url, params=fallback_params, timeout=10)
         data = resp.json()
         if data.get('status') == 'ok':
             articles_raw = data.get('articles', [])
@@ -0,0 +1,332 @@
+"""
+outbox.py — Durable outbox for post-generation side effects
+A generated image is shown to the user before it is uploaded to Cloudinary
+and recorded in Supabase. If the process dies in between, that lead data is
+gone. enqueue() commits the job (payload + image bytes) to a local SQLite
+file *before* the response is returned. A drainer runs it on the background
+'upload' pool, retries with exponential backoff, and at startup replays
+anything left unfinished.
+
+Jobs are keyed by an idempotency key and handlers checkpoint each completed
+step (job.checkpoint), so a replay resumes after the last finished step
+instead of redoing it.
+
+A job keeps retrying for OUTBOX_RETRY_WINDOW (hours, so it outlives an
+outage of Supabase or Cloudinary) before it is marked dead. Dead jobs can be
+put back in the queue with requeue_dead(); their image bytes are dropped
+after OUTBOX_DEAD_RETENTION so a misconfigured dependency can't grow the
+file without bound.
+"""
+
+import os
+import json
+import time
+import random
+import sqlite3
+import logging
+import threading
+
+from config import BASE_DIR
+from background_tasks import submit_task
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_PATH = os.getenv('OUTBOX_PATH', os.path.join(BASE_DIR, '.cache', 'outbox.sqlite3'))
+OUTBOX_RETRY_WINDOW = int(os.getenv('OUTBOX_RETRY_WINDOW', str(12 * 3600)))  # keep retrying for 12 hours
+OUTBOX_RETRY_BASE = float(os.getenv('OUTBOX_RETRY_BASE', '5'))  # seconds, doubled per attempt
+OUTBOX_RETRY_MAX = float(os.getenv('OUTBOX_RETRY_MAX', '900'))
+OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', '300'))
+OUTBOX_POLL_INTERVAL = int(os.getenv('OUTBOX_POLL_INTERVAL', '30'))
+OUTBOX_RETENTION = int(os.getenv('OUTBOX_RETENTION', '86400'))  # keep finished rows for a day
+OUTBOX_DEAD_RETENTION = int(os.getenv('OUTBOX_DEAD_RETENTION', str(7 * 86400)))  # then drop dead rows' images
+
+# kind -> handler(job); a handler raises to request a retry
+_handlers = {}
+
+
+class OutboxJob:
+    """What a handler sees: payload, image bytes and step progress it can checkpoint"""
+
+    def __init__(self, outbox, key, kind, payload, blob, progress, attempts):
+        self.outbox = outbox
+        self.key = key
+        self.kind = kind
+        self.payload = payload
+        self.blob = blob
+        self.progress = progress
+        self.attempts = attempts
+
+    def checkpoint(self, step, value=True):
+        """Persist a finished step so a replay skips it"""
+        self.progress[step] = value
+        if self.outbox:
+            self.outbox._save_progress(self.key, self.progress)
+
+
+class Outbox:
+    """SQLite-backed job table with leases, so concurrent workers never run the same job twice"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn().executescript("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                blob BLOB,
+                progress TEXT NOT NULL DEFAULT '{}',
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                next_attempt_at REAL NOT NULL,
+                leased_until REAL NOT NULL DEFAULT 0,
+                finished_at REAL,
+                retry_until REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(state, next_attempt_at);
+        """)
+        try:
+            # Outbox files created before the retry window existed
+            self._conn().execute("ALTER TABLE outbox ADD COLUMN retry_until REAL")
+        except sqlite3.OperationalError:
+            pass  # already there
+
+    def _conn(self):
+        """One connection per thread; synchronous=FULL because this is the durability point"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            self._local.conn = conn
+        return conn
+
+    def add(self, key, kind, payload, blob):
+        """Commit a job; re-adding an existing key is a no-op. Returns True if it was new."""
+        now = time.time()
+        return self._conn().execute(
+            "INSERT OR IGNORE INTO outbox (key, kind, payload, blob, created_at, next_attempt_at, retry_until) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, kind, json.dumps(payload), sqlite3.Binary(blob) if blob is not None else None,
+             now, now, now + OUTBOX_RETRY_WINDOW)
+        ).rowcount == 1
+
+    def claim(self, key):
+        """Lease a pending job for this worker; None if it is finished, not due, or leased elsewhere"""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            claimed = conn.execute(
+                "UPDATE outbox SET leased_until = ? "
+                "WHERE key = ? AND state = 'pending' AND next_attempt_at <= ? AND leased_until <= ?",
+                (now + OUTBOX_LEASE_SECONDS, key, now, now)
+            ).rowcount
+            if not claimed:
+                return None
+            row = conn.execute(
+                "SELECT kind, payload, blob, progress, attempts FROM outbox WHERE key = ?", (key,)
+            ).fetchone()
+        kind, payload, blob, progress, attempts = row
+        return OutboxJob(self, key, kind, json.loads(payload),
+                         bytes(blob) if blob is not None else None, json.loads(progress), attempts)
+
+    def _save_progress(self, key, progress):
+        self._conn().execute("UPDATE outbox SET progress = ? WHERE key = ?", (json.dumps(progress), key))
+
+    def complete(self, key):
+        """Mark done and drop the image bytes - only the audit row is kept"""
+        self._conn().execute(
+            "UPDATE outbox SET state = 'done', blob = NULL, leased_until = 0, finished_at = ? WHERE key = ?",
+            (time.time(), key)
+        )
+
+    def fail(self, key, attempts, error):
+        """Schedule a retry with jittered exponential backoff, or give up once OUTBOX_RETRY_WINDOW has passed"""
+        now = time.time()
+        retry_until = self._conn().execute(
+            "SELECT COALESCE(retry_until, created_at + ?) FROM outbox WHERE key = ?",
+            (OUTBOX_RETRY_WINDOW, key)
+        ).fetchone()[0]
+        if now >= retry_until:
+            self._conn().execute(
+                "UPDATE outbox SET state = 'dead', attempts = ?, last_error = ?, leased_until = 0, finished_at = ? "
+                "WHERE key = ?",
+                (attempts, error, now, key)
+            )
+            return None
+        delay = min(OUTBOX_RETRY_MAX, OUTBOX_RETRY_BASE * (2 ** (attempts - 1)))
+        delay *= random.uniform(0.8, 1.2)
+        self._conn().execute(
+            "UPDATE outbox SET attempts = ?, last_error = ?, next_attempt_at = ?, leased_until = 0 WHERE key = ?",
+            (attempts, error, now + delay, key)
+        )
+        return delay
+
+    def due_keys(self, limit=100):
+        now = time.time()
+        return [row[0] for row in self._conn().execute(
+            "SELECT key FROM outbox WHERE state = 'pending' AND next_attempt_at <= ? AND leased_until <= ? "
+            "ORDER BY next_attempt_at LIMIT ?",
+            (now, now, limit)
+        )]
+
+    def requeue_dead(self, keys=None):
+        """Give dead jobs (all, or just these keys) a fresh retry window. Returns how many were requeued."""
+        now = time.time()
+        query = ("UPDATE outbox SET state = 'pending', attempts = 0, next_attempt_at = ?, retry_until = ?, "
+                 "leased_until = 0, finished_at = NULL WHERE state = 'dead'")
+        params = [now, now + OUTBOX_RETRY_WINDOW]
+        if keys is not None:
+            query += f" AND key IN ({', '.join('?' * len(keys))})" if keys else " AND 0"
+            params += list(keys)
+        return self._conn().execute(query, params).rowcount
+
+    def prune(self):
+        """
+        Forget finished rows after OUTBOX_RETENTION. Dead rows stay (they can be requeued)
+        but lose their image after OUTBOX_DEAD_RETENTION - a requeue then relies on the source URL.
+        """
+        conn = self._conn()
+        now = time.time()
+        removed = conn.execute(
+            "DELETE FROM outbox WHERE state = 'done' AND finished_at < ?",
+            (now - OUTBOX_RETENTION,)
+        ).rowcount
+        conn.execute(
+            "UPDATE outbox SET blob = NULL WHERE state = 'dead' AND blob IS NOT NULL AND finished_at < ?",
+            (now - OUTBOX_DEAD_RETENTION,)
+        )
+        return removed
+
+    def stats(self):
+        counts = dict(self._conn().execute("SELECT state, COUNT(*) FROM outbox GROUP BY state").fetchall())
+        oldest = self._conn().execute(
+            "SELECT MIN(created_at) FROM outbox WHERE state = 'pending'"
+        ).fetchone()[0]
+        return {
+            'pending': counts.get('pending', 0),
+            'done': counts.get('done', 0),
+            'dead': counts.get('dead', 0),
+            'oldest_pending_age': round(time.time() - oldest, 1) if oldest else 0
+        }
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+_local_stats = {'enqueued': 0, 'completed': 0, 'retried': 0, 'dead': 0, 'non_durable': 0}
+
+
+def register_handler(kind, handler):
+    """handler(job) performs the side effects; raise to retry"""
+    _handlers[kind] = handler
+
+
+def _get_outbox():
+    """Open the outbox lazily; None when the filesystem is not writable (e.g. serverless)"""
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            try:
+                _outbox = Outbox(OUTBOX_PATH)
+                logger.info(f"[OUTBOX] ✅ Durable outbox at {OUTBOX_PATH}")
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"[OUTBOX] Outbox unavailable ({e}) - side effects are not durable")
+                _outbox = False
+        return _outbox or None
+
+
+def _run_job(key):
+    """Claim, run, and record the outcome of one job"""
+    outbox = _get_outbox()
+    job = outbox.claim(key)
+    if not job:
+        return
+
+    try:
+        _handlers[job.kind](job)
+    except Exception as e:
+        attempts = job.attempts + 1
+        delay = outbox.fail(key, attempts, str(e))
+        if delay is None:
+            _local_stats['dead'] += 1
+            logger.error(f"[OUTBOX] ❌ {job.kind} {key} gave up after {attempts} attempt(s): {e}")
+        else:
+            _local_stats['retried'] += 1
+            logger.warning(f"[OUTBOX] {job.kind} {key} failed (attempt {attempts}), retrying in {delay:.0f}s: {e}")
+        return
+
+    outbox.complete(key)
+    _local_stats['completed'] += 1
+    logger.info(f"[OUTBOX] ✅ {job.kind} {key} done")
+
+
+def _run_non_durable(kind, key, payload, blob):
+    """Fallback when there is no outbox file: run once in memory, no retries"""
+    _handlers[kind](OutboxJob(None, key, kind, payload, blob, {}, 0))
+
+
+def enqueue(kind, key, payload, blob=None):
+    """Durably record a side-effect job, then start it on the background upload pool"""
+    outbox = _get_outbox()
+    if not outbox:
+        _local_stats['non_durable'] += 1
+        return submit_task('upload', _run_non_durable, kind, key, payload, blob)
+
+    try:
+        if outbox.add(key, kind, payload, blob):
+            _local_stats['enqueued'] += 1
+    except sqlite3.Error as e:
+        # Disk full / database locked - the image is already generated, so still run it (just not durably)
+        logger.error(f"[OUTBOX] ❌ Could not record {kind} {key} ({e}) - running it without durability")
+        _local_stats['non_durable'] += 1
+        return submit_task('upload', _run_non_durable, kind, key, payload, blob)
+    # If the pool rejects it, the drainer's next poll picks it up
+    return submit_task('upload', _run_job, key)
+
+
+def requeue_dead(keys=None):
+    """Retry dead jobs (all, or the given keys) - e.g. once the failing dependency is fixed"""
+    outbox = _get_outbox()
+    if not outbox:
+        return 0
+    requeued = outbox.requeue_dead(keys)
+    if requeued:
+        logger.info(f"[OUTBOX] Requeued {requeued} dead job(s)")
+    return requeued
+
+
+def start_drainer():
+    """Replay unfinished jobs now (crash recovery), then poll for retries every OUTBOX_POLL_INTERVAL"""
+    if not _get_outbox():
+        return
+
+    def run():
+        while True:
+            try:
+                outbox = _get_outbox()
+                keys = outbox.due_keys()
+                if keys:
+                    logger.info(f"[OUTBOX] Replaying {len(keys)} due job(s)")
+                for key in keys:
+                    submit_task('upload', _run_job, key)
+                outbox.prune()
+            except Exception as e:
+                logger.error(f"[OUTBOX] ❌ Drainer error: {e}")
+            time.sleep(OUTBOX_POLL_INTERVAL)
+
+    threading.Thread(target=run, daemon=True, name='outbox-drainer').start()
+
+
+def get_outbox_stats():
+    outbox = _get_outbox()
+    stats = dict(_local_stats, durable=bool(outbox))
+    if outbox:
+        try:
+            stats.update(outbox.stats())
+        except sqlite3.Error as e:
+            stats['error'] = str(e)
+    return stats
@@ -0,0 +1,241 @@
+"""
+prediction_poller.py — One shared poller for every in-flight Replicate prediction
+Each generation used to poll its own prediction every 0.3s, so 20 concurrent
+generations meant ~65 GETs/s to Replicate. Here a single scheduler thread
+tracks all prediction ids and polls each one on its own schedule:
+
+- rarely while the prediction is far from its expected completion time
+  (a moving average of recent durations per flow),
+- every POLLER_MIN_INTERVAL around the expected finish,
+- backing off again if it runs long.
+
+A 429/503 with Retry-After pauses all polling until then (the limit is
+account-wide). Waiters get a Future resolved with the terminal payload.
+Poll outcomes and prediction timeouts are reported to the optional circuit
+breaker, so a Replicate outage trips it even when no new predictions start.
+"""
+
+import os
+import time
+import heapq
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import http_client
+from replicate_webhooks import TERMINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+POLLER_MIN_INTERVAL = float(os.getenv('POLLER_MIN_INTERVAL', '0.5'))
+POLLER_MAX_INTERVAL = float(os.getenv('POLLER_MAX_INTERVAL', '5'))
+POLLER_EXPECTED_SECONDS = float(os.getenv('POLLER_EXPECTED_SECONDS', '8'))  # before any prediction finished
+POLLER_TIMEOUT = float(os.getenv('POLLER_TIMEOUT', '75'))
+POLLER_WORKERS = int(os.getenv('POLLER_WORKERS', '4'))  # concurrent GETs
+POLLER_DEFAULT_RETRY_AFTER = 5.0
+EXPECTED_SMOOTHING = 0.2  # weight of the newest duration in the moving average
+
+
+def parse_retry_after(value):
+    """Retry-After as seconds (delta-seconds or HTTP-date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class _Watch:
+    """One tracked prediction"""
+
+    def __init__(self, prediction_id, kind, on_status):
+        self.prediction_id = prediction_id
+        self.kind = kind
+        self.on_status = on_status
+        self.future = Future()
+        self.created_at = time.time()
+        self.status = None
+
+
+class PredictionPoller:
+    """Single scheduler thread + a few HTTP workers shared by all waiting generations"""
+
+    def __init__(self, api_base, api_token, workers=POLLER_WORKERS, breaker=None):
+        self.api_base = api_base
+        self.api_token = api_token
+        self.breaker = breaker
+        self._watches = {}
+        self._schedule = []  # heap of (due_at, prediction_id)
+        self._expected = {}  # kind -> moving average of prediction duration
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='poller')
+        self._thread = None
+        self._stats = {'watched': 0, 'completed': 0, 'timeouts': 0, 'polls': 0,
+                       'poll_errors': 0, 'rate_limited': 0}
+
+    def expected_seconds(self, kind):
+        return self._expected.get(kind, POLLER_EXPECTED_SECONDS)
+
+    def _next_interval(self, watch):
+        """Sleep until about halfway to the expected finish, then poll tightly, then back off"""
+        elapsed = time.time() - watch.created_at
+        remaining = self.expected_seconds(watch.kind) - elapsed
+        if remaining > 0:
+            interval = remaining / 2
+        else:
+            interval = -remaining / 4  # overdue: back off gradually
+        return min(POLLER_MAX_INTERVAL, max(POLLER_MIN_INTERVAL, interval))
+
+    def watch(self, prediction_id, kind='default', on_status=None):
+        """
+        Start tracking a prediction. Returns a Future resolved with the terminal
+        payload, or None on POLLER_TIMEOUT. on_status(status) runs on a poller thread.
+        """
+        watch = _Watch(prediction_id, kind, on_status)
+        with self._cond:
+            self._ensure_thread()
+            self._watches[prediction_id] = watch
+            self._stats['watched'] += 1
+            heapq.heappush(self._schedule, (time.time() + self._next_interval(watch), prediction_id))
+            self._cond.notify()
+        return watch.future
+
+    def wait(self, prediction_id, kind='default', on_status=None):
+        """Blocking convenience wrapper around watch()"""
+        return self.watch(prediction_id, kind, on_status).result()
+
+    def _ensure_thread(self):
+        """Caller holds the lock"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name='prediction-poller')
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.time()
+                    if self._schedule:
+                        due_at = max(self._schedule[0][0], self._paused_until)
+                        if due_at <= now:
+                            break
+                        self._cond.wait(due_at - now)
+                    else:
+                        self._cond.wait()
+                _, prediction_id = heapq.heappop(self._schedule)
+                watch = self._watches.get(prediction_id)
+            if not watch:
+                continue
+            try:
+                self._executor.submit(self._poll, watch)
+            except RuntimeError:
+                # Interpreter is exiting - release the waiter instead of leaving it blocked
+                self._finish(watch, None)
+
+    def _reschedule(self, watch, delay):
+        with self._cond:
+            heapq.heappush(self._schedule, (time.time() + delay, watch.prediction_id))
+            self._cond.notify()
+
+    def _record(self, ok, duration=0.0):
+        if self.breaker:
+            self.breaker.record(ok, duration)
+
+    def _finish(self, watch, payload):
+        with self._cond:
+            self._watches.pop(watch.prediction_id, None)
+            if payload is None:
+                self._stats['timeouts'] += 1
+            else:
+                self._stats['completed'] += 1
+                duration = time.time() - watch.created_at
+                previous = self._expected.get(watch.kind, duration)
+                self._expected[watch.kind] = previous + EXPECTED_SMOOTHING * (duration - previous)
+        watch.future.set_result(payload)
+
+    def _poll(self, watch):
+        """Executor task - any unexpected error reschedules the poll, so the Future always resolves"""
+        try:
+            self._poll_once(watch)
+        except Exception as e:
+            with self._cond:
+                self._stats['poll_errors'] += 1
+            logger.error(f"[POLLER] ❌ Poll of {watch.prediction_id[:12]} raised: {e}")
+            if not watch.future.done():
+                self._reschedule(watch, POLLER_MAX_INTERVAL)
+
+    def _poll_once(self, watch):
+        if time.time() - watch.created_at > POLLER_TIMEOUT:
+            logger.warning(f"[POLLER] Prediction {watch.prediction_id[:12]} timed out after {POLLER_TIMEOUT:.0f}s")
+            self._record(False)
+            self._finish(watch, None)
+            return
+
+        with self._cond:
+            self._stats['polls'] += 1
+        started = time.time()
+        try:
+            response = http_client.get(
+                f"{self.api_base}/predictions/{watch.prediction_id}",
+                headers={"Authorization": f"Token {self.api_token}"},
+                timeout=15
+            )
+        except Exception as e:
+            self._record(False, time.time() - started)
+            with self._cond:
+                self._stats['poll_errors'] += 1
+            logger.warning(f"[POLLER] Poll failed for {watch.prediction_id[:12]}: {e}")
+            self._reschedule(watch, POLLER_MAX_INTERVAL)
+            return
+
+        # 429/5xx mean Replicate is struggling; other statuses are answers
+        self._record(response.status_code < 500 and response.status_code != 429, time.time() - started)
+
+        if response.status_code in (429, 503):
+            delay = parse_retry_after(response.headers.get('Retry-After')) or POLLER_DEFAULT_RETRY_AFTER
+            with self._cond:
+                self._stats['rate_limited'] += 1
+                self._paused_until = max(self._paused_until, time.time() + delay)
+            logger.warning(f"[POLLER] Replicate returned {response.status_code} - pausing polls for {delay:.1f}s")
+            self._reschedule(watch, delay)
+            return
+
+        if response.status_code != 200:
+            with self._cond:
+                self._stats['poll_errors'] += 1
+            self._reschedule(watch, POLLER_MAX_INTERVAL)
+            return
+
+        payload = response.json()
+        status = payload.get("status")
+        if status != watch.status:
+            watch.status = status
+            if watch.on_status:
+                try:
+                    watch.on_status(status)
+                except Exception as e:
+                    logger.warning(f"[POLLER] Status callback failed: {e}")
+
+        if status in TERMINAL_STATUSES:
+            self._finish(watch, payload)
+        else:
+            self._reschedule(watch, self._next_interval(watch))
+
+    def stats(self):
+        with self._cond:
+            finished = self._stats['completed'] + self._stats['timeouts']
+            return {
+                **self._stats,
+                'in_flight': len(self._watches),
+                'polls_per_prediction': round(self._stats['polls'] / finished, 1) if finished else 0,
+                'expected_seconds': {kind: round(v, 1) for kind, v in self._expected.items()},
+                'paused_for': round(max(0.0, self._paused_until - time.time()), 1)
+            }
@@ -0,0 +1,96 @@
+"""
+prompt_index.py — Near-duplicate lookup over cached custom-theme prompts
+Custom themes are cached under their normalized text (prompts.normalize_cache_prompt),
+which already folds case, punctuation, stopwords and plurals. This index also
+catches near-duplicates ('batman gotham night' vs 'batman night'): per
+(client, room) it keeps the token sets of recently cached prompts plus an
+inverted token index, and returns the most similar one when its token-set
+(Jaccard) similarity reaches PROMPT_MATCH_THRESHOLD.
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+
+logger = logging.getLogger(__name__)
+
+PROMPT_MATCH_THRESHOLD = float(os.getenv('PROMPT_MATCH_THRESHOLD', '0.75'))
+PROMPT_INDEX_MAX_PER_BUCKET = int(os.getenv('PROMPT_INDEX_MAX_PER_BUCKET', '500'))
+
+
+class PromptSimilarityIndex:
+    """Bounded LRU of cache key -> token set per (client, room), with token -> keys postings"""
+
+    def __init__(self, threshold=PROMPT_MATCH_THRESHOLD, max_per_bucket=PROMPT_INDEX_MAX_PER_BUCKET):
+        self.threshold = threshold
+        self.max_per_bucket = max_per_bucket
+        self._entries = defaultdict(OrderedDict)  # bucket -> {cache_key: frozenset(tokens)}
+        self._postings = defaultdict(lambda: defaultdict(set))  # bucket -> token -> {cache_key}
+        self._lock = threading.Lock()
+        self._stats = {'exact': 0, 'fuzzy': 0, 'misses': 0}
+
+    def _remove(self, bucket, cache_key):
+        """Caller holds the lock"""
+        tokens = self._entries[bucket].pop(cache_key, None)
+        for token in tokens or ():
+            keys = self._postings[bucket][token]
+            keys.discard(cache_key)
+            if not keys:
+                del self._postings[bucket][token]
+
+    def add(self, client_name, room_type, cache_key, tokens):
+        bucket = (client_name, room_type)
+        with self._lock:
+            self._remove(bucket, cache_key)
+            self._entries[bucket][cache_key] = frozenset(tokens)
+            for token in tokens:
+                self._postings[bucket][token].add(cache_key)
+            while len(self._entries[bucket]) > self.max_per_bucket:
+                self._remove(bucket, next(iter(self._entries[bucket])))
+
+    def discard(self, client_name, room_type, cache_key):
+        """Forget a key whose cache entry has expired"""
+        with self._lock:
+            self._remove((client_name, room_type), cache_key)
+
+    def match(self, client_name, room_type, tokens, threshold=None):
+        """(cache_key, similarity) of the closest cached prompt at or above the threshold, else None"""
+        threshold = self.threshold if threshold is None else threshold
+        bucket = (client_name, room_type)
+        query = frozenset(tokens)
+        if not query:
+            return None
+
+        with self._lock:
+            entries = self._entries.get(bucket)
+            if not entries:
+                self._stats['misses'] += 1
+                return None
+            # Only prompts sharing at least one token can be similar
+            candidates = set()
+            for token in query:
+                candidates |= self._postings[bucket].get(token, set())
+
+            best = None
+            for cache_key in candidates:
+                stored = entries[cache_key]
+                similarity = len(query & stored) / len(query | stored)
+                if similarity >= threshold and (best is None or similarity > best[1]):
+                    best = (cache_key, similarity)
+
+            if best:
+                entries.move_to_end(best[0])
+                self._stats['exact' if best[1] == 1.0 else 'fuzzy'] += 1
+            else:
+                self._stats['misses'] += 1
+            return best
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                'threshold': self.threshold,
+                'buckets': len(self._entries),
+                'prompts': sum(len(entries) for entries in self._entries.values())
+            }
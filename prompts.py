@@ -565,7 +565,8 @@ from config import (
     THEME_ELEMENTS,
     ROOM_DESCRIPTIONS
 )
-import re
+import unicodedata
+from functools import lru_cache
 
 
 # ============================================================
@@ -783,129 +784,237 @@ Maintain: exact furniture placement, room structure, architectural elements."""
     return prompt
 
 
+# Photorealistic theme mappings
+THEME_MAPPINGS = {
+    'superman': {
+        'colors': 'bold primary red (#DC2626), royal blue (#1E40AF), bright yellow (#FBBF24) - colors with realistic fabric texture',
+        'materials': 'smooth heroic surfaces with subtle sheen, brushed metallic accents resembling actual superhero costume materials, cape-like silk fabrics with natural draping',
+        'textures': 'satin finish with light reflectivity, embossed S-shield patterns with dimensional depth, comic book art with authentic print texture',
+        'decor': 'framed vintage comic covers with paper texture, collectible figures with realistic plastic finish, movie posters with authentic printing',
+        'lighting': 'dramatic heroic lighting with strong key light (3500K), rim lighting creating subtle edge glow, shadows suggesting power',
+        'mood': 'heroic, powerful, inspiring - photographed like high-end collectibles showcase',
+        'photography': 'shot with dramatic lighting setup mimicking superhero movie poster style, vibrant but realistic color grading'
+    },
+    'batman': {
+        'colors': 'matte black (#0A0A0A), charcoal grey (#374151), tactical yellow (#EAB308), midnight blue (#1E3A8A)',
+        'materials': 'genuine leather textures with age marks, industrial brushed metals with subtle scratches, dark matte surfaces with slight reflectivity',
+        'textures': 'distressed leather with natural creasing, carbon fiber patterns, weathered metal with authentic patina',
+        'decor': 'bat symbol metal wall art with dimensional casting, framed Gotham noir photography, tactical equipment displays with realistic materials',
+        'lighting': 'moody low-key lighting (2200K warm shadows, 4000K cool highlights), dramatic shadows suggesting vigilante atmosphere, subtle backlight creating depth',
+        'mood': 'dark, mysterious, sophisticated - shot with noir cinematography techniques',
+        'photography': 'low-key photography with controlled shadows, film noir aesthetic, professional dark mood lighting'
+    },
+    'underwater': {
+        'colors': 'deep ocean blue gradient (#0C4A6E to #075985), turquoise (#14B8A6), seafoam green (#A7F3D0), coral pink (#FDA4AF), pearl white',
+        'materials': 'flowing silk fabrics with water-like draping, iridescent materials mimicking fish scales with realistic sheen, frosted glass with bubble texture',
+        'textures': 'rippling wave patterns with authentic light refraction, translucent fabrics with backlighting, smooth surfaces with water-droplet effects',
+        'decor': 'real seashells with natural calcium textures, preserved coral with authentic structure, underwater photography art, aquatic plant arrangements',
+        'lighting': 'soft blue-tinted ambient (5000K cool daylight filtered), rippling light patterns projected on surfaces, gentle luminescence mimicking bioluminescence',
+        'mood': 'tranquil, flowing, serene - photographed with underwater cinematography aesthetic',
+        'photography': 'soft focus with dreamy bokeh, blue color grading, gentle light diffusion mimicking water'
+    },
+    'spiderman': {
+        'colors': 'vibrant web-red (#DC2626), electric blue (#3B82F6), black web patterns (#000000)',
+        'materials': 'textured fabrics mimicking spider silk with dimensional weave, urban industrial materials, glossy comic-style finishes with realistic printing',
+        'textures': 'web patterns with 3D embossing, street art with spray paint texture, athletic mesh materials',
+        'decor': 'NYC skyline photography with authentic urban grit, comic panel art with print texture, web-patterned textiles with actual thread work',
+        'lighting': 'dynamic urban lighting (4000K), dramatic shadows from web patterns, cityscape ambient glow',
+        'mood': 'dynamic, youthful, urban - shot with action photography energy',
+        'photography': 'high-energy composition, urban photography style, vibrant but realistic colors'
+    },
+    'harry potter': {
+        'colors': 'Gryffindor burgundy (#7F1D1D), antique gold (#B45309), aged parchment (#F5F1E8), dark magical purple (#581C87)',
+        'materials': 'aged leather with authentic wear patterns, vintage wood with centuries of patina, brass with genuine tarnish, weathered parchment textures',
+        'textures': 'old book bindings with embossed gold lettering showing age, wax seal impressions, stone castle walls with moss',
+        'decor': 'antique potion bottles with realistic glass imperfections, spell books with aged pages, Hogwarts house banners with fabric texture, owl feathers with natural structure',
+        'lighting': 'warm candlelight glow (1800K), fireplace ambient warmth, mysterious shadows in corners, golden hour through gothic windows',
+        'mood': 'magical, mystical, historic - photographed like museum collection pieces',
+        'photography': 'warm vintage color grading, soft focus on backgrounds, film grain for aged photograph aesthetic'
+    },
+    'star wars': {
+        'colors': 'space black (#09090B), brushed metallic silver (#71717A), electric blue lightsaber glow (#3B82F6), laser red (#DC2626)',
+        'materials': 'brushed aluminum spacecraft panels with rivets, holographic displays with realistic projection, aged leather flight gear',
+        'textures': 'worn spaceship interior panels with use marks, control panel buttons with tactile depth, alien metal alloys with sci-fi but realistic finish',
+        'decor': 'lightsaber wall mounts with authentic hilt details, galactic map displays with screen glow, spaceship blueprints with technical accuracy',
+        'lighting': 'cool LED accent lights (6500K), lightsaber glow with realistic bloom, spacecraft cockpit ambient lighting, dramatic rim lighting',
+        'mood': 'futuristic, galactic, adventurous - shot with sci-fi cinematography techniques',
+        'photography': 'anamorphic lens flares, cool color grading, controlled dramatic lighting'
+    },
+    'minecraft': {
+        'colors': 'grass block green (#10B981), dirt brown (#92400E), stone grey (#6B7280), diamond blue (#3B82F6) - with pixelated transitions',
+        'materials': 'cubic furniture with smooth edges but blocky aesthetic, pixel art tapestries with visible squares, wood with cubic grain patterns',
+        'textures': '16x16 pixel patterns scaled large, blocky textures with clean edges, crafting table wood grain in pixel style',
+        'decor': 'framed pixel art with actual LED backlight pixels, cube storage systems, block-styled decorative items with realistic materials',
+        'lighting': 'bright even lighting mimicking game world (4500K), torchlight warm glow from actual sources, subtle ambient occlusion between blocks',
+        'mood': 'playful, creative, gaming-inspired - photographed as real-world implementation of game aesthetic',
+        'photography': 'sharp focus, even lighting, vibrant colors with slight desaturation for realism'
+    },
+    'disney': {
+        'colors': 'fairy tale pink (#FCA5A5), enchanted purple (#C084FC), castle blue (#60A5FA), magical gold (#FCD34D)',
+        'materials': 'soft whimsical fabrics with gentle sheen, pearl-like finishes with iridescence, velvet with direction pile showing luxury',
+        'textures': 'princess-quality silk with natural luster, tulle with visible netting, sparkle finishes with micro-glitter texture',
+        'decor': 'castle-inspired wall art with dimensional elements, character artwork with professional printing, crown and tiara displays with genuine metalwork',
+        'lighting': 'soft dreamy lighting (3000K warm), gentle fairy light twinkle with bokeh, magical glow effects achieved with colored gels',
+        'mood': 'magical, whimsical, enchanting - photographed like high-end princess suite',
+        'photography': 'soft focus with dreamy quality, warm color grading, gentle highlights for magical feel'
+    },
+    'jungle': {
+        'colors': 'lush jungle green (#065F46), earthy brown (#78350F), vibrant tropical flower colors (#F472B6, #FB923C), natural vine tones',
+        'materials': 'natural bamboo with authentic nodes and grain, woven rattan with organic texture, raw wood with bark elements, natural fiber textiles',
+        'textures': 'large tropical leaf patterns with realistic veining, rough tree bark textures, woven natural fibers with visible weave',
+        'decor': 'live tropical plants with realistic leaf structure, animal print textiles with genuine pattern accuracy, wooden tribal masks with carved detail',
+        'lighting': 'dappled forest light through foliage (4500K natural), warm ambient glow (2800K), dramatic shadows from plants',
+        'mood': 'wild, natural, tropical - photographed like National Geographic interior',
+        'photography': 'rich color saturation, dramatic natural lighting, depth created with layered foliage'
+    },
+    'cyberpunk': {
+        'colors': 'neon pink (#EC4899) with glow, electric cyan (#06B6D4), toxic green (#84CC16), deep purple (#7C3AED), metallic chrome',
+        'materials': 'brushed metal panels with holographic overlays, LED-embedded surfaces with actual light emission, reflective chrome with distorted reflections',
+        'textures': 'digital screen textures with visible pixels, neon tube lighting with realistic glow and reflections, carbon fiber with authentic weave',
+        'decor': 'actual LED neon signs with realistic glow bloom, digital art displays with screen texture, holographic elements with proper transparency',
+        'lighting': 'strong neon color casting on surfaces, colored rim lighting (various K temps), dramatic shadows with colored fill light',
+        'mood': 'futuristic, high-tech, dystopian - shot with Blade Runner cinematography style',
+        'photography': 'high contrast, neon color grading with bloom effects, wet surface reflections, film grain for gritty feel'
+    },
+    'retro': {
+        'colors': 'vintage orange (#FB923C), mustard yellow (#FDE047), avocado green (#84CC16), burnt sienna (#DC2626), cream (#FEF3C7)',
+        'materials': 'wood grain laminate with authentic period patterns, shag carpet with dimensional pile texture, vintage plastic with slight yellowing from age',
+        'textures': 'bold geometric wallpaper with period-accurate printing, textured ceiling with popcorn finish, vinyl upholstery with authentic grain',
+        'decor': 'vintage rotary phone with plastic patina, retro appliances with authentic brand logos, period posters with aged paper texture',
+        'lighting': 'warm incandescent glow (2700K), vintage lamp shades with period materials, natural light through period curtains',
+        'mood': 'nostalgic, vintage, throwback - photographed like 1970s home magazines',
+        'photography': 'slight vintage color shift, warm color temperature, subtle film grain, slightly softened focus'
+    },
+    'steampunk': {
+        'colors': 'aged brass (#B45309), copper patina (#92400E), industrial grey (#52525B), Victorian burgundy (#7F1D1D), weathered bronze',
+        'materials': 'actual brass gears with machining marks, riveted metal plates with authentic joining, aged leather with strap buckles, polished wood with brass inlays',
+        'textures': 'exposed gear mechanisms with realistic metal finish, leather with embossing and age cracks, wood with Victorian carving detail',
+        'decor': 'functional-looking pressure gauges with glass faces, vintage brass instruments with patina, clockwork mechanisms with visible movement',
+        'lighting': 'warm Edison bulb glow (2200K amber), brass lamp fixtures with authentic metalwork, dramatic shadows from mechanical elements',
+        'mood': 'Victorian industrial, mechanical, steam-powered - photographed like museum industrial artifacts',
+        'photography': 'warm sepia-toned color grade, emphasis on metallic textures with controlled highlights, dramatic side lighting to show dimension'
+    }
+}
+
+
+# Extra phrases that select a theme (the theme key itself always matches)
+THEME_SYNONYMS = {
+    'superman': ['man of steel', 'krypton'],
+    'batman': ['gotham', 'dark knight', 'batcave'],
+    'underwater': ['under the sea', 'ocean floor', 'mermaid', 'aquarium'],
+    'spiderman': ['spider man', 'spidey', 'peter parker'],
+    'harry potter': ['hogwarts', 'wizarding world', 'gryffindor', 'slytherin'],
+    'star wars': ['jedi', 'lightsaber', 'death star', 'millennium falcon'],
+    'minecraft': ['creeper', 'pixel blocks'],
+    'disney': ['pixar', 'mickey mouse', 'fairy tale castle'],
+    'jungle': ['rainforest', 'safari', 'tropical forest'],
+    'cyberpunk': ['neon city', 'blade runner'],
+    'retro': ['70s', '1970s', 'seventies', 'mid century'],
+    'steampunk': ['clockwork', 'victorian industrial', 'brass gears'],
+}
+
+# Keyword groups for the legacy detect_theme_from_custom_prompt
+LEGACY_THEME_KEYWORDS = {
+    'space': ['galaxy', 'cosmic', 'star', 'planet'],
+    'tropical': ['palm', 'beach', 'island'],
+    'forest': ['woodland', 'nature', 'botanical'],
+    'ocean': ['sea', 'nautical', 'marine'],
+}
+
+def _tokens(text):
+    """Casefolded words in any script ('Spider-Man' -> ['spider', 'man'], 'समुद्र थीम' -> two words)"""
+    words, word = [], []
+    for char in text.casefold():
+        # \w alone would split 'समुद्र' at its vowel signs - combining marks stay in their word
+        # (but never start one, so emoji variation selectors are not words)
+        if char.isalnum() or (word and unicodedata.category(char).startswith('M')):
+            word.append(char)
+        elif word:
+            words.append(''.join(word))
+            word = []
+    if word:
+        words.append(''.join(word))
+    return words
+
+
+def _stem(token):
+    """Light suffix stripping - enough to fold plurals and -ing/-ed forms of theme words"""
+    if len(token) <= 3 or token.isdigit():
+        return token
+    if token.endswith('ies') and len(token) > 4:
+        return token[:-3] + 'y'
+    for suffix in ('ing', 'ed'):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+            return token[:-len(suffix)]
+    if token.endswith(('ches', 'shes', 'xes', 'sses')):
+        return token[:-2]
+    if token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+        return token[:-1]
+    return token
+
+
+class ThemeMatcher:
+    """
+    Phrase index built once at import: every theme name and synonym is stored
+    under its stemmed tokens joined without separators ('Spider-Man', 'spider man'
+    and 'spiderman' all become 'spiderman'; 'jungles' finds 'jungle'). Matching tokenizes the prompt once and
+    looks up each 1..N word window in a dict, so cost depends on prompt length,
+    not on how many themes exist.
+    """
+
+    def __init__(self, phrases_by_theme, name_weight=2, synonym_weight=1):
+        self.order = {theme: i for i, theme in enumerate(phrases_by_theme)}
+        self._phrases = {}  # joined tokens -> (theme, weight)
+        self.max_words = 1
+        for theme, phrases in phrases_by_theme.items():
+            for phrase, weight in [(theme, name_weight)] + [(p, synonym_weight) for p in phrases]:
+                words = [_stem(word) for word in _tokens(phrase)]
+                self._phrases.setdefault(''.join(words), (theme, weight))
+                self.max_words = max(self.max_words, len(words))
+
+    def scores(self, text):
+        """theme -> summed weight of every phrase occurrence (longest phrase wins at each position)"""
+        words = [_stem(word) for word in _tokens(text)]
+        scores = {}
+        i = 0
+        while i < len(words):
+            for n in range(min(self.max_words, len(words) - i), 0, -1):
+                hit = self._phrases.get(''.join(words[i:i + n]))
+                if hit:
+                    theme, weight = hit
+                    scores[theme] = scores.get(theme, 0) + weight
+                    i += n
+                    break
+            else:
+                i += 1
+        return scores
+
+    def best(self, text):
+        """(theme, score) with the highest score (ties go to the earlier theme), or (None, 0)"""
+        scores = self.scores(text)
+        if not scores:
+            return None, 0
+        theme = max(scores, key=lambda t: (scores[t], -self.order[t]))
+        return theme, scores[theme]
+
+
+THEME_MATCHER = ThemeMatcher({theme: THEME_SYNONYMS.get(theme, []) for theme in THEME_MAPPINGS})
+LEGACY_THEME_MATCHER = ThemeMatcher(LEGACY_THEME_KEYWORDS)
+
+
+def match_theme(custom_theme):
+    """Best known theme for a free-text custom prompt: (theme_key, score) or (None, 0)"""
+    return THEME_MATCHER.best(custom_theme)
+
+
 def extract_theme_elements(custom_theme):
     """
     Extract photorealistic visual elements from custom theme
     Enhanced with professional photography details
     """
-    theme_lower = custom_theme.lower()
-    
-    # Photorealistic theme mappings
-    theme_mappings = {
-        'superman': {
-            'colors': 'bold primary red (#DC2626), royal blue (#1E40AF), bright yellow (#FBBF24) - colors with realistic fabric texture',
-            'materials': 'smooth heroic surfaces with subtle sheen, brushed metallic accents resembling actual superhero costume materials, cape-like silk fabrics with natural draping',
-            'textures': 'satin finish with light reflectivity, embossed S-shield patterns with dimensional depth, comic book art with authentic print texture',
-            'decor': 'framed vintage comic covers with paper texture, collectible figures with realistic plastic finish, movie posters with authentic printing',
-            'lighting': 'dramatic heroic lighting with strong key light (3500K), rim lighting creating subtle edge glow, shadows suggesting power',
-            'mood': 'heroic, powerful, inspiring - photographed like high-end collectibles showcase',
-            'photography': 'shot with dramatic lighting setup mimicking superhero movie poster style, vibrant but realistic color grading'
-        },
-        'batman': {
-            'colors': 'matte black (#0A0A0A), charcoal grey (#374151), tactical yellow (#EAB308), midnight blue (#1E3A8A)',
-            'materials': 'genuine leather textures with age marks, industrial brushed metals with subtle scratches, dark matte surfaces with slight reflectivity',
-            'textures': 'distressed leather with natural creasing, carbon fiber patterns, weathered metal with authentic patina',
-            'decor': 'bat symbol metal wall art with dimensional casting, framed Gotham noir photography, tactical equipment displays with realistic materials',
-            'lighting': 'moody low-key lighting (2200K warm shadows, 4000K cool highlights), dramatic shadows suggesting vigilante atmosphere, subtle backlight creating depth',
-            'mood': 'dark, mysterious, sophisticated - shot with noir cinematography techniques',
-            'photography': 'low-key photography with controlled shadows, film noir aesthetic, professional dark mood lighting'
-        },
-        'underwater': {
-            'colors': 'deep ocean blue gradient (#0C4A6E to #075985), turquoise (#14B8A6), seafoam green (#A7F3D0), coral pink (#FDA4AF), pearl white',
-            'materials': 'flowing silk fabrics with water-like draping, iridescent materials mimicking fish scales with realistic sheen, frosted glass with bubble texture',
-            'textures': 'rippling wave patterns with authentic light refraction, translucent fabrics with backlighting, smooth surfaces with water-droplet effects',
-            'decor': 'real seashells with natural calcium textures, preserved coral with authentic structure, underwater photography art, aquatic plant arrangements',
-            'lighting': 'soft blue-tinted ambient (5000K cool daylight filtered), rippling light patterns projected on surfaces, gentle luminescence mimicking bioluminescence',
-            'mood': 'tranquil, flowing, serene - photographed with underwater cinematography aesthetic',
-            'photography': 'soft focus with dreamy bokeh, blue color grading, gentle light diffusion mimicking water'
-        },
-        'spiderman': {
-            'colors': 'vibrant web-red (#DC2626), electric blue (#3B82F6), black web patterns (#000000)',
-            'materials': 'textured fabrics mimicking spider silk with dimensional weave, urban industrial materials, glossy comic-style finishes with realistic printing',
-            'textures': 'web patterns with 3D embossing, street art with spray paint texture, athletic mesh materials',
-            'decor': 'NYC skyline photography with authentic urban grit, comic panel art with print texture, web-patterned textiles with actual thread work',
-            'lighting': 'dynamic urban lighting (4000K), dramatic shadows from web patterns, cityscape ambient glow',
-            'mood': 'dynamic, youthful, urban - shot with action photography energy',
-            'photography': 'high-energy composition, urban photography style, vibrant but realistic colors'
-        },
-        'harry potter': {
-            'colors': 'Gryffindor burgundy (#7F1D1D), antique gold (#B45309), aged parchment (#F5F1E8), dark magical purple (#581C87)',
-            'materials': 'aged leather with authentic wear patterns, vintage wood with centuries of patina, brass with genuine tarnish, weathered parchment textures',
-            'textures': 'old book bindings with embossed gold lettering showing age, wax seal impressions, stone castle walls with moss',
-            'decor': 'antique potion bottles with realistic glass imperfections, spell books with aged pages, Hogwarts house banners with fabric texture, owl feathers with natural structure',
-            'lighting': 'warm candlelight glow (1800K), fireplace ambient warmth, mysterious shadows in corners, golden hour through gothic windows',
-            'mood': 'magical, mystical, historic - photographed like museum collection pieces',
-            'photography': 'warm vintage color grading, soft focus on backgrounds, film grain for aged photograph aesthetic'
-        },
-        'star wars': {
-            'colors': 'space black (#09090B), brushed metallic silver (#71717A), electric blue lightsaber glow (#3B82F6), laser red (#DC2626)',
-            'materials': 'brushed aluminum spacecraft panels with rivets, holographic displays with realistic projection, aged leather flight gear',
-            'textures': 'worn spaceship interior panels with use marks, control panel buttons with tactile depth, alien metal alloys with sci-fi but realistic finish',
-            'decor': 'lightsaber wall mounts with authentic hilt details, galactic map displays with screen glow, spaceship blueprints with technical accuracy',
-            'lighting': 'cool LED accent lights (6500K), lightsaber glow with realistic bloom, spacecraft cockpit ambient lighting, dramatic rim lighting',
-            'mood': 'futuristic, galactic, adventurous - shot with sci-fi cinematography techniques',
-            'photography': 'anamorphic lens flares, cool color grading, controlled dramatic lighting'
-        },
-        'minecraft': {
-            'colors': 'grass block green (#10B981), dirt brown (#92400E), stone grey (#6B7280), diamond blue (#3B82F6) - with pixelated transitions',
-            'materials': 'cubic furniture with smooth edges but blocky aesthetic, pixel art tapestries with visible squares, wood with cubic grain patterns',
-            'textures': '16x16 pixel patterns scaled large, blocky textures with clean edges, crafting table wood grain in pixel style',
-            'decor': 'framed pixel art with actual LED backlight pixels, cube storage systems, block-styled decorative items with realistic materials',
-            'lighting': 'bright even lighting mimicking game world (4500K), torchlight warm glow from actual sources, subtle ambient occlusion between blocks',
-            'mood': 'playful, creative, gaming-inspired - photographed as real-world implementation of game aesthetic',
-            'photography': 'sharp focus, even lighting, vibrant colors with slight desaturation for realism'
-        },
-        'disney': {
-            'colors': 'fairy tale pink (#FCA5A5), enchanted purple (#C084FC), castle blue (#60A5FA), magical gold (#FCD34D)',
-            'materials': 'soft whimsical fabrics with gentle sheen, pearl-like finishes with iridescence, velvet with direction pile showing luxury',
-            'textures': 'princess-quality silk with natural luster, tulle with visible netting, sparkle finishes with micro-glitter texture',
-            'decor': 'castle-inspired wall art with dimensional elements, character artwork with professional printing, crown and tiara displays with genuine metalwork',
-            'lighting': 'soft dreamy lighting (3000K warm), gentle fairy light twinkle with bokeh, magical glow effects achieved with colored gels',
-            'mood': 'magical, whimsical, enchanting - photographed like high-end princess suite',
-            'photography': 'soft focus with dreamy quality, warm color grading, gentle highlights for magical feel'
-        },
-        'jungle': {
-            'colors': 'lush jungle green (#065F46), earthy brown (#78350F), vibrant tropical flower colors (#F472B6, #FB923C), natural vine tones',
-            'materials': 'natural bamboo with authentic nodes and grain, woven rattan with organic texture, raw wood with bark elements, natural fiber textiles',
-            'textures': 'large tropical leaf patterns with realistic veining, rough tree bark textures, woven natural fibers with visible weave',
-            'decor': 'live tropical plants with realistic leaf structure, animal print textiles with genuine pattern accuracy, wooden tribal masks with carved detail',
-            'lighting': 'dappled forest light through foliage (4500K natural), warm ambient glow (2800K), dramatic shadows from plants',
-            'mood': 'wild, natural, tropical - photographed like National Geographic interior',
-            'photography': 'rich color saturation, dramatic natural lighting, depth created with layered foliage'
-        },
-        'cyberpunk': {
-            'colors': 'neon pink (#EC4899) with glow, electric cyan (#06B6D4), toxic green (#84CC16), deep purple (#7C3AED), metallic chrome',
-            'materials': 'brushed metal panels with holographic overlays, LED-embedded surfaces with actual light emission, reflective chrome with distorted reflections',
-            'textures': 'digital screen textures with visible pixels, neon tube lighting with realistic glow and reflections, carbon fiber with authentic weave',
-            'decor': 'actual LED neon signs with realistic glow bloom, digital art displays with screen texture, holographic elements with proper transparency',
-            'lighting': 'strong neon color casting on surfaces, colored rim lighting (various K temps), dramatic shadows with colored fill light',
-            'mood': 'futuristic, high-tech, dystopian - shot with Blade Runner cinematography style',
-            'photography': 'high contrast, neon color grading with bloom effects, wet surface reflections, film grain for gritty feel'
-        },
-        'retro': {
-            'colors': 'vintage orange (#FB923C), mustard yellow (#FDE047), avocado green (#84CC16), burnt sienna (#DC2626), cream (#FEF3C7)',
-            'materials': 'wood grain laminate with authentic period patterns, shag carpet with dimensional pile texture, vintage plastic with slight yellowing from age',
-            'textures': 'bold geometric wallpaper with period-accurate printing, textured ceiling with popcorn finish, vinyl upholstery with authentic grain',
-            'decor': 'vintage rotary phone with plastic patina, retro appliances with authentic brand logos, period posters with aged paper texture',
-            'lighting': 'warm incandescent glow (2700K), vintage lamp shades with period materials, natural light through period curtains',
-            'mood': 'nostalgic, vintage, throwback - photographed like 1970s home magazines',
-            'photography': 'slight vintage color shift, warm color temperature, subtle film grain, slightly softened focus'
-        },
-        'steampunk': {
-            'colors': 'aged brass (#B45309), copper patina (#92400E), industrial grey (#52525B), Victorian burgundy (#7F1D1D), weathered bronze',
-            'materials': 'actual brass gears with machining marks, riveted metal plates with authentic joining, aged leather with strap buckles, polished wood with brass inlays',
-            'textures': 'exposed gear mechanisms with realistic metal finish, leather with embossing and age cracks, wood with Victorian carving detail',
-            'decor': 'functional-looking pressure gauges with glass faces, vintage brass instruments with patina, clockwork mechanisms with visible movement',
-            'lighting': 'warm Edison bulb glow (2200K amber), brass lamp fixtures with authentic metalwork, dramatic shadows from mechanical elements',
-            'mood': 'Victorian industrial, mechanical, steam-powered - photographed like museum industrial artifacts',
-            'photography': 'warm sepia-toned color grade, emphasis on metallic textures with controlled highlights, dramatic side lighting to show dimension'
-        }
-    }
-    
-    # Check for matches
-    for key, elements in theme_mappings.items():
-        if key in theme_lower:
-            return elements
+    theme, _ = match_theme(custom_theme)
+    if theme:
+        return THEME_MAPPINGS[theme]
     
     # Generic theme with photorealism
     return {
@@ -1011,22 +1120,175 @@ def construct_fixed_layout_prompt(room_type, style=None, custom_prompt=None):
 
 def detect_theme_from_custom_prompt(custom_prompt):
     """Legacy theme detection"""
-    prompt_lower = custom_prompt.lower()
-    
-    theme_keywords = {
-        'space': ['space', 'galaxy', 'cosmic', 'star', 'planet'],
-        'tropical': ['tropical', 'palm', 'beach', 'island'],
-        'forest': ['forest', 'woodland', 'nature', 'botanical'],
-        'ocean': ['ocean', 'sea', 'nautical', 'marine'],
-    }
-    
-    for theme, keywords in theme_keywords.items():
-        if any(keyword in prompt_lower for keyword in keywords):
-            return theme, custom_prompt
-    
-    return None, custom_prompt
+    theme, _ = LEGACY_THEME_MATCHER.best(custom_prompt)
+    return theme, custom_prompt
 
 
 def deconstruct_theme_to_realistic_elements(custom_prompt):
     """Legacy function"""
-    return extract_theme_elements(custom_prompt)
\ No newline at end of file
+    return extract_theme_elements(custom_prompt)
+
+# ============================================================
+# COMPILED PROMPTS (final model input, precomputed)
+# ============================================================
+
+# Longest base prompt sent to Replicate (the flow suffix is appended after this)
+PROMPT_CHAR_BUDGET = 800
+CUSTOM_PROMPT_CACHE_SIZE = 1024
+
+# Blocks of the prompt templates, most important first. Lower-priority blocks
+# are dropped (or trimmed to whole lines) when the prompt exceeds the budget.
+SECTION_PRIORITIES = (
+    'PHOTOREALISTIC',
+    'PRESERVE EXACTLY',
+    'Transform only',
+    'APPLY',
+    'PHOTOGRAPHY SPECIFICATIONS',
+    'CRITICAL PHOTOREALISM',
+)
+
+_STRIP_CHARS = str.maketrans('', '', '⚠✅❌🔒🏗🪑🎨📸🚫━️')
+
+
+def normalize_prompt(prompt):
+    """Strip decorative emoji/rules and collapse whitespace into a single line"""
+    return " ".join(prompt.translate(_STRIP_CHARS).split())
+
+
+def _split_sections(prompt):
+    """Blank-line separated blocks; a header-only block ('APPLY ...:') is merged into the block after it"""
+    blocks = [b.strip() for b in prompt.split('\n\n') if b.strip()]
+    sections = []
+    pending_header = None
+    for block in blocks:
+        if pending_header:
+            block = f"{pending_header}\n{block}"
+            pending_header = None
+        if block.endswith(':') and '\n' not in block:
+            pending_header = block
+            continue
+        sections.append(block)
+    if pending_header:
+        sections.append(pending_header)
+    return sections
+
+
+def _section_priority(section):
+    for rank, prefix in enumerate(SECTION_PRIORITIES):
+        if section.startswith(prefix):
+            return rank
+    return len(SECTION_PRIORITIES)
+
+
+def truncate_at_boundary(text, budget=PROMPT_CHAR_BUDGET):
+    """Cut flat text at the last sentence or clause boundary that fits"""
+    if len(text) <= budget:
+        return text
+    head = text[:budget]
+    for separator in ('. ', ', ', ' '):
+        cut = head.rfind(separator)
+        if cut > budget // 2:
+            return head[:cut].rstrip(' ,.')
+    return head
+
+
+def fit_prompt_to_budget(prompt, budget=PROMPT_CHAR_BUDGET):
+    """
+    Normalize a sectioned template prompt and fit it into budget characters.
+    Whole sections are kept in priority order; the first section that does not
+    fit contributes whole lines only, so nothing is cut mid-clause.
+    """
+    sections = _split_sections(prompt)
+    chosen = {}
+    used = 0
+    for index in sorted(range(len(sections)), key=lambda i: (_section_priority(sections[i]), i)):
+        text = normalize_prompt(sections[index])
+        cost = len(text) + (1 if chosen else 0)
+        if used + cost <= budget:
+            chosen[index] = text
+            used += cost
+            continue
+
+        # Partial section: header line plus as many complete lines as fit
+        lines = [normalize_prompt(line) for line in sections[index].split('\n') if line.strip()]
+        kept = []
+        for line in lines:
+            cost = len(line) + 1
+            if used + cost > budget:
+                break
+            kept.append(line)
+            used += cost
+        if len(kept) > 1 or (kept and len(lines) == 1):
+            chosen[index] = " ".join(kept)
+        elif kept:
+            used -= len(kept[0]) + 1  # a lone header line says nothing - give the space back
+
+    fitted = " ".join(chosen[i] for i in sorted(chosen))
+    return truncate_at_boundary(fitted, budget)
+
+
+def _compile_style_prompts():
+    """Final prompt for every (room, style) - style-based requests never build prompts at runtime"""
+    return {
+        (room_type, style): fit_prompt_to_budget(construct_style_transformation_prompt(room_type, style))
+        for room_type in FIXED_ROOM_LAYOUTS
+        for style in INTERIOR_STYLES
+    }
+
+
+COMPILED_STYLE_PROMPTS = _compile_style_prompts()
+
+
+@lru_cache(maxsize=CUSTOM_PROMPT_CACHE_SIZE)
+def _compile_custom_prompt(room_type, custom_theme):
+    return fit_prompt_to_budget(construct_custom_theme_prompt(room_type, custom_theme)['prompt'])
+
+
+def compile_prompt(room_type, style=None, custom_prompt=None):
+    """
+    Final, budget-fitted prompt for the model.
+    Precomputed for predefined styles, memoized for custom themes.
+    """
+    if custom_prompt and custom_prompt.strip():
+        return _compile_custom_prompt(room_type, custom_prompt.strip())
+
+    compiled = COMPILED_STYLE_PROMPTS.get((room_type, style))
+    if compiled is None:
+        compiled = fit_prompt_to_budget(construct_style_transformation_prompt(room_type, style))
+    return compiled
+
+# ============================================================
+# CACHE KEYS FOR CUSTOM THEMES
+# ============================================================
+
+# Words that change the wording of a request but not the design asked for
+CACHE_KEY_STOPWORDS = frozenset({
+    'a', 'an', 'the', 'and', 'or', 'of', 'in', 'on', 'for', 'with', 'to', 'by', 'at', 'as',
+    'my', 'me', 'i', 'we', 'our', 'please', 'want', 'like', 'make', 'it', 'this', 'some',
+    'lot', 'lots', 'very', 'really', 'full', 'all',
+    'theme', 'themed', 'style', 'styled', 'inspired', 'look', 'vibe', 'design', 'decor', 'room',
+})
+
+
+def _key_words(custom_prompt):
+    """Stems of the meaningful words, in prompt order"""
+    return [_stem(t) for t in _tokens(custom_prompt) if t not in CACHE_KEY_STOPWORDS]
+
+
+def cache_key_tokens(custom_prompt):
+    """
+    Sorted, de-duplicated stems of the meaningful words ('Batman-themed!' -> ('batman',)).
+    Order is dropped on purpose - this is the token set for near-duplicate lookup, not the cache key.
+    """
+    return tuple(sorted(set(_key_words(custom_prompt))))
+
+
+def normalize_cache_prompt(custom_prompt):
+    """
+    Cache key text for a custom theme: meaningful stems in their original order, so
+    'red sofa with blue walls' and 'blue sofa with red walls' stay different designs.
+    Falls back to every word when all are stopwords, and to the casefolded,
+    whitespace-collapsed prompt when it has no words at all (emoji-only prompts).
+    """
+    words = _key_words(custom_prompt) or _tokens(custom_prompt)
+    return " ".join(words) if words else " ".join(custom_prompt.casefold().split())
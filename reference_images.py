@@ -0,0 +1,292 @@
+"""
+reference_images.py — Precomputed reference image store
+Every (client, room) reference is transcoded WebP -> RGB PNG once, written to
+an on-disk cache (PNG and its base64) named by the source file's content hash,
+and both files are memory-mapped, so gunicorn workers on the same host share
+the page cache instead of each decoding and holding its own copy. The base64
+string is only materialized for the call that needs it (data-URI fallback,
+room preview). Lookups only stat() the source file and rebuild the entry if
+it changed.
+
+Each reference is also uploaded once to Cloudinary (re-uploaded only when the
+source changes) so predictions can send Replicate a URL instead of a
+multi-megabyte data URI.
+"""
+
+import os
+import io
+import json
+import mmap
+import base64
+import hashlib
+import logging
+import threading
+from PIL import Image
+
+from config import BASE_DIR, ROOM_IMAGES, CLIENT_ROOM_IMAGES
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_CACHE_DIR = os.getenv(
+    'REFERENCE_CACHE_DIR',
+    os.path.join(BASE_DIR, '.cache', 'reference_images')
+)
+
+# (client_name, room_type) -> asset dict, see _load_asset()
+_store = {}
+_store_lock = threading.Lock()
+
+
+def resolve_reference_path(room_type, client_name='skyline'):
+    """Map (room, client) to the source image path, falling back to the default images"""
+    if client_name and client_name != 'default':
+        filename_map = CLIENT_ROOM_IMAGES.get(client_name)
+        if filename_map is None:
+            logger.error(f"Unknown client: {client_name}")
+            return None
+
+        filename = filename_map.get(room_type)
+        if not filename:
+            logger.error(f"No filename mapping for {room_type} in {client_name}")
+            return None
+
+        image_path = os.path.join(BASE_DIR, 'images', client_name, filename)
+        if not os.path.exists(image_path):
+            logger.warning(f"Client image not found: {image_path}, falling back to default")
+            image_path = ROOM_IMAGES.get(room_type)
+        return image_path
+
+    if room_type not in ROOM_IMAGES:
+        logger.error(f"No reference image found for {room_type}")
+        return None
+    return ROOM_IMAGES[room_type]
+
+
+def _transcode_to_png(image_path):
+    """Decode any Pillow-readable image, flatten alpha onto white and encode as PNG bytes"""
+    img = Image.open(image_path)
+
+    # Convert RGBA to RGB if needed
+    if img.mode == 'RGBA':
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[3])
+        img = background
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    img_byte_arr = io.BytesIO()
+    img.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
+
+def _map_file(path):
+    """Read-only memory map of a cache file"""
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _write_atomic(path, data):
+    """Write via temp file + rename so concurrent workers never see a partial file"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _load_asset(client_name, room_type, image_path):
+    """Build (or map an existing) precompiled cache entry for one reference image"""
+    stat = os.stat(image_path)
+    with open(image_path, 'rb') as f:
+        source_hash = hashlib.sha256(f.read()).hexdigest()
+
+    stem = os.path.join(REFERENCE_CACHE_DIR, f"{client_name}_{room_type}_{source_hash[:16]}")
+    png_path, b64_path = f"{stem}.png", f"{stem}.b64"
+
+    try:
+        if not (os.path.exists(png_path) and os.path.exists(b64_path)):
+            png_bytes = _transcode_to_png(image_path)
+            os.makedirs(REFERENCE_CACHE_DIR, exist_ok=True)
+            _write_atomic(png_path, png_bytes)
+            _write_atomic(b64_path, base64.b64encode(png_bytes))
+            logger.info(f"[REFERENCE] Precompiled {client_name}/{room_type} ({len(png_bytes)} bytes)")
+
+        png_map = _map_file(png_path)
+        b64_map = _map_file(b64_path)
+    except OSError as e:
+        # Read-only filesystem (e.g. serverless) - keep a private in-memory copy instead
+        logger.warning(f"[REFERENCE] Disk cache unavailable ({e}) - holding {client_name}/{room_type} in memory")
+        png_map = _transcode_to_png(image_path)
+        b64_map = base64.b64encode(png_map)
+
+    return {
+        'client_name': client_name,
+        'room_type': room_type,
+        'source_path': image_path,
+        'source_mtime': stat.st_mtime,
+        'source_size': stat.st_size,
+        'source_hash': source_hash,
+        'png': png_map,
+        'png_size': len(png_map),
+        'base64': b64_map  # ASCII bytes (mapped file, or bytes on a read-only filesystem)
+    }
+
+
+def get_reference_asset(room_type, client_name='skyline'):
+    """
+    Return the prepared asset for (room, client), or None if there is no reference.
+    Rebuilt only when the source file's mtime or size changes.
+    """
+    image_path = resolve_reference_path(room_type, client_name)
+    if not image_path or not os.path.exists(image_path):
+        logger.error(f"Reference image not found at path: {image_path}")
+        return None
+
+    key = (client_name or 'default', room_type)
+    stat = os.stat(image_path)
+    asset = _store.get(key)
+    if (asset and asset['source_path'] == image_path
+            and asset['source_mtime'] == stat.st_mtime
+            and asset['source_size'] == stat.st_size):
+        return asset
+
+    with _store_lock:
+        asset = _load_asset(key[0], room_type, image_path)
+        _store[key] = asset
+    return asset
+
+
+def get_reference_base64(room_type, client_name='skyline'):
+    """Base64 PNG of the reference image, ready to embed in a data URI (a fresh str per call - don't keep it)"""
+    asset = get_reference_asset(room_type, client_name)
+    return asset['base64'][:].decode('ascii') if asset else None
+
+
+def build_reference_store():
+    """Prepare every configured (client, room) reference at startup"""
+    prepared = 0
+    for client_name, filename_map in CLIENT_ROOM_IMAGES.items():
+        for room_type in filename_map:
+            try:
+                if get_reference_asset(room_type, client_name):
+                    prepared += 1
+            except Exception as e:
+                logger.error(f"[REFERENCE] ❌ Failed to prepare {client_name}/{room_type}: {e}")
+    logger.info(f"[REFERENCE] ✅ {prepared} reference image(s) ready")
+    return prepared
+
+
+def get_reference_stats():
+    """Summary for the health endpoint"""
+    with _store_lock:
+        stats = {
+            'assets': len(_store),
+            'png_bytes': sum(a['png_size'] for a in _store.values())
+        }
+    with _uploads_lock:
+        stats['hosted'] = len(_uploads or {})
+    return stats
+
+
+# ============================================================
+# HOSTED REFERENCE URLS (upload once, send Replicate a URL)
+# ============================================================
+
+REFERENCE_UPLOAD_FOLDER = os.getenv('REFERENCE_UPLOAD_FOLDER', 'reference')
+_UPLOAD_MANIFEST_PATH = os.path.join(REFERENCE_CACHE_DIR, 'uploads.json')
+
+# "client/room" -> {'source_hash': str, 'url': str}
+_uploads = None
+_uploads_lock = threading.Lock()
+
+
+def _load_upload_manifest():
+    """Read the manifest of previously uploaded references (caller holds the lock)"""
+    global _uploads
+    if _uploads is None:
+        try:
+            with open(_UPLOAD_MANIFEST_PATH) as f:
+                _uploads = json.load(f)
+        except (OSError, ValueError):
+            _uploads = {}
+    return _uploads
+
+
+def _save_upload_manifest():
+    """Persist the manifest so restarts don't re-upload (caller holds the lock)"""
+    try:
+        os.makedirs(REFERENCE_CACHE_DIR, exist_ok=True)
+        _write_atomic(_UPLOAD_MANIFEST_PATH, json.dumps(_uploads, indent=2).encode())
+    except OSError as e:
+        # Read-only filesystem - the in-memory manifest still serves this process
+        logger.warning(f"[REFERENCE] Could not persist upload manifest ({e}) - keeping it in memory")
+
+
+def _upload_reference(asset):
+    """Upload the precompiled PNG to Cloudinary under a content-addressed public_id"""
+    import cloudinary.uploader
+
+    public_id = f"{asset['client_name']}/{asset['room_type']}_{asset['source_hash'][:16]}"
+    result = cloudinary.uploader.upload(
+        io.BytesIO(asset['png']),
+        folder=REFERENCE_UPLOAD_FOLDER,
+        public_id=public_id,
+        overwrite=False,
+        resource_type='image'
+    )
+    return result['secure_url']
+
+
+def ensure_reference_uploaded(room_type, client_name='skyline'):
+    """
+    Upload the reference once per source version and return its hosted URL.
+    Returns None when Cloudinary is not configured or the upload fails.
+    """
+    import cloudinary
+    if not cloudinary.config().cloud_name:
+        return None
+
+    asset = get_reference_asset(room_type, client_name)
+    if not asset:
+        return None
+
+    key = f"{asset['client_name']}/{room_type}"
+    with _uploads_lock:
+        entry = _load_upload_manifest().get(key)
+        if entry and entry['source_hash'] == asset['source_hash']:
+            return entry['url']
+
+    try:
+        url = _upload_reference(asset)
+    except Exception as e:
+        logger.error(f"[REFERENCE] ❌ Upload failed for {key}: {e}")
+        return None
+
+    with _uploads_lock:
+        _load_upload_manifest()[key] = {'source_hash': asset['source_hash'], 'url': url}
+        _save_upload_manifest()
+    logger.info(f"[REFERENCE] ✅ Uploaded {key}: {url}")
+    return url
+
+
+def get_reference_image_url(room_type, client_name='skyline'):
+    """Hosted URL for the current version of the reference, or None (caller falls back to a data URI)"""
+    asset = get_reference_asset(room_type, client_name)
+    if not asset:
+        return None
+
+    with _uploads_lock:
+        entry = _load_upload_manifest().get(f"{asset['client_name']}/{room_type}")
+    if entry and entry['source_hash'] == asset['source_hash']:
+        return entry['url']
+    return None
+
+
+def sync_reference_uploads():
+    """Make sure every configured reference is hosted - run once at startup, off the request path"""
+    uploaded = 0
+    for client_name, filename_map in CLIENT_ROOM_IMAGES.items():
+        for room_type in filename_map:
+            if ensure_reference_uploaded(room_type, client_name):
+                uploaded += 1
+    logger.info(f"[REFERENCE] {uploaded} reference image(s) hosted")
+    return uploaded
@@ -0,0 +1,156 @@
+"""
+replicate_webhooks.py — Signed Replicate webhook receiver
+Flow: prediction created with webhook=REPLICATE_WEBHOOK_URL -> Replicate POSTs
+      /api/replicate/webhook on completion -> signature verified -> waiting
+      generation thread is woken with the prediction payload.
+Generations fall back to polling when no webhook arrives before the deadline.
+"""
+
+from flask import Blueprint, request, jsonify
+import os
+import hmac
+import time
+import base64
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+replicate_webhook_bp = Blueprint('replicate_webhook', __name__, url_prefix='/api/replicate')
+
+# Public URL of the route below, e.g. https://api.example.com/api/replicate/webhook
+REPLICATE_WEBHOOK_URL = os.getenv('REPLICATE_WEBHOOK_URL')
+# Signing secret from GET /v1/webhooks/default/secret (format: whsec_<base64>)
+REPLICATE_WEBHOOK_SECRET = os.getenv('REPLICATE_WEBHOOK_SECRET')
+# Seconds to wait for the webhook before falling back to polling
+REPLICATE_WEBHOOK_DEADLINE = float(os.getenv('REPLICATE_WEBHOOK_DEADLINE', '60'))
+
+SIGNATURE_TOLERANCE_SECONDS = 300  # reject replays older than 5 minutes
+UNCLAIMED_TTL_SECONDS = 600        # webhooks that nobody waited for
+
+TERMINAL_STATUSES = ('succeeded', 'failed', 'canceled')
+
+# prediction_id -> {'event': Event, 'payload': dict|None, 'created_at': float}
+_waiters = {}
+_waiters_lock = threading.Lock()
+
+if REPLICATE_WEBHOOK_URL and REPLICATE_WEBHOOK_SECRET:
+    logger.info("[WEBHOOK] Replicate webhook mode enabled")
+elif REPLICATE_WEBHOOK_URL:
+    logger.warning("[WEBHOOK] REPLICATE_WEBHOOK_SECRET not set - webhook mode disabled, polling only")
+
+
+def webhooks_enabled():
+    """Webhook mode needs both a public callback URL and a signing secret"""
+    return bool(REPLICATE_WEBHOOK_URL and REPLICATE_WEBHOOK_SECRET)
+
+
+def verify_signature(headers, body):
+    """
+    Verify Replicate's webhook signature.
+    Signed content is "{webhook-id}.{webhook-timestamp}.{body}", HMAC-SHA256
+    with the base64 part of the whsec_ secret, sent as "v1,<base64>" entries.
+    """
+    if not REPLICATE_WEBHOOK_SECRET:
+        return False
+
+    webhook_id = headers.get('webhook-id')
+    timestamp = headers.get('webhook-timestamp')
+    signatures = headers.get('webhook-signature')
+    if not webhook_id or not timestamp or not signatures:
+        return False
+
+    try:
+        if abs(time.time() - int(timestamp)) > SIGNATURE_TOLERANCE_SECONDS:
+            logger.warning("[WEBHOOK] Timestamp outside tolerance")
+            return False
+        secret = base64.b64decode(REPLICATE_WEBHOOK_SECRET.split('_', 1)[-1])
+    except (ValueError, TypeError):
+        return False
+
+    signed_content = f"{webhook_id}.{timestamp}.".encode() + body
+    expected = base64.b64encode(hmac.new(secret, signed_content, hashlib.sha256).digest()).decode()
+
+    for entry in signatures.split():
+        version, _, signature = entry.partition(',')
+        if version == 'v1' and hmac.compare_digest(signature, expected):
+            return True
+    return False
+
+
+def _prune_unclaimed():
+    """Drop completed entries nobody claimed (caller holds the lock)"""
+    cutoff = time.time() - UNCLAIMED_TTL_SECONDS
+    stale = [pid for pid, w in _waiters.items() if w['created_at'] < cutoff]
+    for pid in stale:
+        del _waiters[pid]
+
+
+def _get_or_create_waiter(prediction_id):
+    """Caller holds the lock"""
+    waiter = _waiters.get(prediction_id)
+    if waiter is None:
+        waiter = {'event': threading.Event(), 'payload': None, 'created_at': time.time()}
+        _waiters[prediction_id] = waiter
+    return waiter
+
+
+def register_prediction(prediction_id):
+    """Start tracking a prediction; safe even if its webhook already arrived"""
+    with _waiters_lock:
+        _prune_unclaimed()
+        _get_or_create_waiter(prediction_id)
+
+
+def complete_prediction(payload):
+    """Record a terminal prediction payload and wake its waiter. Returns True if terminal."""
+    prediction_id = payload.get('id')
+    if not prediction_id or payload.get('status') not in TERMINAL_STATUSES:
+        return False
+
+    with _waiters_lock:
+        waiter = _get_or_create_waiter(prediction_id)
+        waiter['payload'] = payload
+        waiter['event'].set()
+    return True
+
+
+def wait_for_prediction(prediction_id, timeout):
+    """Block until the prediction's webhook arrives. Returns the payload, or None on timeout."""
+    with _waiters_lock:
+        waiter = _get_or_create_waiter(prediction_id)
+
+    waiter['event'].wait(timeout)
+
+    with _waiters_lock:
+        _waiters.pop(prediction_id, None)
+    return waiter['payload']
+
+
+def discard_prediction(prediction_id):
+    """Stop tracking a prediction (e.g. it was resolved by polling)"""
+    with _waiters_lock:
+        _waiters.pop(prediction_id, None)
+
+
+# ============================================================
+# POST /api/replicate/webhook
+# ============================================================
+
+@replicate_webhook_bp.route('/webhook', methods=['POST'])
+def replicate_webhook():
+    body = request.get_data()
+
+    if not verify_signature(request.headers, body):
+        logger.warning("[WEBHOOK] ❌ Invalid signature")
+        return jsonify({'error': 'Invalid signature'}), 401
+
+    payload = request.get_json(silent=True) or {}
+    prediction_id = payload.get('id', '')
+
+    if complete_prediction(payload):
+        logger.info(f"[WEBHOOK] ✅ Prediction {prediction_id[:12]} {payload.get('status')}")
+    else:
+        logger.info(f"[WEBHOOK] Ignored non-terminal event for {prediction_id[:12]} ({payload.get('status')})")
+
+    return jsonify({'success': True}), 200
@@ -0,0 +1,58 @@
+"""
+single_flight.py — Coalesce identical in-flight work
+The first caller for a key runs the function; concurrent callers with the same
+key wait on the same Future and receive its result (or exception), so a burst
+of identical room+style requests costs one Replicate prediction.
+"""
+
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls by key"""
+
+    def __init__(self, name='single_flight'):
+        self.name = name
+        self._calls = {}  # key -> Future
+        self._lock = threading.Lock()
+        self._stats = {'leaders': 0, 'coalesced': 0}
+
+    def do(self, key, fn, timeout=None):
+        """
+        Run fn() once per key among concurrent callers.
+
+        Returns:
+            (result, shared) - shared is True when this caller reused another caller's result
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self._stats['leaders'] += 1
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            logger.info(f"[{self.name.upper()}] ⚡ Joined in-flight call for {key}")
+            return future.result(timeout=timeout), True
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'in_flight': len(self._calls)}
@@ -0,0 +1,170 @@
+"""
+variant_pool.py — Pre-generated design variants per (client, room, style)
+Style-based requests only vary by client x room x style, so a background
+manager keeps up to VARIANT_POOL_DEPTH finished variants ready for each
+combination. A request pops one (served in milliseconds, never shown twice)
+and the pool schedules a replacement off the request path.
+
+Refills cost real Replicate predictions, so the pool is off unless
+VARIANT_POOL_ENABLED is set, and refill throughput is capped by both worker
+count and VARIANT_POOL_REFILLS_PER_MINUTE.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+VARIANT_POOL_ENABLED = os.getenv('VARIANT_POOL_ENABLED', 'false').lower() == 'true'
+VARIANT_POOL_DEPTH = int(os.getenv('VARIANT_POOL_DEPTH', '2'))
+# Outputs requested per refill prediction (one prediction can fill several slots)
+VARIANT_POOL_BATCH = int(os.getenv('VARIANT_POOL_BATCH', '2'))
+VARIANT_POOL_REFILL_WORKERS = int(os.getenv('VARIANT_POOL_REFILL_WORKERS', '1'))
+VARIANT_POOL_REFILLS_PER_MINUTE = float(os.getenv('VARIANT_POOL_REFILLS_PER_MINUTE', '6'))
+VARIANT_POOL_CHECK_INTERVAL = int(os.getenv('VARIANT_POOL_CHECK_INTERVAL', '300'))
+VARIANT_POOL_MAX_BYTES = int(float(os.getenv('VARIANT_POOL_MAX_MB', '256')) * 1024 * 1024)
+# Comma-separated subset of styles to pre-generate (empty = every style)
+VARIANT_POOL_STYLES = [s.strip() for s in os.getenv('VARIANT_POOL_STYLES', '').split(',') if s.strip()]
+
+
+class VariantPool:
+    """
+    Bounded per-key queues of ready variants plus a rate-limited refill executor.
+
+    generate_fn(key, count) must return up to count [(metadata, image_bytes)], or [] on failure.
+    """
+
+    def __init__(self, generate_fn, keys, depth=VARIANT_POOL_DEPTH, batch=VARIANT_POOL_BATCH,
+                 workers=VARIANT_POOL_REFILL_WORKERS,
+                 refills_per_minute=VARIANT_POOL_REFILLS_PER_MINUTE,
+                 max_bytes=VARIANT_POOL_MAX_BYTES):
+        self.generate_fn = generate_fn
+        self.keys = list(keys)
+        self.depth = depth
+        self.batch = max(1, batch)
+        self.max_bytes = max_bytes
+        self._min_interval = 60.0 / refills_per_minute if refills_per_minute > 0 else 0.0
+        self._next_slot = 0.0
+        self._pools = {key: deque() for key in self.keys}
+        self._pending = set()  # keys with a refill queued or running
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='variant-pool')
+        self._started = False
+        self._stats = {'served': 0, 'misses': 0, 'refills': 0, 'refill_failures': 0}
+
+    def take(self, key):
+        """Pop a ready variant for key, or None; either way a refill is scheduled"""
+        if key not in self._pools:
+            return None
+
+        with self._lock:
+            pool = self._pools[key]
+            if pool:
+                metadata, image_bytes = pool.popleft()
+                self._bytes -= len(image_bytes)
+                self._stats['served'] += 1
+                variant = (metadata, image_bytes)
+            else:
+                self._stats['misses'] += 1
+                variant = None
+
+        self._schedule(key)
+        return variant
+
+    def _needs_refill(self, key):
+        """Caller holds the lock"""
+        return len(self._pools[key]) < self.depth and self._bytes < self.max_bytes
+
+    def _schedule(self, key):
+        """Queue one refill task per under-filled key"""
+        if not self._started:
+            return
+        with self._lock:
+            if key in self._pending or not self._needs_refill(key):
+                return
+            self._pending.add(key)
+        self._executor.submit(self._refill, key)
+
+    def _wait_for_slot(self):
+        """Space refills at least _min_interval apart across all workers"""
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _refill(self, key):
+        """Generate variants for key until it is back at depth (or a generation fails)"""
+        try:
+            while True:
+                with self._lock:
+                    if not self._needs_refill(key):
+                        return
+                    count = min(self.batch, self.depth - len(self._pools[key]))
+                self._wait_for_slot()
+
+                try:
+                    variants = self.generate_fn(key, count)
+                except Exception as e:
+                    logger.error(f"[VARIANT POOL] ❌ Refill crashed for {key}: {e}")
+                    variants = []
+
+                with self._lock:
+                    if not variants:
+                        self._stats['refill_failures'] += 1
+                        return
+                    for metadata, image_bytes in variants[:self.depth - len(self._pools[key])]:
+                        self._pools[key].append((metadata, image_bytes))
+                        self._bytes += len(image_bytes)
+                        self._stats['refills'] += 1
+                    ready = len(self._pools[key])
+                logger.info(f"[VARIANT POOL] ✅ Refilled {key} ({ready}/{self.depth})")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def start(self):
+        """Fill every key in the background and re-check periodically (after failed refills)"""
+        if self._started:
+            return
+        self._started = True
+
+        def run():
+            while True:
+                for key in self.keys:
+                    self._schedule(key)
+                time.sleep(VARIANT_POOL_CHECK_INTERVAL)
+
+        threading.Thread(target=run, daemon=True, name='variant-pool-manager').start()
+        logger.info(f"[VARIANT POOL] 🚀 Filling {len(self.keys)} combination(s) to depth {self.depth}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                'enabled': self._started,
+                'combinations': len(self.keys),
+                'depth': self.depth,
+                'batch': self.batch,
+                'ready': sum(len(pool) for pool in self._pools.values()),
+                'full': sum(1 for pool in self._pools.values() if len(pool) >= self.depth),
+                'refilling': len(self._pending),
+                'bytes': self._bytes
+            }
+
+
+def pool_keys(client_room_images, styles):
+    """Every (client, room, style) combination the pool should keep warm"""
+    selected = [s for s in styles if not VARIANT_POOL_STYLES or s in VARIANT_POOL_STYLES]
+    return [
+        (client_name, room_type, style)
+        for client_name, filename_map in client_room_images.items()
+        for room_type in filename_map
+        for style in selected
+    ]
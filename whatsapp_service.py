@@ -2,6 +2,7 @@
 import os
 import logging
 import requests
+import http_client
 from datetime import datetime
 from supabase import Client as SupabaseClient
 
@@ -98,7 +99,7 @@ def send_whatsapp_message(phone_number, message, country_code='IN'):
         
         logger.info(f"[META WHATSAPP] Sending to {formatted_phone}")
         
-        response = requests.post(url, headers=headers, json=payload, timeout=10)
+        response = http_client.post(url, headers=headers, json=payload, timeout=10)
         
         if response.status_code == 200:
             result = response.json()